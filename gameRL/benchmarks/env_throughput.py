@@ -0,0 +1,205 @@
+# Throughput benchmarks of the blackjack simulators, compared against a stored baseline so
+# the simulator does not quietly get slower as features land
+import argparse
+import json
+import platform
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from gameRL.game_simulators.blackjack import BlackjackCustomEnv, BlackjackDeck, BlackjackHand
+from gameRL.game_simulators.blackjack_count import (
+    BlackjackEnvwithRunningCount,
+    BlackjackEnvwithTrueCount,
+)
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+# a benchmark regresses once its throughput drops this far below the baseline
+DEFAULT_THRESHOLD = 0.2
+DECKS_TO_TRY = [1, 3, 10]
+RHO_TO_TRY = [0.25, 0.75, 0.95]
+# actions drawn up front, so the random policy does not time the sampling
+N_ACTIONS = 4096
+
+
+def time_ops(run: Callable[[int], None], min_time: float = 0.5, repeat: int = 3) -> float:
+    """
+    Operations per second of run(n), which performs n operations. n grows until one run
+    takes min_time, then the best of repeat runs is reported to filter out noise
+    """
+    n = 1
+    while True:
+        start = time.perf_counter()
+        run(n)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        n *= 2 if elapsed <= 0 else max(2, min(10, int(1.2 * min_time / elapsed)))
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        run(n)
+        best = min(best, time.perf_counter() - start)
+    return n / best
+
+
+def env_steps(env, policy: str, seed: int = 0) -> Callable[[int], None]:
+    """
+    Steps env n times, resetting it whenever an episode ends. The fixed policy always sticks,
+    the random one plays uniformly random actions
+    """
+    env.seed(seed)
+    env.reset()
+    if policy == "random":
+        actions = np.random.default_rng(seed).integers(env.action_space.n, size=N_ACTIONS)
+        actions = actions.tolist()
+    else:
+        actions = [0] * N_ACTIONS
+
+    def run(n: int) -> None:
+        for i in range(n):
+            _, _, done, _ = env.step(actions[i % N_ACTIONS])
+            if done:
+                env.reset()
+
+    return run
+
+
+def deck_draws(N_decks: int) -> Callable[[int], None]:
+    deck = BlackjackDeck(N_decks, np_random=np.random.default_rng(0))
+    size = len(deck.deck)
+
+    def run(n: int) -> None:
+        for i in range(n):
+            if deck.cursor == size:
+                # deal the same shoe again, so shuffling is not timed
+                deck.cursor = 0
+            deck.draw_card()
+
+    return run
+
+
+def hand_sums() -> Callable[[int], None]:
+    hand = BlackjackHand(BlackjackDeck(1, np_random=np.random.default_rng(0)), 21)
+
+    def run(n: int) -> None:
+        for _ in range(n):
+            hand.sum_hand()
+
+    return run
+
+
+def env_resets(env) -> Callable[[int], None]:
+    env.seed(0)
+
+    def run(n: int) -> None:
+        for _ in range(n):
+            env.reset()
+
+    return run
+
+
+def env_redeals(env: BlackjackEnvwithRunningCount) -> Callable[[int], None]:
+    env.seed(0)
+    env.reset()
+
+    def run(n: int) -> None:
+        for _ in range(n):
+            env.redeal()
+            if env.reshuffled:
+                env.reset()
+
+    return run
+
+
+def get_benchmarks() -> Dict[str, Callable[[], Callable[[int], None]]]:
+    """Constructors of the run function of every benchmark, by benchmark name"""
+    benchmarks = {}
+    for policy in ["fixed", "random"]:
+        benchmarks[f"step/custom/{policy}"] = \
+            lambda policy=policy: env_steps(BlackjackCustomEnv(3), policy)
+        benchmarks[f"step/running_count/{policy}"] = \
+            lambda policy=policy: env_steps(BlackjackEnvwithRunningCount(3, rho=0.75), policy)
+        benchmarks[f"step/true_count/{policy}"] = \
+            lambda policy=policy: env_steps(BlackjackEnvwithTrueCount(3, rho=0.75), policy)
+    for N_decks in DECKS_TO_TRY:
+        for rho in RHO_TO_TRY:
+            benchmarks[f"step/running_count/random/nd_{N_decks}_rho_{rho}"] = \
+                lambda N_decks=N_decks, rho=rho: env_steps(
+                    BlackjackEnvwithRunningCount(N_decks, rho=rho), "random")
+        benchmarks[f"deck/draw_card/nd_{N_decks}"] = \
+            lambda N_decks=N_decks: deck_draws(N_decks)
+        benchmarks[f"reset/custom/nd_{N_decks}"] = \
+            lambda N_decks=N_decks: env_resets(BlackjackCustomEnv(N_decks))
+        benchmarks[f"reset/running_count/nd_{N_decks}"] = \
+            lambda N_decks=N_decks: env_resets(BlackjackEnvwithRunningCount(N_decks))
+    benchmarks["hand/sum_hand"] = hand_sums
+    benchmarks["redeal/running_count"] = \
+        lambda: env_redeals(BlackjackEnvwithRunningCount(3, rho=0.75, allow_observe=False))
+    return benchmarks
+
+
+def run_benchmarks(pattern: str = "", min_time: float = 0.5, repeat: int = 3) -> Dict:
+    """
+    Runs every benchmark whose name contains pattern
+    :return: operations per second of each benchmark, with the machine they were measured on
+    """
+    results = {}
+    for name, make_run in get_benchmarks().items():
+        if pattern in name:
+            results[name] = time_ops(make_run(), min_time, repeat)
+            print(f"{name:50s} {results[name]:14,.0f} ops/s")
+    return {"results": results, "python": platform.python_version(),
+            "numpy": np.__version__, "machine": platform.machine(), "time": time.time()}
+
+
+def find_regressions(results: Dict[str, float], baseline: Dict[str, float],
+                     threshold: float = DEFAULT_THRESHOLD) -> Dict[str, float]:
+    """
+    Benchmarks whose throughput dropped more than threshold below the baseline. Benchmarks
+    missing from either side are not compared
+    :return: the ratio of each regressed benchmark's throughput to its baseline
+    """
+    ratios = {name: results[name] / baseline[name] for name in results if name in baseline}
+    return {name: ratio for name, ratio in ratios.items() if ratio < 1 - threshold}
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Throughput benchmarks of the simulators")
+    parser.add_argument("--filter", default="", help="only run benchmarks containing this")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="fraction of baseline throughput that may be lost")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store these results as the new baseline")
+    parser.add_argument("--require-baseline", action="store_true",
+                        help="fail when there is no baseline to compare against, e.g. in CI")
+    parser.add_argument("--min-time", type=float, default=0.5,
+                        help="seconds each timed run of a benchmark takes at least")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.filter, args.min_time)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        return 0
+    if not Path(args.baseline).exists():
+        print(f"No baseline at {args.baseline}, run with --save-baseline to store one")
+        return 1 if args.require_baseline else 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    regressions = find_regressions(report["results"], baseline, args.threshold)
+    for name, ratio in regressions.items():
+        print(f"REGRESSION {name}: {ratio:.0%} of baseline throughput")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,67 +5,177 @@ Also, the github version draws with replacement, while I modified to not use rep
 
 Also, reference here for how to play blackjack
 """
-from typing import Dict, List, Tuple
+import functools
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
 
 import gym
 import numpy as np
 from gym import spaces
 from gym.utils import seeding
 
+try:
+    from stable_baselines.common.vec_env import VecEnv
+except ImportError:  # stable-baselines is only needed to train on VecBlackjackEnv
+    VecEnv = object
+
 SUITS = 4
 CARD_VALUES = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10]
 DEALER_MAX = 17
 
 
+def spawn_seeds(
+    seed: Union[None, int, np.random.SeedSequence], n_streams: int
+) -> List[np.random.SeedSequence]:
+    """
+    Spawns independent, non-overlapping seed sequences for n_streams envs, e.g. one per
+    worker process. Pass each child to env.seed() so no two envs deal the same shoes
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(n_streams)
+
+
+def state_indices(
+    obs: np.ndarray, dims: Tuple[int, ...], offsets: Tuple[int, ...]
+) -> np.ndarray:
+    """
+    State index of each row of obs, components shifted up by offsets and raveled in dims,
+    see BlackjackCustomEnv.get_state_layout. Components outside their dimension, like hand
+    sums past a bust, are clamped to its smallest or largest value
+    """
+    state = np.clip(np.asarray(obs, dtype=np.int64) + np.asarray(offsets), 0,
+                    np.asarray(dims) - 1)
+    return np.ravel_multi_index(tuple(np.moveaxis(state, -1, 0)), dims)
+
+
+@functools.lru_cache(maxsize=None)
+def shoe_template(N_decks: int) -> np.ndarray:
+    """The unshuffled cards of a shoe of N_decks decks, read only, which shoes refill from"""
+    template = np.array(CARD_VALUES * SUITS * N_decks, dtype=np.int8)
+    template.flags.writeable = False
+    return template
+
+
 class BlackjackDeck:
-    def __init__(self, N_decks: int, with_replacement=False):
+    __slots__ = ("N_decks", "with_replacement", "np_random", "deck", "cursor")
+
+    def __init__(
+        self,
+        N_decks: int,
+        with_replacement=False,
+        np_random: Optional[np.random.Generator] = None,
+    ):
         self.N_decks = N_decks
-        self.deck = CARD_VALUES.copy() * SUITS * N_decks
         self.with_replacement = with_replacement
+        self.np_random = np_random if np_random is not None else np.random.default_rng()
+        # the shoe is shuffled once and then dealt from a cursor, so each draw is O(1)
+        self.deck = shoe_template(N_decks).copy()
+        self.cursor = 0
+        self.shuffle()
+
+    def refill(self) -> None:
+        """
+        Puts every card back and shuffles the shoe in place, dealing the same cards a new
+        shoe would without allocating one
+        """
+        np.copyto(self.deck, shoe_template(self.N_decks))
+        self.shuffle()
+
+    def shuffle(self) -> None:
+        """Shuffles the full shoe and moves the cursor back to the top"""
+        self.np_random.shuffle(self.deck)
+        self.cursor = 0
 
     def draw_card(self) -> int:
         """Draws and returns card from the deck"""
-        index = np.random.randint(len(self.deck))
         if self.with_replacement:
-            return self.deck[index]
-        return self.deck.pop(index)
+            return int(self.deck[self.np_random.integers(len(self.deck))])
+        card = self.deck[self.cursor]
+        self.cursor += 1
+        return int(card)
+
+    def get_state(self) -> Tuple:
+        """The shoe and its cursor, see BlackjackCustomEnv.snapshot"""
+        return self.deck.copy(), self.cursor
+
+    def set_state(self, state: Tuple) -> None:
+        deck, self.cursor = state[:2]
+        np.copyto(self.deck, deck)
+
+    def cards_remaining(self) -> int:
+        if self.with_replacement:
+            return len(self.deck)
+        return len(self.deck) - self.cursor
 
     def is_empty(self) -> bool:
-        return not len(self.deck)
+        return not self.cards_remaining()
 
 
 class BlackjackHand:
+    # the hard total and ace count are kept up to date on every draw so that
+    # every query below is O(1) instead of re-scanning the hand
+    __slots__ = ("max_hand_sum", "blackjack_deck", "hand", "hard_total", "num_aces")
+
     def __init__(self, blackjack_deck: BlackjackDeck, max_hand_sum: int = None):
         self.max_hand_sum = max_hand_sum
         self.blackjack_deck: BlackjackDeck = blackjack_deck
         self.hand: List[int] = []
+        self.hard_total = 0
+        self.num_aces = 0
         self._initial_draw()
 
+    def _add_card(self, card: int):
+        self.hand.append(card)
+        self.hard_total += card
+        if card == 1:
+            self.num_aces += 1
+
     def draw_card(self):
-        self.hand.append(self.blackjack_deck.draw_card())
+        self._add_card(self.blackjack_deck.draw_card())
 
     def _initial_draw(self):
-        self.hand = []
+        self.hand.clear()
+        self.hard_total = 0
+        self.num_aces = 0
         for _ in range(2):
             self.draw_card()
 
+    def get_state(self) -> Tuple:
+        return tuple(self.hand), self.hard_total, self.num_aces
+
+    def set_state(self, state: Tuple) -> None:
+        hand, self.hard_total, self.num_aces = state[:3]
+        self.hand[:] = hand
+
+    @classmethod
+    def from_state(cls, blackjack_deck: BlackjackDeck, max_hand_sum: int, state: Tuple):
+        """Hand restored from get_state, built without drawing from blackjack_deck"""
+        hand = cls.__new__(cls)
+        hand.blackjack_deck = blackjack_deck
+        hand.max_hand_sum = max_hand_sum
+        hand.hand = []
+        hand.set_state(state)
+        return hand
+
     def has_usable_ace(self) -> bool:
-        return 1 in self.hand and sum(self.hand) + 10 <= self.max_hand_sum
+        return self.num_aces > 0 and self.hard_total + 10 <= self.max_hand_sum
 
     def sum_hand(self) -> int:
         if self.has_usable_ace():
-            return sum(self.hand) + 10
-        return sum(self.hand)
+            return self.hard_total + 10
+        return self.hard_total
 
     def is_bust(self) -> bool:
-        return sum(self.hand) > self.max_hand_sum
+        return self.hard_total > self.max_hand_sum
 
     def score(self) -> int:
         return 0 if self.is_bust() else self.sum_hand()
 
     def is_natural(self) -> bool:
         """The optimal blackjack hand, eq"""
-        return sorted(self.hand) == [1, 10]
+        # an ace plus a ten-valued card is the only two card hand with one ace and a hard 11
+        return len(self.hand) == 2 and self.num_aces == 1 and self.hard_total == 11
 
     def __str__(self) -> str:
         return f"Hand={self.hand}  Score={self.score()}"
@@ -81,9 +191,86 @@ class BlackjackHand:
         return self.hand_size == 2
 
 
+class EnvStats:
+    """
+    Counters of an env built with instrument=True. Envs without them pay a single None check
+    per step. Counts of shoes that were already refilled or replaced are kept here, the shoe
+    in play is read off its cursor
+    """
+
+    TIMED = ("step", "reset", "redeal")
+
+    def __init__(self, n_actions: int):
+        self.action_counts = np.zeros(n_actions, dtype=np.int64)
+        self.cards_drawn = 0
+        self.shoes = 0
+        self.reshuffles = 0
+        self.hands = 0
+        self.dealer_draws = 0
+        self.calls = dict.fromkeys(self.TIMED, 0)
+        self.seconds = dict.fromkeys(self.TIMED, 0.0)
+        self.deck: Optional[BlackjackDeck] = None
+
+    def timed(self, method: Callable, name: str) -> Callable:
+        """Wraps method to add the time spent in it to seconds[name]"""
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.seconds[name] += time.perf_counter() - start
+                self.calls[name] += 1
+
+        return wrapper
+
+    def new_shoe(self, deck: BlackjackDeck) -> None:
+        """Called before deck is dealt afresh, which may be the shoe in play about to refill"""
+        if self.deck is not None:
+            self.cards_drawn += self.deck.cursor
+        self.deck = deck
+        self.shoes += 1
+
+    def end_hand(self, dealer: BlackjackHand) -> None:
+        self.hands += 1
+        # a reshuffle can cut the dealer's deal short, leaving fewer than the two cards dealt
+        self.dealer_draws += max(dealer.hand_size - 2, 0)
+
+    def as_dict(self) -> Dict[str, float]:
+        stats = {
+            "cards_drawn": self.cards_drawn + (self.deck.cursor if self.deck is not None else 0),
+            "shoes": self.shoes,
+            "reshuffles": self.reshuffles,
+            "hands": self.hands,
+            "hands_per_shoe": self.hands / max(self.shoes, 1),
+            "dealer_draws_per_hand": self.dealer_draws / max(self.hands, 1),
+        }
+        total_actions = max(self.action_counts.sum(), 1)
+        for action, count in enumerate(self.action_counts):
+            stats[f"action_{action}_frequency"] = count / total_actions
+        for name in self.TIMED:
+            stats[f"{name}_calls"] = self.calls[name]
+            stats[f"{name}_seconds"] = self.seconds[name]
+        return stats
+
+
+class EnvSnapshot(NamedTuple):
+    """
+    Compact state of an env, see BlackjackCustomEnv.snapshot: the shoe state, the state of
+    each hand (None for a hand not in play), env flags and the deck generator state
+    """
+
+    deck: Tuple
+    hands: Tuple
+    flags: Tuple
+    rng_state: Dict
+
+
 class BlackjackCustomEnv(gym.Env):
     def __init__(self, N_decks: int, natural_bonus: bool = True, max_hand_sum: int = 21,
-                 simple_game: bool = False):
+                 simple_game: bool = False, instrument: bool = False, flat_obs: bool = False,
+                 array_obs: bool = False):
         # actions: either "hit" (keep playing) or "stand" (stop where you are)
         self.max_hand_sum = max_hand_sum
 
@@ -91,6 +278,9 @@ class BlackjackCustomEnv(gym.Env):
         self.action_space = spaces.Discrete(2 if simple_game else 3)
 
         self.observation_space = spaces.MultiDiscrete([32, 11, 2])
+        # a hand sum is at most max_hand_sum plus the ten that busts it
+        self._init_flat_obs(flat_obs, [max_hand_sum + 11, 11, 2], [0, 0, 0])
+        self._init_obs_buffer(array_obs)
 
         self.N_decks = N_decks
         self.seed()
@@ -98,14 +288,99 @@ class BlackjackCustomEnv(gym.Env):
         # Flag to payout 1.5 on a "natural" blackjack win, like casino rules
         # Ref: http://www.bicyclecards.com/how-to-play/blackjack/
         self.natural_bonus = natural_bonus
+        self._instrument(instrument)
         # start the first game
         self.reset()
 
+    def _instrument(self, instrument: bool) -> None:
+        """
+        With instrument, keeps EnvStats counters, copied into info["stats"], and times step,
+        reset and redeal by shadowing them with timed wrappers on this instance, so envs
+        without instrumentation run the plain methods
+        """
+        self.stats: Optional[EnvStats] = None
+        if not instrument:
+            return
+        self.stats = EnvStats(self.action_space.n)
+        for name in EnvStats.TIMED:
+            if hasattr(self, name):
+                setattr(self, name, self.stats.timed(getattr(self, name), name))
+
+    def _init_flat_obs(self, flat_obs: bool, dims: List[int], offsets: List[int]) -> None:
+        """
+        Sets up the state index of observations whose components, shifted up by offsets, lie
+        in [0, dims). With flat_obs, observations are that index, in Discrete(n_states)
+        """
+        self._flat_obs = flat_obs
+        self._state_dims = tuple(dims)
+        self._state_offsets = np.array(offsets, dtype=np.int64)
+        # plain ints, so the index built in _get_obs is a plain int too
+        self._state_strides = tuple(int(np.prod(dims[i + 1:])) for i in range(len(dims)))
+        if flat_obs:
+            self.observation_space = spaces.Discrete(self.n_states)
+
+    def _init_obs_buffer(self, array_obs: bool) -> None:
+        """
+        With array_obs, observations are written in place into one array matching
+        observation_space, which every step and reset returns instead of a new tuple
+        """
+        self._obs_buffer: Optional[np.ndarray] = None
+        if array_obs:
+            space = self.observation_space
+            self.set_obs_buffer(np.zeros(space.shape, dtype=space.dtype))
+
+    def set_obs_buffer(self, buffer: np.ndarray) -> None:
+        """
+        Writes observations into buffer from now on, e.g. a row of the caller's batch of
+        observations. Each step overwrites the array the last one returned, so copy an
+        observation to keep it
+        """
+        space = self.observation_space
+        if buffer.shape != space.shape or buffer.dtype != space.dtype:
+            raise ValueError(f"Observation buffer must have shape {space.shape} and dtype "
+                             f"{space.dtype}, got {buffer.shape} and {buffer.dtype}")
+        self._obs_buffer = buffer
+
+    @property
+    def n_states(self) -> int:
+        return int(np.prod(self._state_dims))
+
+    def get_state_layout(self) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+        """Size and offset of each observation component in the state index"""
+        return self._state_dims, tuple(self._state_offsets.tolist())
+
+    def state_index(self, obs) -> int:
+        """
+        Index in [0, n_states) of a tuple observation, what the env returns with flat_obs.
+        Hand sums past a bust, reachable by hitting on in the running-count env, are
+        clamped to the largest sum
+        """
+        return int(state_indices(obs, self._state_dims, self._state_offsets))
+
+    def index_to_state(self, index: int) -> Tuple[int, ...]:
+        """Tuple observation of a state index, the inverse of state_index"""
+        state = np.array(np.unravel_index(index, self._state_dims)) - self._state_offsets
+        return tuple(state.tolist())
+
+    def get_stats(self) -> Dict[str, float]:
+        """Instrumentation counters, empty unless the env was built with instrument=True"""
+        return {} if self.stats is None else self.stats.as_dict()
+
     def render(self) -> None:
         print(f"Dealer State: {str(self.dealer)}\n Player State: {str(self.player)}")
 
     def seed(self, seed=None):
-        self.np_random, seed = seeding.np_random(seed)
+        """
+        Seeds the env. seed may be an int or a SeedSequence from spawn_seeds; the decks built
+        on the next reset draw from the resulting per-env generator
+        """
+        if isinstance(seed, np.random.SeedSequence):
+            self.deck_rng = np.random.default_rng(seed)
+            seed = int(seed.generate_state(1)[0])
+            self.np_random, seed = seeding.np_random(seed)
+        else:
+            self.np_random, seed = seeding.np_random(seed)
+            self.deck_rng = np.random.default_rng(seed)
         return [seed]
 
     def _calculate_player_reward(self) -> int:
@@ -157,11 +432,53 @@ class BlackjackCustomEnv(gym.Env):
         _, reward = self._stick()
         return True, multiplier * reward
 
+    # hands captured by snapshot, in order, and the class of a hand restored from nothing
+    _HANDS = ("dealer", "player")
+    _HAND_CLASS = BlackjackHand
+    # other attributes of the game in progress captured by snapshot
+    _FLAGS = ()
+
+    def snapshot(self) -> EnvSnapshot:
+        """
+        Compact copy of the game in progress: the shoe and its cursor, the cards and totals of
+        every hand, the flags of the game and the deck generator state, which restore() returns
+        the env to. Much cheaper than deepcopy, for search that branches from a state many
+        times. Instrumentation counters are not part of it
+        """
+        return EnvSnapshot(
+            self.blackjack_deck.get_state(),
+            tuple(None if getattr(self, name) is None else getattr(self, name).get_state()
+                  for name in self._HANDS),
+            tuple(getattr(self, name) for name in self._FLAGS),
+            self.deck_rng.bit_generator.state,
+        )
+
+    def restore(self, snapshot: EnvSnapshot) -> None:
+        """Returns the env to a snapshot, which can be restored any number of times"""
+        self.blackjack_deck.set_state(snapshot.deck)
+        for name, state in zip(self._HANDS, snapshot.hands):
+            hand = getattr(self, name)
+            if state is None:
+                setattr(self, name, None)
+            elif hand is None:
+                setattr(self, name, self._HAND_CLASS.from_state(
+                    self.blackjack_deck, self.max_hand_sum, state))
+            else:
+                hand.set_state(state)
+        for name, value in zip(self._FLAGS, snapshot.flags):
+            setattr(self, name, value)
+        self.deck_rng.bit_generator.state = snapshot.rng_state
+
     def _get_info(self) -> Dict:
-        """Return debugging info, for now just empty dictionary"""
-        return {}
+        """
+        Return debugging info, a snapshot of the instrumentation counters if there are any,
+        which later steps leave unchanged
+        """
+        if self.stats is None:
+            return {}
+        return {"stats": self.stats.as_dict()}
 
-    def step(self, action) -> Tuple[Tuple, int, bool, dict]:
+    def step(self, action) -> Tuple[Tuple, np.float32, bool, dict]:
         """Action must be in the set {0,1}"""
         assert self.action_space.contains(action)
         # player hits
@@ -173,17 +490,293 @@ class BlackjackCustomEnv(gym.Env):
             done, reward = self._double_down()
         else:
             raise ValueError("Illegal action")
-        return self._get_obs(), reward, done, {}
+        if self.stats is not None:
+            self.stats.action_counts[action] += 1
+            if done:
+                self.stats.end_hand(self.dealer)
+        # one reward dtype, rather than ints mixed with the natural's 1.5
+        return self._get_obs(), np.float32(reward), done, self._get_info()
 
     def _get_obs(self) -> Tuple[int, int, bool]:
+        buffer = self._obs_buffer
+        if self._flat_obs:
+            strides = self._state_strides
+            index = (min(self.player.sum_hand(), self._state_dims[0] - 1) * strides[0]
+                     + self.dealer.hand[0] * strides[1]
+                     + self.player.has_usable_ace())
+            if buffer is None:
+                return index
+            buffer[()] = index
+            return buffer
+        if buffer is not None:
+            buffer[0] = self.player.sum_hand()
+            buffer[1] = self.dealer.hand[0]
+            buffer[2] = self.player.has_usable_ace()
+            return buffer
         return (
             self.player.sum_hand(),
             self.dealer.hand[0],
             self.player.has_usable_ace(),
         )
 
+    def _make_shoe(self) -> BlackjackDeck:
+        return BlackjackDeck(self.N_decks, np_random=self.deck_rng)
+
+    def _shoe_fits(self, deck: BlackjackDeck) -> bool:
+        """Whether deck can be refilled for the next episode instead of making a new shoe"""
+        return deck.N_decks == self.N_decks
+
+    def _shuffle_shoe(self) -> None:
+        """
+        Deals the next episode from a full, freshly shuffled shoe. The shoe of the last
+        episode is refilled in place, so episodes only allocate when the env is built
+        """
+        deck = getattr(self, "blackjack_deck", None)
+        if deck is not None and self._shoe_fits(deck):
+            if self.stats is not None:
+                self.stats.new_shoe(deck)
+            # seed() may have replaced the generator since the shoe was made
+            deck.np_random = self.deck_rng
+            deck.refill()
+        else:
+            self.blackjack_deck = self._make_shoe()
+            if self.stats is not None:
+                self.stats.new_shoe(self.blackjack_deck)
+
+    def _deal(self, name: str) -> None:
+        """Deals a fresh hand to the hand attribute name, reusing the hand already there"""
+        hand = getattr(self, name, None)
+        if hand is None or hand.blackjack_deck is not self.blackjack_deck:
+            setattr(self, name, self._HAND_CLASS(self.blackjack_deck, self.max_hand_sum))
+        else:
+            hand._initial_draw()
+
     def reset(self) -> Tuple[int, int, bool]:
-        self.blackjack_deck: BlackjackDeck = BlackjackDeck(self.N_decks)
-        self.dealer = BlackjackHand(self.blackjack_deck, self.max_hand_sum)
-        self.player = BlackjackHand(self.blackjack_deck, self.max_hand_sum)
+        self._shuffle_shoe()
+        self._deal("dealer")
+        self._deal("player")
         return self._get_obs()
+
+
+def _usable_ace(hard_total: np.ndarray, num_aces: np.ndarray, max_hand_sum: int) -> np.ndarray:
+    return (num_aces > 0) & (hard_total + 10 <= max_hand_sum)
+
+
+def _sum_hand(hard_total: np.ndarray, num_aces: np.ndarray, max_hand_sum: int) -> np.ndarray:
+    return hard_total + 10 * _usable_ace(hard_total, num_aces, max_hand_sum)
+
+
+def _score(hard_total: np.ndarray, num_aces: np.ndarray, max_hand_sum: int) -> np.ndarray:
+    return np.where(
+        hard_total > max_hand_sum, 0, _sum_hand(hard_total, num_aces, max_hand_sum)
+    )
+
+
+class VecBlackjackShoe:
+    """
+    N independent shoes, one row of per-value card counts per table. Drawing a value in
+    proportion to the cards left of it is equivalent to dealing from a shuffled shoe
+    """
+
+    def __init__(
+        self,
+        num_shoes: int,
+        N_decks: int,
+        np_random: Optional[np.random.Generator] = None,
+    ):
+        self.N_decks = N_decks
+        # number of cards of each value 1..10 in a full shoe
+        self.full_shoe = np.bincount(CARD_VALUES, minlength=11)[1:] * SUITS * N_decks
+        self.composition = np.tile(self.full_shoe, (num_shoes, 1))
+        self.remaining = np.full(num_shoes, self.full_shoe.sum())
+        self.np_random = np_random if np_random is not None else np.random.default_rng()
+
+    def shuffle(self, idx: np.ndarray) -> None:
+        """Returns every card to the shoes in idx"""
+        self.composition[idx] = self.full_shoe
+        self.remaining[idx] = self.full_shoe.sum()
+
+    def draw_cards(self, idx: np.ndarray) -> np.ndarray:
+        """Draws one card from each shoe in idx and returns their values"""
+        position = self.np_random.random(len(idx)) * self.remaining[idx]
+        cumulative = np.cumsum(self.composition[idx], axis=1)
+        ranks = (cumulative <= position[:, None]).sum(axis=1)
+        self.composition[idx, ranks] -= 1
+        self.remaining[idx] -= 1
+        return ranks + 1
+
+
+class VecBlackjackEnv(VecEnv):
+    """
+    num_envs independent BlackjackCustomEnv tables stepped together with array operations.
+    Finished tables are reset automatically, with their final observation stored in
+    info["terminal_observation"] as stable-baselines expects
+    """
+
+    def __init__(
+        self,
+        num_envs: int,
+        N_decks: int,
+        natural_bonus: bool = True,
+        max_hand_sum: int = 21,
+        simple_game: bool = False,
+        seed=None,
+    ):
+        # same attributes VecEnv.__init__ sets
+        self.num_envs = num_envs
+        self.action_space = spaces.Discrete(2 if simple_game else 3)
+        self.observation_space = spaces.MultiDiscrete([32, 11, 2])
+
+        self.N_decks = N_decks
+        self.natural_bonus = natural_bonus
+        self.max_hand_sum = max_hand_sum
+        self._simple_game = simple_game
+
+        self.shoe = self._make_shoe()
+        self.seed(seed)
+
+        self.player_total = np.zeros(num_envs, dtype=np.int64)
+        self.player_aces = np.zeros(num_envs, dtype=np.int64)
+        self.player_cards = np.zeros(num_envs, dtype=np.int64)
+        self.dealer_total = np.zeros(num_envs, dtype=np.int64)
+        self.dealer_aces = np.zeros(num_envs, dtype=np.int64)
+        self.dealer_card = np.zeros(num_envs, dtype=np.int64)
+        self._all_tables = np.arange(num_envs)
+        self._actions = None
+
+    def _make_shoe(self) -> VecBlackjackShoe:
+        return VecBlackjackShoe(self.num_envs, self.N_decks)
+
+    def seed(self, seed=None):
+        """seed may be an int or a SeedSequence, see spawn_seeds"""
+        self.np_random = np.random.default_rng(seed)
+        self.shoe.np_random = self.np_random
+        return [seed]
+
+    def _draw_player(self, idx: np.ndarray) -> None:
+        cards = self.shoe.draw_cards(idx)
+        self.player_total[idx] += cards
+        self.player_aces[idx] += cards == 1
+        # shoes with a reshuffle point deal a 0 once they have run out
+        self.player_cards[idx] += cards > 0
+
+    def _draw_dealer(self, idx: np.ndarray) -> np.ndarray:
+        cards = self.shoe.draw_cards(idx)
+        self.dealer_total[idx] += cards
+        self.dealer_aces[idx] += cards == 1
+        return cards
+
+    def _reset_tables(self, idx: np.ndarray) -> None:
+        """Every hand is dealt from a fresh shoe, as in BlackjackCustomEnv.reset"""
+        self.shoe.shuffle(idx)
+        self.player_total[idx] = 0
+        self.player_aces[idx] = 0
+        self.player_cards[idx] = 0
+        self.dealer_total[idx] = 0
+        self.dealer_aces[idx] = 0
+        self.dealer_card[idx] = self._draw_dealer(idx)
+        self._draw_dealer(idx)
+        for _ in range(2):
+            self._draw_player(idx)
+
+    def _play_dealer(self, idx: np.ndarray) -> None:
+        """Dealer draws to DEALER_MAX on every table in idx"""
+        while len(idx):
+            idx = idx[
+                _sum_hand(self.dealer_total[idx], self.dealer_aces[idx], self.max_hand_sum)
+                < DEALER_MAX
+            ]
+            self._draw_dealer(idx)
+
+    def _calculate_player_reward(self, idx: np.ndarray) -> np.ndarray:
+        """Same payout as BlackjackCustomEnv._stick, after the dealer has played"""
+        player_sum = _score(self.player_total[idx], self.player_aces[idx], self.max_hand_sum)
+        dealer_sum = _score(self.dealer_total[idx], self.dealer_aces[idx], self.max_hand_sum)
+        reward = np.sign(player_sum - dealer_sum).astype(np.float32)
+        if self.natural_bonus:
+            natural = (
+                (self.player_cards[idx] == 2)
+                & (self.player_aces[idx] == 1)
+                & (self.player_total[idx] == 11)
+            )
+            reward[natural & (reward == 1)] = 1.5
+        return reward
+
+    def _get_obs(self) -> np.ndarray:
+        return np.stack(
+            [
+                _sum_hand(self.player_total, self.player_aces, self.max_hand_sum),
+                self.dealer_card,
+                _usable_ace(self.player_total, self.player_aces, self.max_hand_sum),
+            ],
+            axis=1,
+        ).astype(np.int64)
+
+    def reset(self) -> np.ndarray:
+        self._reset_tables(self._all_tables)
+        return self._get_obs()
+
+    def step_async(self, actions) -> None:
+        self._actions = np.asarray(actions).reshape(self.num_envs)
+
+    def step_wait(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[Dict]]:
+        actions = self._actions
+        if np.any((actions < 0) | (actions >= self.action_space.n)):
+            raise ValueError("Illegal action")
+        rewards = np.zeros(self.num_envs, dtype=np.float32)
+        dones = np.zeros(self.num_envs, dtype=bool)
+
+        # an illegal double down acts as a hit, like BlackjackCustomEnv._double_down
+        doubling = (actions == 2) & (self.player_cards == 2)
+        hitting = np.flatnonzero((actions == 1) | ((actions == 2) & ~doubling))
+        doubling = np.flatnonzero(doubling)
+
+        self._draw_player(hitting)
+        bust = self.player_total[hitting] > self.max_hand_sum
+        rewards[hitting[bust]] = -1
+        dones[hitting[bust]] = True
+
+        self._draw_player(doubling)
+        bust = self.player_total[doubling] > self.max_hand_sum
+        rewards[doubling[bust]] = -2
+        dones[doubling] = True
+
+        multiplier = np.where(actions == 2, 2, 1)
+        sticking = np.concatenate([np.flatnonzero(actions == 0), doubling[~bust]])
+        self._play_dealer(sticking)
+        rewards[sticking] = multiplier[sticking] * self._calculate_player_reward(sticking)
+        dones[sticking] = True
+
+        obs = self._get_obs()
+        infos = [{} for _ in range(self.num_envs)]
+        finished = np.flatnonzero(dones)
+        for i in finished:
+            infos[i]["terminal_observation"] = obs[i].copy()
+        self._reset_tables(finished)
+        obs[finished] = self._get_obs()[finished]
+        return obs, rewards, dones, infos
+
+    def step(self, actions) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[Dict]]:
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self) -> None:
+        pass
+
+    def _get_indices(self, indices) -> range:
+        if indices is None:
+            return range(self.num_envs)
+        if isinstance(indices, int):
+            return range(indices, indices + 1)
+        return indices
+
+    def get_attr(self, attr_name, indices=None) -> List:
+        """Tables share their settings, so every index reports the same attribute"""
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None) -> None:
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs) -> List:
+        result = getattr(self, method_name)(*method_args, **method_kwargs)
+        return [result for _ in self._get_indices(indices)]
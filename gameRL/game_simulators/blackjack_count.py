@@ -1,6 +1,7 @@
 # Created by Patrick Kao
+import functools
 import math
-from typing import Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 from gym import spaces
@@ -12,13 +13,85 @@ from gameRL.game_simulators.blackjack import (
     BlackjackHand,
     DEALER_MAX,
     BlackjackCustomEnv,
+    VecBlackjackEnv,
+    VecBlackjackShoe,
+    _sum_hand,
+    _usable_ace,
+    shoe_template,
 )
 
+# Tag of each card value in each card-counting system, indexed by the card value itself
+# (index 0 is unused, index 1 is the ace). Wong Halves is doubled to keep counts integral
+COUNTING_SYSTEMS: Dict[str, np.ndarray] = {
+    "Hi-Lo": np.array([0, -1, 1, 1, 1, 1, 1, 0, 0, 0, -1]),
+    "KO": np.array([0, -1, 1, 1, 1, 1, 1, 1, 0, 0, -1]),
+    "Hi-Opt I": np.array([0, 0, 0, 1, 1, 1, 1, 0, 0, 0, -1]),
+    "Hi-Opt II": np.array([0, 0, 1, 1, 2, 2, 1, 1, 0, 0, -2]),
+    "Omega II": np.array([0, 0, 1, 1, 2, 2, 2, 1, 0, -1, -2]),
+    "Zen": np.array([0, -1, 1, 1, 2, 2, 2, 1, 0, 0, -2]),
+    "Wong Halves": np.array([0, -2, 1, 2, 2, 3, 2, 1, 0, -1, -2]),
+}
+
+
+def get_count_tags(systems: Sequence[str]) -> np.ndarray:
+    """Stacks the tag arrays of systems into a (len(systems), 11) lookup table"""
+    for system in systems:
+        if system not in COUNTING_SYSTEMS:
+            raise ValueError(f"Unknown card-counting system {system}")
+    return np.stack([COUNTING_SYSTEMS[system] for system in systems])
+
+
+@functools.lru_cache(maxsize=None)
+def composition_template(N_decks: int) -> np.ndarray:
+    """Number of cards of each value in a full shoe, indexed by the card value, read only"""
+    template = np.bincount(shoe_template(N_decks), minlength=11)
+    template.flags.writeable = False
+    return template
+
+
+def get_count_range(system: str, N_decks: int) -> Tuple[int, int]:
+    """
+    Lowest and highest running count of system over a shoe of N_decks decks, reached by
+    dealing every card with a negative, or positive, tag first. [-20 * N_decks, 20 * N_decks]
+    for Hi-Lo, while unbalanced systems like KO reach further on one side
+    """
+    totals = get_count_tags([system])[0] * composition_template(N_decks)
+    return int(totals[totals < 0].sum()), int(totals[totals > 0].sum())
+
+
+def get_count_space(system: str, N_decks: int) -> int:
+    """Size of the count observation for system, every count get_count_range allows"""
+    low, high = get_count_range(system, N_decks)
+    return high - low + 1
+
 
 class BlackjackDeckwithCount(BlackjackDeck):
-    def __init__(self, N_decks: int, with_replacement=False, rho=1):
-        BlackjackDeck.__init__(self, N_decks, with_replacement)
-        self.count = 0
+    __slots__ = (
+        "systems",
+        "count_tags",
+        "counts",
+        "composition",
+        "rho",
+        "reshuffle_point",
+        "cards_used",
+        "reshuffled",
+    )
+
+    def __init__(
+        self,
+        N_decks: int,
+        with_replacement=False,
+        rho=1,
+        np_random: Optional[np.random.Generator] = None,
+        systems: Sequence[str] = ("Hi-Lo",),
+    ):
+        BlackjackDeck.__init__(self, N_decks, with_replacement, np_random)
+        # one running count per counting system, all updated by a single lookup per draw
+        self.systems = tuple(systems)
+        self.count_tags = get_count_tags(self.systems)
+        self.counts = np.zeros(len(self.systems), dtype=np.int64)
+        # number of cards of each value left in the shoe, indexed by the card value itself
+        self.composition = composition_template(N_decks).copy()
         self.rho = rho
         self.reshuffle_point = math.floor(
             len(CARD_VALUES) * SUITS * self.N_decks * (1 - self.rho)
@@ -30,33 +103,69 @@ class BlackjackDeckwithCount(BlackjackDeck):
         """Draws and returns card from the deck"""
         if self.reshuffled:
             return None, self.reshuffled
-        if len(self.deck) - 1 <= self.reshuffle_point:
+        if self.cards_remaining() - 1 <= self.reshuffle_point:
             self.reshuffled = True
         self.cards_used += 1
-        index = np.random.randint(len(self.deck))
-        self.count += self.update_count(self.deck[index])
-        if self.with_replacement:
-            return self.deck[index], self.reshuffled
-        return self.deck.pop(index), self.reshuffled
+        card = BlackjackDeck.draw_card(self)
+        self.counts += self.count_tags[:, card]
+        if not self.with_replacement:
+            self.composition[card] -= 1
+        return card, self.reshuffled
+
+    def refill(self) -> None:
+        BlackjackDeck.refill(self)
+        self.counts.fill(0)
+        np.copyto(self.composition, composition_template(self.N_decks))
+        self.cards_used = 0
+        self.reshuffled = False
+
+    def get_state(self) -> Tuple:
+        return (*BlackjackDeck.get_state(self), self.counts.copy(), self.composition.copy(),
+                self.cards_used, self.reshuffled)
+
+    def set_state(self, state: Tuple) -> None:
+        BlackjackDeck.set_state(self, state)
+        counts, composition, self.cards_used, self.reshuffled = state[2:]
+        np.copyto(self.counts, counts)
+        np.copyto(self.composition, composition)
 
     def update_count(self, card, system="Hi-Lo") -> int:
         """
-        Computes various card-counting systems including: Hi-Lo
+        Computes various card-counting systems, see COUNTING_SYSTEMS
         """
-        if system == "Hi-Lo":
-            if card in [2, 3, 4, 5, 6]:
-                return 1
-            elif card in [7, 8, 9]:
-                return 0
-            else:
-                return -1
+        return int(COUNTING_SYSTEMS[system][card])
+
+    @property
+    def count(self) -> int:
+        """Running count of the first counting system"""
+        return int(self.counts[0])
 
     def get_running_count(self) -> int:
         return self.count
 
+    def get_running_counts(self) -> Tuple[int, ...]:
+        """Running count of every counting system, in the order they were given"""
+        return tuple(self.counts.tolist())
+
+    def get_true_count(self) -> float:
+        """Running count of the first counting system per deck remaining in the shoe"""
+        return self.count / self.get_decks_remaining()
+
+    def get_true_counts(self) -> Tuple[float, ...]:
+        return tuple((self.counts / self.get_decks_remaining()).tolist())
+
+    def get_decks_remaining(self) -> float:
+        """Exact number of decks left in the shoe, never less than a single card"""
+        cards_per_deck = len(CARD_VALUES) * SUITS
+        return max(self.cards_remaining(), 1) / cards_per_deck
+
+    def get_composition(self) -> np.ndarray:
+        """Number of cards of each value 1..10 left in the shoe"""
+        return self.composition[1:].copy()
+
     def _get_num_decks(self) -> int:
         cards_per_deck = len(CARD_VALUES) * SUITS
-        num_decks = math.ceil(len(self.deck) / cards_per_deck)
+        num_decks = math.ceil(self.cards_remaining() / cards_per_deck)
         return num_decks
 
     def _get_cards_used(self) -> int:
@@ -67,19 +176,36 @@ class BlackjackDeckwithCount(BlackjackDeck):
 
 
 class BlackjackHandwithReshuffle(BlackjackHand):
+    __slots__ = ("reshuffled",)
+
     def __init__(self, blackjack_deck: BlackjackDeckwithCount, max_hand_sum: int = 21):
         BlackjackHand.__init__(self, blackjack_deck, max_hand_sum)
+
+    def _initial_draw(self):
+        # a hand reused from the last shoe must not carry its reshuffle over
         self.reshuffled = False
+        BlackjackHand._initial_draw(self)
+
+    def get_state(self) -> Tuple:
+        return (*BlackjackHand.get_state(self), self.reshuffled)
+
+    def set_state(self, state: Tuple) -> None:
+        BlackjackHand.set_state(self, state)
+        self.reshuffled = state[3]
 
     def draw_card(self):
         card, reshuffled = self.blackjack_deck.draw_card()
         if not reshuffled:
-            self.hand.append(card)
+            self._add_card(card)
         else:
             self.reshuffled = True
 
 
 class BlackjackEnvwithRunningCount(BlackjackCustomEnv):
+    _HANDS = ("dealer", "dummy", "player")
+    _HAND_CLASS = BlackjackHandwithReshuffle
+    _FLAGS = ("observing", "reshuffled")
+
     def __init__(
         self,
         N_decks: int,
@@ -87,30 +213,63 @@ class BlackjackEnvwithRunningCount(BlackjackCustomEnv):
         rho=1,
         max_hand_sum: int = 21,
         allow_observe: bool = True,
+        counting_systems: Sequence[str] = ("Hi-Lo",),
+        observe_composition: bool = False,
+        instrument: bool = False,
+        flat_obs: bool = False,
+        array_obs: bool = False,
     ):
         BlackjackCustomEnv.__init__(
             self, N_decks, natural_bonus, max_hand_sum=max_hand_sum
         )
         # actions: either "hit" (keep playing), "stand" (stop where you are), observe or join
         self.action_space = spaces.Discrete(5) if allow_observe else spaces.Discrete(3)
-        # count observation depends on the card-counting system and number of decks
-        # use the following defaults
-        # Hi-Lo: [-20 * N_decks, 20 * N_decks], (2*20 + 1) * N_decks
-        count_space = (2 * 20 + 1) * N_decks
+        # count observation depends on the card-counting system and number of decks,
+        # one count per system in counting_systems
+        self.counting_systems = tuple(counting_systems)
+        count_spaces = [get_count_space(system, N_decks) for system in counting_systems]
+        # optionally followed by the number of cards of each value left in the shoe
+        composition_space = (
+            list(np.bincount(CARD_VALUES, minlength=11)[1:] * SUITS * N_decks + 1)
+            if observe_composition
+            else []
+        )
         self.observation_space = spaces.MultiDiscrete(
-            [33, 11, 2, count_space, 2]
-        )  # last for observing or not
+            [33, 11, 2, *count_spaces, 2, *composition_space]
+        )  # observing or not after the counts
+
+        # with flat_obs, counts are shifted up to be non negative, and the composition, which
+        # would make the state space intractable, can not be observed
+        if flat_obs and observe_composition:
+            raise ValueError("flat_obs can not be combined with observe_composition")
+        count_offsets = [-get_count_range(system, N_decks)[0] for system in counting_systems]
+        self._init_flat_obs(
+            flat_obs,
+            [max_hand_sum + 11, 11, 2, *count_spaces, 2],
+            [0, 0, 0, *count_offsets, 0],
+        )
+        self._count_strides = np.array(self._state_strides[3:-1], dtype=np.int64)
+        self._count_base = int(np.dot(count_offsets, self._count_strides))
+        # counts a shoe can not reach, e.g. from a restored state, are clamped like hand sums
+        self._count_low = -np.array(count_offsets, dtype=np.int64)
+        self._count_high = self._count_low + np.array(count_spaces, dtype=np.int64) - 1
+        self._init_obs_buffer(array_obs)
 
         self.rho = rho
         self._allow_observe = allow_observe
+        self._observe_composition = observe_composition
 
         # for game objects don't assign value until reset
         self.observing = None
         self.dealer = None
         self.dummy = None
+        self.player = None
         self.blackjack_deck = None
         self.reshuffled = None
+        # the player's hand, kept while the player observes so joining does not build one
+        self._player_hand = None
 
+        self._instrument(instrument)
         self.reset()
 
     def _calculate_player_reward(self) -> int:
@@ -193,7 +352,7 @@ class BlackjackEnvwithRunningCount(BlackjackCustomEnv):
         # otherwise behavior same as super
         return super()._double_down()
 
-    def step(self, action) -> Tuple[Tuple, int, bool, dict]:
+    def step(self, action) -> Tuple[Tuple, np.float32, bool, dict]:
         """Action must be in the set {0,1,2,3}"""
         assert self.action_space.contains(action)
         # player hits
@@ -211,6 +370,11 @@ class BlackjackEnvwithRunningCount(BlackjackCustomEnv):
         else:  # player doubles down
             hand_done, reward = self._double_down()
 
+        if self.stats is not None:
+            self.stats.action_counts[action] += 1
+            if hand_done:
+                self.stats.end_hand(self.dealer)
+
         if hand_done:  # draw new cards
             self.redeal()
 
@@ -218,50 +382,65 @@ class BlackjackEnvwithRunningCount(BlackjackCustomEnv):
             self.reshuffled = True
 
         game_done = game_done or self.reshuffled
+        if game_done and self.stats is not None:
+            self.stats.reshuffles += 1
 
-        return self._get_obs(), reward, game_done, {}
+        return self._get_obs(), np.float32(reward), game_done, self._get_info()
 
-    def _get_obs(self) -> Tuple[int, int, bool, int, bool]:
+    def _get_obs(self) -> Tuple:
         """
         Gets player's current obs
-        :return: Returns sum of own hand, dealer card, usable ace, card counting obs, observing flag
+        :return: Returns sum of own hand, dealer card, usable ace, card counting obs (one per
+        counting system), observing flag and, if observe_composition, the shoe composition,
+        written into the observation buffer with array_obs
         """
         if self.reshuffled:
-            return (
-                0,
-                1,
-                False,
-                self.blackjack_deck.get_running_count(),
-                self.observing,
-            )
-        if self.observing:
-            return (
-                0,
-                self.dealer.hand[0],
-                False,
-                self.blackjack_deck.get_running_count(),
-                self.observing,
-            )
+            player_sum, dealer_card, usable_ace = 0, 1, False
+        elif self.observing:
+            player_sum, dealer_card, usable_ace = 0, self.dealer.hand[0], False
         else:
-            return (
-                self.player.sum_hand(),
-                self.dealer.hand[0],
-                self.player.has_usable_ace(),
-                self.blackjack_deck.get_running_count(),
-                self.observing,
-            )
+            player_sum = self.player.sum_hand()
+            dealer_card = self.dealer.hand[0]
+            usable_ace = self.player.has_usable_ace()
+        buffer = self._obs_buffer
+        if self._flat_obs:
+            strides = self._state_strides
+            player_sum = min(player_sum, self._state_dims[0] - 1)
+            index = (player_sum * strides[0] + dealer_card * strides[1] + usable_ace * strides[2]
+                     + int(np.clip(self.blackjack_deck.counts, self._count_low, self._count_high)
+                           @ self._count_strides) + self._count_base
+                     + self.observing)
+            if buffer is None:
+                return index
+            buffer[()] = index
+            return buffer
+        if buffer is not None:
+            n_counts = len(self.counting_systems)
+            buffer[0] = player_sum
+            buffer[1] = dealer_card
+            buffer[2] = usable_ace
+            buffer[3:3 + n_counts] = self.blackjack_deck.counts
+            buffer[3 + n_counts] = self.observing
+            if self._observe_composition:
+                buffer[4 + n_counts:] = self.blackjack_deck.composition[1:]
+            return buffer
+        counts = self.blackjack_deck.get_running_counts()
+        obs = (player_sum, dealer_card, usable_ace, *counts, self.observing)
+        if self._observe_composition:
+            obs += tuple(self.blackjack_deck.composition[1:].tolist())
+        return obs
 
     def reset(self) -> Tuple[int, int, bool]:
         if not hasattr(self, "blackjack_deck"):
             return None
 
         self.observing = self._allow_observe
-        self.blackjack_deck = BlackjackDeckwithCount(self.N_decks, rho=self.rho)
-        self.dealer = BlackjackHandwithReshuffle(self.blackjack_deck)
-        self.dummy = BlackjackHandwithReshuffle(self.blackjack_deck)
+        self._shuffle_shoe()
+        self._deal("dealer")
+        self._deal("dummy")
         self.reshuffled = False
         if not self.observing:
-            self.player = BlackjackHandwithReshuffle(self.blackjack_deck)
+            self._deal_player()
         else:
             self.player = None
         return self._get_obs()
@@ -274,7 +453,9 @@ class BlackjackEnvwithRunningCount(BlackjackCustomEnv):
         )
         if not self.observing:
             if not self.player:
-                self.player = BlackjackHandwithReshuffle(self.blackjack_deck)
+                # a joining player is dealt twice, as was a new hand, whose constructor drew
+                # the two cards _initial_draw replaces
+                self._deal_player()
             self.player._initial_draw()
             self.reshuffled = self.reshuffled or self.player.reshuffled
         else:
@@ -282,10 +463,39 @@ class BlackjackEnvwithRunningCount(BlackjackCustomEnv):
 
         return self._get_obs()
 
+    def _make_shoe(self) -> BlackjackDeckwithCount:
+        return BlackjackDeckwithCount(
+            self.N_decks,
+            rho=self.rho,
+            np_random=self.deck_rng,
+            systems=self.counting_systems,
+        )
+
+    def _shoe_fits(self, deck: BlackjackDeckwithCount) -> bool:
+        return (deck.N_decks == self.N_decks and deck.rho == self.rho
+                and deck.systems == self.counting_systems)
+
+    def _deal_player(self) -> None:
+        """Seats the player with a fresh hand, dealt into the hand kept while observing"""
+        if self.player is None:
+            self.player = self._player_hand
+        self._deal("player")
+        self._player_hand = self.player
+
+    def restore(self, snapshot) -> None:
+        # a player hand in the snapshot is restored into the kept hand, not a new one
+        if self.player is None:
+            self.player = self._player_hand
+        BlackjackCustomEnv.restore(self, snapshot)
+        if self.player is not None:
+            self._player_hand = self.player
+
 
 class BlackjackEnvwithTrueCount(BlackjackEnvwithRunningCount):
-    def __init__(self, N_decks: int, natural_bonus: bool = True, rho=1):
-        BlackjackEnvwithRunningCount.__init__(self, N_decks, natural_bonus, rho=rho)
+    def __init__(self, N_decks: int, natural_bonus: bool = True, rho=1,
+                 instrument: bool = False):
+        BlackjackEnvwithRunningCount.__init__(self, N_decks, natural_bonus, rho=rho,
+                                              instrument=instrument)
         # self.action_space = spaces.Discrete(4)
         true_min, true_max = -20, 20
         self.observation_space = spaces.Tuple(
@@ -333,3 +543,237 @@ class BlackjackEnvwithTrueCount(BlackjackEnvwithRunningCount):
                 self.blackjack_deck.get_true_count(),
                 self.observing,
             )
+
+
+class VecBlackjackShoewithCount(VecBlackjackShoe):
+    """
+    VecBlackjackShoe that keeps a running count and stops dealing at its reshuffle point
+    like BlackjackDeckwithCount: the card that reaches the reshuffle point is counted but
+    not dealt, and every draw after it deals a 0
+    """
+
+    def __init__(
+        self,
+        num_shoes: int,
+        N_decks: int,
+        rho=1,
+        np_random: Optional[np.random.Generator] = None,
+        systems: Sequence[str] = ("Hi-Lo",),
+    ):
+        VecBlackjackShoe.__init__(self, num_shoes, N_decks, np_random)
+        self.rho = rho
+        self.systems = tuple(systems)
+        self.count_tags = get_count_tags(self.systems)
+        full_deck_size = len(CARD_VALUES) * SUITS * N_decks
+        self.reshuffle_point = math.floor(full_deck_size * (1 - rho))
+        # number of cards used when the reshuffle point is reached
+        self.cards_per_shoe = full_deck_size - self.reshuffle_point
+        self.counts = np.zeros((num_shoes, len(self.systems)), dtype=np.int64)
+        self.cards_used = np.zeros(num_shoes, dtype=np.int64)
+        self.reshuffled = np.zeros(num_shoes, dtype=bool)
+
+    def shuffle(self, idx: np.ndarray) -> None:
+        VecBlackjackShoe.shuffle(self, idx)
+        self.counts[idx] = 0
+        self.cards_used[idx] = 0
+        self.reshuffled[idx] = False
+
+    def draw_cards(self, idx: np.ndarray) -> np.ndarray:
+        live = ~self.reshuffled[idx]
+        drawing = idx[live]
+        drawn = VecBlackjackShoe.draw_cards(self, drawing)
+        self.counts[drawing] += self.count_tags[:, drawn].T
+        self.cards_used[drawing] += 1
+        self.reshuffled[drawing] = self.cards_used[drawing] >= self.cards_per_shoe
+
+        cards = np.zeros(len(idx), dtype=drawn.dtype)
+        cards[live] = drawn
+        cards[self.reshuffled[idx]] = 0
+        return cards
+
+    def get_true_counts(self) -> np.ndarray:
+        """Running counts per deck remaining in each shoe, like BlackjackDeckwithCount"""
+        cards_per_deck = len(CARD_VALUES) * SUITS
+        decks_remaining = np.maximum(self.remaining, 1) / cards_per_deck
+        return self.counts / decks_remaining[:, None]
+
+
+class VecBlackjackEnvwithRunningCount(VecBlackjackEnv):
+    """
+    num_envs independent BlackjackEnvwithRunningCount shoes stepped together with array
+    operations. Each table plays until its shoe reaches the reshuffle point and is then
+    reset with a fresh shoe, with its final observation in info["terminal_observation"]
+    """
+
+    def __init__(
+        self,
+        num_envs: int,
+        N_decks: int,
+        natural_bonus: bool = True,
+        rho=1,
+        max_hand_sum: int = 21,
+        allow_observe: bool = True,
+        counting_systems: Sequence[str] = ("Hi-Lo",),
+        observe_composition: bool = False,
+        seed=None,
+    ):
+        self.rho = rho
+        self._allow_observe = allow_observe
+        self._observe_composition = observe_composition
+        self.counting_systems = tuple(counting_systems)
+        self.observing = np.zeros(num_envs, dtype=bool)
+        self.reshuffled = np.zeros(num_envs, dtype=bool)
+        VecBlackjackEnv.__init__(
+            self, num_envs, N_decks, natural_bonus, max_hand_sum=max_hand_sum, seed=seed
+        )
+        self.action_space = spaces.Discrete(5) if allow_observe else spaces.Discrete(3)
+        count_spaces = [get_count_space(system, N_decks) for system in counting_systems]
+        composition_space = list(self.shoe.full_shoe + 1) if observe_composition else []
+        self.observation_space = spaces.MultiDiscrete(
+            [33, 11, 2, *count_spaces, 2, *composition_space]
+        )
+
+    def _make_shoe(self) -> VecBlackjackShoewithCount:
+        return VecBlackjackShoewithCount(
+            self.num_envs, self.N_decks, self.rho, systems=self.counting_systems
+        )
+
+    def _deal_player(self, idx: np.ndarray) -> None:
+        self.player_total[idx] = 0
+        self.player_aces[idx] = 0
+        self.player_cards[idx] = 0
+        for _ in range(2):
+            self._draw_player(idx)
+
+    def _deal_dealer_and_dummy(self, idx: np.ndarray) -> None:
+        self.dealer_total[idx] = 0
+        self.dealer_aces[idx] = 0
+        self.dealer_card[idx] = self._draw_dealer(idx)
+        self._draw_dealer(idx)
+        # the dummy hand is never played, its cards only move the count
+        for _ in range(2):
+            self.shoe.draw_cards(idx)
+
+    def _reset_tables(self, idx: np.ndarray) -> None:
+        """Same deal as BlackjackEnvwithRunningCount.reset, from a fresh shoe"""
+        self.shoe.shuffle(idx)
+        self.reshuffled[idx] = False
+        self.observing[idx] = self._allow_observe
+        self._deal_dealer_and_dummy(idx)
+        self._deal_player(idx[~self.observing[idx]])
+
+    def _redeal(self, idx: np.ndarray, was_observing: np.ndarray) -> None:
+        """Same deal as BlackjackEnvwithRunningCount.redeal"""
+        self._deal_dealer_and_dummy(idx)
+        seated = idx[~self.observing[idx]]
+        # a player who just joined gets a new hand, whose constructor draws two cards that
+        # _initial_draw then replaces
+        for _ in range(2):
+            self.shoe.draw_cards(seated[was_observing[seated]])
+        self._deal_player(seated)
+
+    def _play_dealer(self, idx: np.ndarray) -> np.ndarray:
+        """
+        Dealer draws to DEALER_MAX on every table in idx
+        :return: the tables whose dealer finished before the shoe reached its reshuffle point
+        """
+        stopped = np.zeros(self.num_envs, dtype=bool)
+        drawing = idx
+        while len(drawing):
+            drawing = drawing[
+                _sum_hand(self.dealer_total[drawing], self.dealer_aces[drawing],
+                          self.max_hand_sum) < DEALER_MAX
+            ]
+            self._draw_dealer(drawing)
+            out_of_cards = self.shoe.reshuffled[drawing]
+            stopped[drawing[out_of_cards]] = True
+            drawing = drawing[~out_of_cards]
+        return idx[~stopped[idx]]
+
+    def _get_obs(self) -> np.ndarray:
+        playing = ~self.observing & ~self.reshuffled
+        return np.column_stack(
+            [
+                np.where(
+                    playing,
+                    _sum_hand(self.player_total, self.player_aces, self.max_hand_sum),
+                    0,
+                ),
+                np.where(self.reshuffled, 1, self.dealer_card),
+                playing & _usable_ace(self.player_total, self.player_aces, self.max_hand_sum),
+                self.shoe.counts,
+                self.observing,
+                *([self.shoe.composition] if self._observe_composition else []),
+            ]
+        ).astype(np.int64)
+
+    def step_wait(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[Dict]]:
+        actions = self._actions
+        if np.any((actions < 0) | (actions >= self.action_space.n)):
+            raise ValueError("Illegal action")
+        was_observing = self.observing.copy()
+        playing = ~was_observing
+        rewards = np.zeros(self.num_envs, dtype=np.float32)
+        hand_done = np.zeros(self.num_envs, dtype=bool)
+
+        if self._allow_observe:
+            joining = actions == 2
+            leaving = actions == 3
+            doubling = actions == 4
+        else:
+            joining = leaving = np.zeros(self.num_envs, dtype=bool)
+            doubling = actions == 2
+        # an observer who hits, sticks or doubles down just moves on to the next hand
+        hand_done[was_observing & ~joining & ~leaving] = True
+
+        # hits, including double downs; an illegal double down is just a hit
+        legal_double = doubling & playing & (self.player_cards == 2)
+        hitting = np.flatnonzero(playing & ((actions == 1) | doubling))
+        self._draw_player(hitting)
+        out_of_cards = self.shoe.reshuffled[hitting]
+        hand_done[hitting[out_of_cards]] = True
+        # as in BlackjackEnvwithRunningCount._hit, going bust costs 1 but does not end the hand
+        hit_only = hitting[~out_of_cards & ~legal_double[hitting]]
+        rewards[hit_only[self.player_total[hit_only] > self.max_hand_sum]] = -1
+
+        # the dealer plays out sticks, double downs, joins and leaves
+        sticking = playing & ((actions == 0) | (legal_double & ~self.shoe.reshuffled))
+        dealing = np.flatnonzero(sticking | joining | leaving)
+        hand_done[dealing] = True
+        completed = self._play_dealer(dealing)
+        # a player joining from the sidelines has no hand yet, and one leaving forfeits it
+        scored = completed[(sticking | (joining & playing))[completed]]
+        rewards[scored] = np.where(legal_double[scored], 2, 1) * self._calculate_player_reward(
+            scored
+        )
+
+        self.observing[joining] = False
+        self.observing[leaving] = True
+        self._redeal(np.flatnonzero(hand_done), was_observing)
+        self.reshuffled = self.shoe.reshuffled.copy()
+
+        obs = self._get_obs()
+        dones = self.reshuffled.copy()
+        infos = [{} for _ in range(self.num_envs)]
+        finished = np.flatnonzero(dones)
+        for i in finished:
+            infos[i]["terminal_observation"] = obs[i].copy()
+        self._reset_tables(finished)
+        obs[finished] = self._get_obs()[finished]
+        return obs, rewards, dones, infos
+
+
+def make_vec_env(env: BlackjackCustomEnv, n_envs: int, seed=None) -> VecBlackjackEnv:
+    """
+    Vectorized env of n_envs tables with the same rules as env, whose observations have the
+    state layout of env, see BlackjackCustomEnv.get_state_layout
+    """
+    if isinstance(env, BlackjackEnvwithTrueCount) or getattr(env, "_observe_composition", False):
+        raise ValueError("Only the discrete running count observation can be vectorized")
+    if isinstance(env, BlackjackEnvwithRunningCount):
+        return VecBlackjackEnvwithRunningCount(
+            n_envs, env.N_decks, env.natural_bonus, rho=env.rho, max_hand_sum=env.max_hand_sum,
+            allow_observe=env._allow_observe, counting_systems=env.counting_systems, seed=seed)
+    return VecBlackjackEnv(n_envs, env.N_decks, env.natural_bonus,
+                           max_hand_sum=env.max_hand_sum, simple_game=env._simple_game,
+                           seed=seed)
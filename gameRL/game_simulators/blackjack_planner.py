@@ -0,0 +1,310 @@
+# Expectimax planning agent for BlackjackEnvwithRunningCount with a transposition table
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Tuple
+
+import numpy as np
+
+from gameRL.game_simulators.blackjack_count import BlackjackEnvwithRunningCount
+from gameRL.game_simulators.blackjack_solver import HIT, STICK, draws
+from gameRL.game_simulators.dealer_probabilities import dealer_distribution
+
+# actions of BlackjackEnvwithRunningCount with allow_observe, besides STICK and HIT
+JOIN, OBSERVE, DOUBLE_DOWN = 2, 3, 4
+# past the search horizon, rollouts play on by hitting below this
+ROLLOUT_STAND = 17
+
+
+class TranspositionTable:
+    """LRU table of search results, counting hits, misses and evictions"""
+
+    def __init__(self, max_size: int = 2 ** 18):
+        self.max_size = max_size
+        self.table: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable):
+        value = self.table.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.table.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value) -> None:
+        self.table[key] = value
+        self.table.move_to_end(key)
+        if len(self.table) > self.max_size:
+            self.table.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+
+class ExpectimaxAgent:
+    """
+    Plays BlackjackEnvwithRunningCount by searching from the env's current state with the
+    cards the player can see: the shoe composition plus the dealer's unseen hole card.
+
+    Hit, stick and double down are valued by expectimax over the cards drawn, with the
+    dealer's play taken from the exact dealer outcome probabilities of the shoe. The search
+    expands max_depth draws deep; below that, or once the time_budget of the decision is
+    spent, a hand that would still hit is valued by n_rollouts sampled playouts and any
+    other hand by standing. Nodes are cached in a transposition table keyed on (hand state,
+    dealer up card, shoe composition), together with how deep they were searched.
+
+    Whether to sit out the next hands is decided by the expected value of a fresh hand from
+    the shoe, computed by dynamic programming over hand totals with the shoe's current card
+    probabilities: the agent joins when it is positive. A seated agent leaves, forfeiting its
+    hand for a reward of 0, when the best play of the hand plus the value of staying seated
+    for the next one is negative.
+    Like the env, a bust hand stays in play, so it is valued as standing on a score of 0,
+    and a hit that reaches the reshuffle point ends the game with no reward
+    """
+
+    def __init__(
+        self,
+        env: BlackjackEnvwithRunningCount,
+        max_depth: int = 3,
+        n_rollouts: int = 16,
+        time_budget: float = 0.1,
+        table_size: int = 2 ** 18,
+        seed=None,
+    ):
+        self.env = env
+        self.max_depth = max_depth
+        self.n_rollouts = n_rollouts
+        self.time_budget = time_budget
+        self.table = TranspositionTable(table_size)
+        self.np_random = np.random.default_rng(seed)
+        self._deadline = float("inf")
+
+        self.decisions = 0
+        self.timeouts = 0
+        self.rollouts = 0
+        self.decision_seconds = 0.0
+
+    @property
+    def max_hand_sum(self) -> int:
+        return self.env.max_hand_sum
+
+    def _sum_hand(self, hard_total: int, has_ace: bool) -> int:
+        if has_ace and hard_total + 10 <= self.max_hand_sum:
+            return hard_total + 10
+        return hard_total
+
+    def _stand_value(
+        self, hard_total: int, has_ace: bool, natural: bool, dealer_card: int,
+        composition: Tuple[int, ...],
+    ) -> float:
+        dist = dealer_distribution(dealer_card, composition, self.max_hand_sum)
+        score = 0 if hard_total > self.max_hand_sum else self._sum_hand(hard_total, has_ace)
+        payout = 1.5 if natural and self.env.natural_bonus else 1
+        return payout * dist[:score].sum() - dist[score + 1:].sum()
+
+    def _out_of_cards(self, composition: Tuple[int, ...]) -> bool:
+        """Whether the next card reaches the reshuffle point; the hole card is not in the shoe"""
+        return sum(composition) - 2 <= self.env.blackjack_deck.reshuffle_point
+
+    def _rollout_value(
+        self, hard_total: int, has_ace: bool, dealer_card: int, composition: Tuple[int, ...]
+    ) -> float:
+        """Mean reward of n_rollouts playouts that hit below ROLLOUT_STAND, then stand"""
+        total = 0.0
+        for _ in range(self.n_rollouts):
+            shoe = np.array(composition)
+            rollout_total, rollout_ace, reward = hard_total, has_ace, 0.0
+            while self._sum_hand(rollout_total, rollout_ace) < ROLLOUT_STAND:
+                if self._out_of_cards(tuple(shoe)):
+                    break
+                card = self.np_random.choice(10, p=shoe / shoe.sum()) + 1
+                shoe[card - 1] -= 1
+                rollout_total += card
+                rollout_ace = rollout_ace or card == 1
+                if rollout_total > self.max_hand_sum:
+                    reward = -1.0
+                    break
+            else:
+                reward = self._stand_value(rollout_total, rollout_ace, False, dealer_card,
+                                           tuple(shoe.tolist()))
+            if reward == -1.0:
+                # as in the env, the bust hand is then stood on
+                reward += self._stand_value(rollout_total, rollout_ace, False, dealer_card,
+                                            tuple(shoe.tolist()))
+            total += reward
+        self.rollouts += self.n_rollouts
+        return total / self.n_rollouts
+
+    def _leaf_value(
+        self, hard_total: int, has_ace: bool, dealer_card: int, composition: Tuple[int, ...]
+    ) -> float:
+        if hard_total <= self.max_hand_sum and time.perf_counter() < self._deadline \
+                and self._sum_hand(hard_total, has_ace) < ROLLOUT_STAND:
+            return self._rollout_value(hard_total, has_ace, dealer_card, composition)
+        return self._stand_value(hard_total, has_ace, False, dealer_card, composition)
+
+    def action_values(
+        self, hard_total: int, has_ace: bool, n_cards: int, dealer_card: int,
+        composition: Tuple[int, ...], depth: int = 0,
+    ) -> Dict[int, float]:
+        """
+        Expected reward of sticking, hitting and, on two cards, doubling down, searching
+        max_depth - depth draws deep
+        :param composition: cards of each value 1..10 the player has not seen
+        """
+        key = (hard_total, has_ace, n_cards == 2, dealer_card, composition)
+        remaining = self.max_depth - depth
+        cached = self.table.get(key)
+        if cached is not None and cached[1] >= remaining:
+            return cached[0]
+
+        natural = n_cards == 2 and has_ace and hard_total == 11
+        values = {STICK: self._stand_value(hard_total, has_ace, natural, dealer_card,
+                                           composition)}
+        if hard_total > self.max_hand_sum:
+            # hitting on a bust hand only costs more
+            self.table.put(key, (values, remaining))
+            return values
+        if self._out_of_cards(composition):
+            values[HIT] = 0.0
+            if n_cards == 2:
+                values[DOUBLE_DOWN] = 0.0
+            self.table.put(key, (values, remaining))
+            return values
+
+        expand = remaining > 1 and time.perf_counter() < self._deadline
+        hit_value = double_value = 0.0
+        for card, prob, rest in draws(composition):
+            total, ace = hard_total + card, has_ace or card == 1
+            if total > self.max_hand_sum:
+                hit_value -= prob
+            if expand:
+                hit_value += prob * max(
+                    self.action_values(total, ace, n_cards + 1, dealer_card, rest, depth + 1)
+                    .values())
+            else:
+                hit_value += prob * self._leaf_value(total, ace, dealer_card, rest)
+            if n_cards == 2:
+                # the env scores a bust double down as standing on it, for twice the stake
+                double_value += 2 * prob * self._stand_value(total, ace, False, dealer_card,
+                                                             rest)
+        values[HIT] = hit_value
+        if n_cards == 2:
+            values[DOUBLE_DOWN] = double_value
+        if expand or time.perf_counter() < self._deadline:
+            self.table.put(key, (values, remaining))
+        return values
+
+    def seat_value(self, composition: Tuple[int, ...]) -> float:
+        """
+        Expected reward of a fresh hand from composition, by dynamic programming over hand
+        totals with the card probabilities of composition held fixed and the dealer's
+        outcomes of composition
+        """
+        key = ("seat", composition)
+        cached = self.table.get(key)
+        if cached is not None:
+            return cached
+        probs = np.array(composition) / sum(composition)
+        value = 0.0
+        for dealer_card in range(1, 11):
+            if not probs[dealer_card - 1]:
+                continue
+            dist = dealer_distribution(dealer_card, composition, self.max_hand_sum)
+            below = np.concatenate([[0], np.cumsum(dist)])
+
+            def stand(hard_total, has_ace, natural=False):
+                if hard_total > self.max_hand_sum:
+                    return -(1 - dist[0])
+                score = self._sum_hand(hard_total, has_ace)
+                payout = 1.5 if natural and self.env.natural_bonus else 1
+                return payout * below[score] - (1 - below[score + 1])
+
+            best = {}
+
+            def hand_value(hard_total, has_ace):
+                if (hard_total, has_ace) not in best:
+                    hit = 0.0
+                    if hard_total <= self.max_hand_sum:
+                        for card, prob in enumerate(probs, start=1):
+                            total = hard_total + card
+                            hit += prob * (hand_value(total, has_ace or card == 1)
+                                           - (total > self.max_hand_sum))
+                    best[(hard_total, has_ace)] = max(stand(hard_total, has_ace),
+                                                      hit if hard_total <= self.max_hand_sum
+                                                      else -np.inf)
+                return best[(hard_total, has_ace)]
+
+            dealt = 0.0
+            for first, first_prob in enumerate(probs, start=1):
+                for second, second_prob in enumerate(probs, start=1):
+                    hard_total, has_ace = first + second, 1 in (first, second)
+                    options = [hand_value(hard_total, has_ace),
+                               stand(hard_total, has_ace, hard_total == 11 and has_ace)]
+                    options.append(2 * sum(
+                        prob * stand(hard_total + card, has_ace or card == 1)
+                        for card, prob in enumerate(probs, start=1)))
+                    dealt += first_prob * second_prob * max(options)
+            value += probs[dealer_card - 1] * dealt
+        self.table.put(key, value)
+        return value
+
+    def _seen_composition(self) -> Tuple[int, ...]:
+        """Cards the player has not seen: the shoe plus the dealer's hole card"""
+        composition = self.env.blackjack_deck.composition[1:].copy()
+        for card in self.env.dealer.hand[1:]:
+            composition[card - 1] += 1
+        return tuple(composition.tolist())
+
+    def act(self) -> int:
+        """Best action in the env's current state, found within time_budget seconds"""
+        start = time.perf_counter()
+        self._deadline = start + self.time_budget
+        action = self._decide()
+        if time.perf_counter() > self._deadline:
+            self.timeouts += 1
+        self.decisions += 1
+        self.decision_seconds += time.perf_counter() - start
+        return action
+
+    def _decide(self) -> int:
+        env = self.env
+        if env.reshuffled:
+            return STICK
+        composition = self._seen_composition()
+        if env.observing:
+            return JOIN if self.seat_value(composition) > 0 else OBSERVE
+        player = env.player
+        values = self.action_values(player.hard_total, player.num_aces > 0,
+                                    player.hand_size, env.dealer.hand[0], composition)
+        action = max(values, key=values.get)
+        # observing forfeits the hand for a reward of 0 and sits out the next one, which a
+        # player who would rather be seated makes up by joining again
+        if env._allow_observe and values[action] + max(self.seat_value(composition), 0) < 0:
+            return OBSERVE
+        if action == DOUBLE_DOWN:
+            # without observe and join, the double down is action 2
+            return DOUBLE_DOWN if env._allow_observe else JOIN
+        return action
+
+    def predict(self, observation=None, state=None, mask=None, deterministic=True):
+        """stable-baselines style predict, planning from the env rather than observation"""
+        return self.act(), None
+
+    def stats(self) -> Dict[str, float]:
+        lookups = max(self.table.hits + self.table.misses, 1)
+        return {
+            "decisions": self.decisions,
+            "mean_decision_seconds": self.decision_seconds / max(self.decisions, 1),
+            "timeouts": self.timeouts,
+            "rollouts": self.rollouts,
+            "table_size": len(self.table),
+            "table_hits": self.table.hits,
+            "table_misses": self.table.misses,
+            "table_hit_rate": self.table.hits / lookups,
+            "table_evictions": self.table.evictions,
+        }
@@ -0,0 +1,191 @@
+# Exact expected values and optimal play for BlackjackCustomEnv by dynamic programming
+from typing import Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+
+from gameRL.game_simulators.dealer_probabilities import (
+    INFINITE_DECK_PROBS,
+    Composition,
+    dealer_distribution,
+    full_shoe,
+)
+
+# actions, as numbered by BlackjackCustomEnv.step
+STICK, HIT, DOUBLE_DOWN = 0, 1, 2
+
+# observation of BlackjackCustomEnv: (sum of hand, dealer card, usable ace) -> action
+Policy = Callable[[Tuple[int, int, bool]], int]
+
+
+def remove_cards(composition: Composition, cards: Sequence[int]) -> Composition:
+    if composition is None:
+        return None
+    remaining = list(composition)
+    for card in cards:
+        remaining[card - 1] -= 1
+    return tuple(remaining)
+
+
+def draws(composition: Composition) -> Iterator[Tuple[int, float, Composition]]:
+    """Yields every card that can be drawn with its probability and the shoe left after it"""
+    if composition is None:
+        for card, prob in enumerate(INFINITE_DECK_PROBS, start=1):
+            yield card, prob, None
+        return
+    total = sum(composition)
+    for index, count in enumerate(composition):
+        if count:
+            rest = composition[:index] + (count - 1,) + composition[index + 1:]
+            yield index + 1, count / total, rest
+
+
+class BlackjackSolver:
+    """
+    Computes the optimal hit/stick/double down policy of BlackjackCustomEnv and its exact
+    expected reward, for either an infinite shoe or the exact composition of a finite one.
+    Values are memoized on (player hand, dealer card, shoe composition).
+
+    The player's state here includes the number of cards in hand, which the env's
+    observation does not, so expected_value() is an upper bound for any agent of the env.
+    The dealer's hole card is drawn after the player's cards, which does not change the
+    odds since the player never sees it
+    """
+
+    def __init__(
+        self,
+        N_decks: int = 1,
+        natural_bonus: bool = True,
+        max_hand_sum: int = 21,
+        simple_game: bool = False,
+        infinite_deck: bool = False,
+    ):
+        self.N_decks = N_decks
+        self.natural_bonus = natural_bonus
+        self.max_hand_sum = max_hand_sum
+        self.simple_game = simple_game
+        self.infinite_deck = infinite_deck
+        self.full_shoe: Composition = None if infinite_deck else full_shoe(N_decks)
+        self._value_cache: Dict[Tuple, float] = {}
+
+    def _sum_hand(self, hard_total: int, has_ace: bool) -> int:
+        if has_ace and hard_total + 10 <= self.max_hand_sum:
+            return hard_total + 10
+        return hard_total
+
+    def dealer_distribution(self, dealer_card: int, composition: Composition) -> np.ndarray:
+        """
+        Probability of each final dealer score from the dealer's up card, where index 0 is a
+        bust, with the hole card and hits drawn from composition
+        """
+        return dealer_distribution(dealer_card, composition, self.max_hand_sum)
+
+    def _stick_value(
+        self, hard_total: int, has_ace: bool, natural: bool, dealer_card: int,
+        composition: Composition,
+    ) -> float:
+        dist = self.dealer_distribution(dealer_card, composition)
+        score = self._sum_hand(hard_total, has_ace)
+        win, lose = dist[:score].sum(), dist[score + 1:].sum()
+        payout = 1.5 if natural and self.natural_bonus else 1
+        return payout * win - lose
+
+    def _action_values(
+        self, hard_total: int, has_ace: bool, n_cards: int, dealer_card: int,
+        composition: Composition, policy: Optional[Policy], cache: Dict,
+    ) -> Dict[int, float]:
+        natural = n_cards == 2 and has_ace and hard_total == 11
+        values = {
+            STICK: self._stick_value(hard_total, has_ace, natural, dealer_card, composition)
+        }
+
+        hit_value = 0
+        for card, prob, rest in draws(composition):
+            if hard_total + card > self.max_hand_sum:
+                hit_value -= prob
+            else:
+                hit_value += prob * self._value(
+                    hard_total + card, has_ace or card == 1, n_cards + 1, dealer_card, rest,
+                    policy, cache,
+                )
+        values[HIT] = hit_value
+
+        if not self.simple_game and n_cards == 2:
+            double_value = 0
+            for card, prob, rest in draws(composition):
+                if hard_total + card > self.max_hand_sum:
+                    double_value -= 2 * prob
+                else:
+                    double_value += 2 * prob * self._stick_value(
+                        hard_total + card, has_ace or card == 1, False, dealer_card, rest
+                    )
+            values[DOUBLE_DOWN] = double_value
+        return values
+
+    def _value(
+        self, hard_total: int, has_ace: bool, n_cards: int, dealer_card: int,
+        composition: Composition, policy: Optional[Policy], cache: Dict,
+    ) -> float:
+        # only whether the hand has two cards matters, for double downs and naturals
+        key = (hard_total, has_ace, min(n_cards, 3), dealer_card, composition)
+        if key in cache:
+            return cache[key]
+        values = self._action_values(
+            hard_total, has_ace, n_cards, dealer_card, composition, policy, cache
+        )
+        if policy is None:
+            value = max(values.values())
+        else:
+            hand_sum = self._sum_hand(hard_total, has_ace)
+            action = policy((hand_sum, dealer_card, has_ace and hand_sum != hard_total))
+            # an illegal double down acts as a hit, like BlackjackCustomEnv._double_down
+            if action == DOUBLE_DOWN and n_cards != 2:
+                action = HIT
+            if action not in values:
+                raise ValueError("Illegal action")
+            value = values[action]
+        cache[key] = value
+        return value
+
+    def action_values(
+        self, player_cards: Sequence[int], dealer_card: int,
+        composition: Composition = None,
+    ) -> Dict[int, float]:
+        """
+        Expected reward of each legal action with optimal play afterwards
+        :param composition: shoe the next cards come from, by default the full shoe without
+        the player's cards and the dealer card
+        """
+        if composition is None:
+            composition = remove_cards(self.full_shoe, [*player_cards, dealer_card])
+        return self._action_values(
+            sum(player_cards), 1 in player_cards, len(player_cards), dealer_card,
+            composition, None, self._value_cache,
+        )
+
+    def optimal_action(
+        self, player_cards: Sequence[int], dealer_card: int,
+        composition: Composition = None,
+    ) -> int:
+        values = self.action_values(player_cards, dealer_card, composition)
+        return max(values, key=values.get)
+
+    def expected_value(self, policy: Optional[Policy] = None) -> float:
+        """
+        Expected reward of a hand dealt from the full shoe
+        :param policy: maps an observation of BlackjackCustomEnv to an action, by default
+        the optimal policy
+        """
+        cache = self._value_cache if policy is None else {}
+        total = 0
+        for dealer_card, dealer_prob, shoe in draws(self.full_shoe):
+            for first, first_prob, shoe_after_first in draws(shoe):
+                for second, second_prob, rest in draws(shoe_after_first):
+                    total += dealer_prob * first_prob * second_prob * self._value(
+                        first + second, 1 in (first, second), 2, dealer_card, rest,
+                        policy, cache,
+                    )
+        return total
+
+    def regret(self, policy: Policy) -> float:
+        """Expected reward per hand lost by following policy instead of optimal play"""
+        return self.expected_value() - self.expected_value(policy)
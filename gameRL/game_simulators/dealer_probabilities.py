@@ -0,0 +1,120 @@
+# Probabilities of the dealer's final score in BlackjackCustomEnv, by up card and shoe composition
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from gameRL.game_simulators.blackjack import CARD_VALUES, DEALER_MAX, SUITS
+
+# number of (up card, composition, max hand sum) distributions kept by the LRU cache
+DEALER_CACHE_SIZE = 2 ** 16
+
+# probability of drawing each card value 1..10 from an infinite shoe
+INFINITE_DECK_PROBS = np.bincount(CARD_VALUES, minlength=11)[1:] / len(CARD_VALUES)
+
+# number of cards of each value 1..10 left in a shoe, None for an infinite shoe
+Composition = Optional[Tuple[int, ...]]
+
+
+def full_shoe(N_decks: int) -> Tuple[int, ...]:
+    return tuple((np.bincount(CARD_VALUES, minlength=11)[1:] * SUITS * N_decks).tolist())
+
+
+@lru_cache(maxsize=None)
+def dealer_hands(dealer_card: int, max_hand_sum: int) -> Tuple[np.ndarray, ...]:
+    """
+    Every set of cards the dealer can draw after the up card, as the env's dealer draws to
+    DEALER_MAX. Drawing without replacement, every order of the same cards is equally likely,
+    so each set is weighted by the number of orders in which the dealer would draw it
+    :return: number of cards of each value 1..10 in each set, number of orders, and the
+    dealer's final score (0 for a bust)
+    """
+    hands: Dict[Tuple[Tuple[int, ...], int], int] = {}
+
+    def expand(hard_total: int, has_ace: bool, counts: List[int]):
+        hand_sum = hard_total
+        if has_ace and hard_total + 10 <= max_hand_sum:
+            hand_sum += 10
+        if hand_sum >= DEALER_MAX:
+            key = (tuple(counts), 0 if hard_total > max_hand_sum else hand_sum)
+            hands[key] = hands.get(key, 0) + 1
+            return
+        for card in range(1, 11):
+            counts[card - 1] += 1
+            expand(hard_total + card, has_ace or card == 1, counts)
+            counts[card - 1] -= 1
+
+    expand(dealer_card, dealer_card == 1, [0] * 10)
+    counts = np.array([counts for counts, _ in hands])
+    scores = np.array([score for _, score in hands])
+    return counts, np.array(list(hands.values())), scores
+
+
+@lru_cache(maxsize=None)
+def infinite_deck_table(max_hand_sum: int = 21) -> np.ndarray:
+    """
+    Dealer final score probabilities on an infinite shoe, one row per up card (row 0 is
+    unused) and one column per score (column 0 is a bust)
+    """
+    table = np.zeros((11, max_hand_sum + 1))
+    for dealer_card in range(1, 11):
+        counts, orders, scores = dealer_hands(dealer_card, max_hand_sum)
+        probs = orders * (INFINITE_DECK_PROBS ** counts).prod(axis=1)
+        table[dealer_card] = np.bincount(scores, weights=probs, minlength=max_hand_sum + 1)
+    table.flags.writeable = False
+    return table
+
+
+@lru_cache(maxsize=DEALER_CACHE_SIZE)
+def _finite_deck_distribution(
+    dealer_card: int, composition: Tuple[int, ...], max_hand_sum: int
+) -> np.ndarray:
+    counts, orders, scores = dealer_hands(dealer_card, max_hand_sum)
+    # drawing a given order of cards has probability prod_v C_v (C_v - 1) ... over
+    # T (T - 1) ..., falling factorials of each value's count C_v and the shoe size T
+    shoe = np.array(composition, dtype=float)
+    cards_drawn = counts.sum(axis=1)
+    steps = np.arange(cards_drawn.max())
+    falling = np.vstack([np.ones(10), np.maximum(shoe - steps[:, None], 0).cumprod(axis=0)])
+    shoe_falling = np.concatenate([[1], np.maximum(shoe.sum() - steps, 0).cumprod()])
+    probs = (
+        orders
+        * falling[counts, np.arange(10)].prod(axis=1)
+        / np.maximum(shoe_falling[cards_drawn], 1)
+    )
+    dist = np.bincount(scores, weights=probs, minlength=max_hand_sum + 1)
+    dist.flags.writeable = False
+    return dist
+
+
+def dealer_distribution(
+    dealer_card: int, composition: Composition = None, max_hand_sum: int = 21
+) -> np.ndarray:
+    """
+    Probability of each final dealer score, where index 0 is a bust
+    :param dealer_card: the dealer's up card
+    :param composition: number of cards of each value 1..10 left in the shoe, which the hole
+    card and hits are drawn from, or None for an infinite shoe
+    """
+    if composition is None:
+        return infinite_deck_table(max_hand_sum)[dealer_card]
+    return _finite_deck_distribution(dealer_card, tuple(map(int, composition)), max_hand_sum)
+
+
+def dealer_bust_probability(
+    dealer_card: int, composition: Composition = None, max_hand_sum: int = 21
+) -> float:
+    return float(dealer_distribution(dealer_card, composition, max_hand_sum)[0])
+
+
+def stand_outcomes(
+    player_score: int, dealer_card: int, composition: Composition = None,
+    max_hand_sum: int = 21,
+) -> Tuple[float, float, float]:
+    """Probabilities that standing on player_score wins, ties and loses"""
+    dist = dealer_distribution(dealer_card, composition, max_hand_sum)
+    return (
+        float(dist[:player_score].sum()),
+        float(dist[player_score]),
+        float(dist[player_score + 1:].sum()),
+    )
@@ -0,0 +1,229 @@
+# Vectorized env running blocks of blackjack envs in worker processes that exchange actions,
+# observations, rewards and dones through shared memory instead of pickling them through pipes
+import multiprocessing
+import os
+import traceback
+from multiprocessing.sharedctypes import RawArray
+from threading import BrokenBarrierError
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import gym
+import numpy as np
+
+from gameRL.game_simulators.blackjack import spawn_seeds
+
+try:
+    from stable_baselines.common.vec_env import VecEnv
+except ImportError:  # stable-baselines is only needed to train on SharedMemoryVecEnv
+    VecEnv = object
+
+# start method of every worker process and process pool of the package: the processes that
+# train and evaluate models load TensorFlow, and a process forked from one can deadlock
+START_METHOD = "spawn"
+# commands the parent sets before releasing the workers from the start barrier
+STEP, RESET, CALL, CLOSE = range(4)
+
+
+def _shared_array(ctx, shape: Tuple[int, ...], dtype) -> RawArray:
+    """Lock-free shared memory for an array of shape and dtype, see _as_array"""
+    return ctx.RawArray("b", max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1))
+
+
+def _as_array(raw: RawArray, shape: Tuple[int, ...], dtype) -> np.ndarray:
+    return np.frombuffer(raw, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def _call(env: gym.Env, i: int, kind: str, name: str, args: tuple, kwargs: dict):
+    if kind == "seed":
+        # args[0] holds a seed for every env of the batch
+        return env.seed(args[0][i])
+    if kind == "get_attr":
+        return getattr(env, name)
+    if kind == "set_attr":
+        return setattr(env, name, args[0])
+    return getattr(env, name)(*args, **kwargs)
+
+
+def _worker(env_fn: Callable[[], gym.Env], indices: Sequence[int], seeds: list,
+            raws: Dict[str, RawArray], layout: Dict[str, Tuple[tuple, np.dtype]],
+            command, barrier, pipe, errors) -> None:
+    """
+    Steps the envs at indices of the batch whenever the parent passes the start barrier, then
+    meets it at the end barrier once every result is written
+    """
+    try:
+        arrays = {key: _as_array(raws[key], *layout[key]) for key in raws}
+        obs, terminal_obs = arrays["obs"], arrays["terminal_obs"]
+        rewards, dones, actions = arrays["rewards"], arrays["dones"], arrays["actions"]
+        envs = []
+        for i, seed in zip(indices, seeds):
+            env = env_fn()
+            env.seed(seed)
+            # each env writes its observations straight into its row of the batch
+            env.set_obs_buffer(obs[i, ...])
+            envs.append(env)
+        while True:
+            barrier.wait()
+            if command.value == CLOSE:
+                break
+            if command.value == STEP:
+                for i, env in zip(indices, envs):
+                    _, rewards[i], dones[i], _ = env.step(int(actions[i]))
+                    if dones[i]:
+                        terminal_obs[i] = obs[i]
+                        env.reset()
+            elif command.value == RESET:
+                for env in envs:
+                    env.reset()
+            elif command.value == CALL:
+                kind, name, args, kwargs, targets = pipe.recv()
+                pipe.send([_call(env, i, kind, name, args, kwargs)
+                           for i, env in zip(indices, envs) if i in targets])
+            barrier.wait()
+        for env in envs:
+            env.close()
+    except BrokenBarrierError:
+        pass
+    except Exception:
+        errors.put(traceback.format_exc())
+        barrier.abort()
+
+
+class SharedMemoryVecEnv(VecEnv):
+    """
+    n_envs copies of the env built by env_fn, split into blocks stepped by n_workers
+    processes. Actions, observations, rewards and dones live in shared arrays, each env
+    writing its observation into its own row through set_obs_buffer, and a step costs two
+    barrier waits rather than pickling every observation through a pipe as SubprocVecEnv
+    does. Finished envs are reset automatically, with their final observation in
+    info["terminal_observation"]; other info the envs return is dropped.
+
+    env_fn must build a BlackjackCustomEnv or subclass with an array observation space, and
+    be picklable unless start_method is fork
+    """
+
+    def __init__(self, env_fn: Callable[[], gym.Env], n_envs: int,
+                 n_workers: Optional[int] = None, seed=None, start_method: str = START_METHOD):
+        env = env_fn()
+        # same attributes VecEnv.__init__ sets
+        self.num_envs = n_envs
+        self.observation_space = env.observation_space
+        self.action_space = env.action_space
+        env.close()
+
+        n_workers = min(n_workers or os.cpu_count() or 1, n_envs)
+        ctx = multiprocessing.get_context(start_method)
+        layout = {
+            "obs": ((n_envs, *self.observation_space.shape), self.observation_space.dtype),
+            "terminal_obs": ((n_envs, *self.observation_space.shape),
+                             self.observation_space.dtype),
+            "rewards": ((n_envs,), np.float32),
+            "dones": ((n_envs,), np.bool_),
+            "actions": ((n_envs,), np.int64),
+        }
+        raws = {key: _shared_array(ctx, *layout[key]) for key in layout}
+        arrays = {key: _as_array(raws[key], *layout[key]) for key in raws}
+        self._obs, self._terminal_obs = arrays["obs"], arrays["terminal_obs"]
+        self._rewards, self._dones, self._actions = \
+            arrays["rewards"], arrays["dones"], arrays["actions"]
+
+        self._command = ctx.RawValue("i", RESET)
+        # the parent and every worker meet at the start and at the end of each command
+        self._barrier = ctx.Barrier(n_workers + 1)
+        self._errors = ctx.SimpleQueue()
+        seeds = spawn_seeds(seed, n_envs)
+        self._pipes = []
+        self._processes = []
+        for indices in np.array_split(np.arange(n_envs), n_workers):
+            parent_pipe, worker_pipe = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker,
+                args=(env_fn, indices.tolist(), [seeds[i] for i in indices], raws, layout,
+                      self._command, self._barrier, worker_pipe, self._errors),
+                daemon=True)
+            process.start()
+            worker_pipe.close()
+            self._pipes.append(parent_pipe)
+            self._processes.append(process)
+        self.closed = False
+
+    def _run(self, command: int) -> None:
+        """Runs command on every worker, raising the first error a worker hit"""
+        self._command.value = command
+        try:
+            self._barrier.wait()
+            if command == CALL:
+                self._replies = [pipe.recv() for pipe in self._pipes]
+            self._barrier.wait()
+        except (BrokenBarrierError, EOFError):
+            self.close(wait=False)
+            error = self._errors.get() if not self._errors.empty() else "worker died"
+            raise RuntimeError(f"SharedMemoryVecEnv worker failed:\n{error}")
+
+    def reset(self) -> np.ndarray:
+        self._run(RESET)
+        return self._obs.copy()
+
+    def step(self, actions) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[Dict]]:
+        self.step_async(actions)
+        return self.step_wait()
+
+    def step_async(self, actions) -> None:
+        self._actions[:] = np.asarray(actions).reshape(self.num_envs)
+
+    def step_wait(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[Dict]]:
+        self._run(STEP)
+        infos = [{} for _ in range(self.num_envs)]
+        for i in np.flatnonzero(self._dones):
+            infos[i]["terminal_observation"] = self._terminal_obs[i].copy()
+        # copies, since the workers overwrite the shared arrays on the next step
+        return self._obs.copy(), self._rewards.copy(), self._dones.copy(), infos
+
+    def close(self, wait: bool = True) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if wait:
+            self._command.value = CLOSE
+            try:
+                self._barrier.wait()
+            except BrokenBarrierError:
+                pass
+        for process in self._processes:
+            process.join(timeout=1 if wait else 0)
+            if process.is_alive():
+                process.terminate()
+        for pipe in self._pipes:
+            pipe.close()
+
+    def _get_indices(self, indices) -> List[int]:
+        if indices is None:
+            return list(range(self.num_envs))
+        if isinstance(indices, int):
+            return [indices]
+        return list(indices)
+
+    def _call(self, kind: str, name: str, indices, *args, **kwargs) -> List:
+        targets = set(self._get_indices(indices))
+        for pipe in self._pipes:
+            pipe.send((kind, name, args, kwargs, targets))
+        self._run(CALL)
+        # blocks hold consecutive envs, so their replies come back in index order
+        return [result for reply in self._replies for result in reply]
+
+    def seed(self, seed=None) -> List:
+        """
+        Seeds every env with its stream spawned from seed, as the constructor does; the
+        shoes they draw from change on the next reset
+        :return: the seeds of every env
+        """
+        return self._call("seed", "seed", None, spawn_seeds(seed, self.num_envs))
+
+    def get_attr(self, attr_name, indices=None) -> List:
+        return self._call("get_attr", attr_name, indices)
+
+    def set_attr(self, attr_name, value, indices=None) -> None:
+        self._call("set_attr", attr_name, indices, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs) -> List:
+        return self._call("env_method", method_name, indices, *method_args, **method_kwargs)
@@ -0,0 +1,47 @@
+import json
+import os
+import tempfile
+import unittest
+
+from gameRL.benchmarks.env_throughput import (
+    BASELINE_PATH,
+    find_regressions,
+    get_benchmarks,
+    main,
+    time_ops,
+)
+
+
+class TestBenchmarks(unittest.TestCase):
+    def testFindRegressions(self):
+        baseline = {"fast": 100.0, "slow": 100.0, "removed": 100.0}
+        results = {"fast": 90.0, "slow": 70.0, "added": 1.0}
+        self.assertEqual(find_regressions(results, baseline, threshold=0.2), {"slow": 0.7})
+
+    def testBaselineCommitted(self):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)["results"]
+        self.assertEqual(set(baseline), set(get_benchmarks()))
+
+    def testMain(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            args = ["--filter", "hand/sum_hand", "--min-time", "0.001",
+                    "--output", os.path.join(tmp, "results.json"),
+                    "--baseline", os.path.join(tmp, "baseline.json")]
+            self.assertEqual(main(args), 0)
+            self.assertEqual(main(args + ["--require-baseline"]), 1)
+            self.assertEqual(main(args + ["--save-baseline"]), 0)
+            self.assertEqual(main(args + ["--require-baseline"]), 0)
+            # a baseline no run can reach regresses
+            with open(os.path.join(tmp, "baseline.json"), "w") as f:
+                json.dump({"results": {"hand/sum_hand": 1e15}}, f)
+            self.assertEqual(main(args), 1)
+
+    def testEveryBenchmarkRuns(self):
+        for name, make_run in get_benchmarks().items():
+            with self.subTest(name=name):
+                self.assertGreater(time_ops(make_run(), min_time=0.001, repeat=1), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
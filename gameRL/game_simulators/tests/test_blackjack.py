@@ -1,11 +1,20 @@
 import unittest
+
+import numpy as np
+
 from gameRL.game_simulators.blackjack import (
     BlackjackDeck,
     BlackjackCustomEnv,
+    BlackjackHand,
+    spawn_seeds,
 )
 from gameRL.game_simulators.blackjack_count import (
     BlackjackEnvwithRunningCount,
+    BlackjackEnvwithTrueCount,
     BlackjackDeckwithCount,
+    COUNTING_SYSTEMS,
+    get_count_range,
+    get_count_space,
 )
 
 
@@ -56,6 +65,304 @@ class TestGameSimulator(unittest.TestCase):
             actual = deck3.get_running_count()
             self.assertEqual(actual, expected, "Multiple Deck Counting Failed")
 
+    def testSeveralCountingSystems(self):
+        systems = ["Hi-Lo", "KO", "Hi-Opt I", "Hi-Opt II", "Omega II", "Zen", "Wong Halves"]
+        deck = BlackjackDeckwithCount(N_decks=1, systems=systems)
+        cards = []
+        for _ in range(52):
+            card, reshuffled = deck.draw_card()
+            cards.append(card)
+        # balanced systems sum to zero over a full deck, KO to +4 per deck
+        expected = [0, 4, 0, 0, 0, 0, 0]
+        self.assertEqual(list(deck.get_running_counts()), expected)
+        self.assertEqual(deck.get_running_count(), 0)
+
+    def testCountRange(self):
+        self.assertEqual(get_count_range("Hi-Lo", 2), (-40, 40))
+        # KO tags the 7 too, so it is unbalanced
+        self.assertEqual(get_count_range("KO", 1), (-20, 24))
+        self.assertEqual(get_count_space("KO", 3), 133)
+        for system in COUNTING_SYSTEMS:
+            deck = BlackjackDeckwithCount(N_decks=1, systems=[system])
+            # deal the cards of highest tag first, for the highest count the shoe reaches
+            deck.deck[:] = sorted(deck.deck, key=lambda card: -COUNTING_SYSTEMS[system][card])
+            highest = max(deck.draw_card() and deck.count for _ in range(52))
+            self.assertEqual(highest, get_count_range(system, 1)[1])
+
+    def testCountObservation(self):
+        env = BlackjackEnvwithRunningCount(2, counting_systems=["Hi-Lo", "Omega II"])
+        obs = env.reset()
+        self.assertEqual(len(obs), 6)
+        self.assertEqual(obs[3:5], env.blackjack_deck.get_running_counts())
+        self.assertEqual(len(env.observation_space.nvec), 6)
+
+    def testTrueCount(self):
+        deck = BlackjackDeckwithCount(N_decks=2)
+        drawn = []
+        for _ in range(26):
+            card, reshuffled = deck.draw_card()
+            drawn.append(card)
+        self.assertAlmostEqual(deck.get_decks_remaining(), 1.5)
+        self.assertAlmostEqual(deck.get_true_count(), deck.get_running_count() / 1.5)
+        expected = [8 - drawn.count(value) for value in range(1, 10)] + [32 - drawn.count(10)]
+        self.assertEqual(deck.get_composition().tolist(), expected)
+
+    def testTrueCountEnv(self):
+        env = BlackjackEnvwithTrueCount(1)
+        done = False
+        while not done:
+            obs, _, done, _ = env.step(3)
+            self.assertIsInstance(obs[3], float)
+
+    def testCompositionObservation(self):
+        env = BlackjackEnvwithRunningCount(1, observe_composition=True)
+        obs = env.reset()
+        self.assertEqual(len(obs), 15)
+        self.assertEqual(sum(obs[5:]), 48, "Dealer and dummy hands leave the shoe")
+        self.assertEqual(len(env.observation_space.nvec), 15)
+
+    def testDeckDealsFullShoe(self):
+        deck = BlackjackDeck(N_decks=2)
+        cards = [deck.draw_card() for _ in range(104)]
+        self.assertTrue(deck.is_empty())
+        for value in range(1, 10):
+            self.assertEqual(cards.count(value), 8, "Shoe composition changed")
+        self.assertEqual(cards.count(10), 32, "Shoe composition changed")
+
+    def testDeckWithReplacement(self):
+        deck = BlackjackDeck(N_decks=1, with_replacement=True)
+        for _ in range(200):
+            self.assertIn(deck.draw_card(), range(1, 11))
+        self.assertEqual(deck.cards_remaining(), 52)
+
+    def testIncrementalHandState(self):
+        for max_hand_sum in [19, 21, 24]:
+            for _ in range(50):
+                hand = BlackjackHand(BlackjackDeck(N_decks=1), max_hand_sum)
+                while sum(hand.hand) <= max_hand_sum:
+                    usable = 1 in hand.hand and sum(hand.hand) + 10 <= max_hand_sum
+                    self.assertEqual(hand.has_usable_ace(), usable)
+                    self.assertEqual(hand.sum_hand(), sum(hand.hand) + 10 * usable)
+                    self.assertEqual(hand.is_natural(), sorted(hand.hand) == [1, 10])
+                    self.assertFalse(hand.is_bust())
+                    hand.draw_card()
+                self.assertTrue(hand.is_bust())
+                self.assertEqual(hand.score(), 0)
+
+    def testSeededEnvsReproducible(self):
+        env1 = BlackjackEnvwithRunningCount(1)
+        env2 = BlackjackEnvwithRunningCount(1)
+        env1.seed(7)
+        env2.seed(7)
+        self.assertEqual(env1.reset(), env2.reset())
+        for action in [2, 1, 0, 3, 3, 2, 4]:
+            self.assertEqual(env1.step(action), env2.step(action))
+
+    def testSpawnedSeedsIndependent(self):
+        shoes = []
+        for child_seed in spawn_seeds(0, 4):
+            env = BlackjackCustomEnv(1)
+            env.seed(child_seed)
+            env.reset()
+            shoes.append(env.blackjack_deck.deck.tolist())
+        self.assertEqual(len({tuple(shoe) for shoe in shoes}), 4, "Spawned streams collided")
+
+    def testResetReusesShoeAndHands(self):
+        env = BlackjackCustomEnv(1)
+        env.seed(5)
+        env.step(0)
+        deck, dealer, player = env.blackjack_deck, env.dealer, env.player
+        rng = np.random.default_rng()
+        rng.bit_generator.state = env.deck_rng.bit_generator.state
+        env.reset()
+        self.assertIs(env.blackjack_deck, deck)
+        self.assertIs(env.dealer, dealer)
+        self.assertIs(env.player, player)
+        # a refilled shoe deals exactly what a new one would
+        self.assertEqual(deck.deck.tolist(), BlackjackDeck(1, np_random=rng).deck.tolist())
+        self.assertEqual(env.dealer.hand, deck.deck[:2].tolist())
+
+    def testResetReusesCountShoeAndHands(self):
+        env = BlackjackEnvwithRunningCount(1, rho=0.5)
+        env.seed(5)
+        env.step(2)  # player joins game
+        deck, dealer, player = env.blackjack_deck, env.dealer, env.player
+        while not env.step(3)[2]:
+            pass
+        rng = np.random.default_rng()
+        rng.bit_generator.state = env.deck_rng.bit_generator.state
+        env.reset()
+        self.assertIs(env.blackjack_deck, deck)
+        self.assertIs(env.dealer, dealer)
+        new_deck = BlackjackDeckwithCount(1, rho=0.5, np_random=rng)
+        self.assertEqual(deck.deck.tolist(), new_deck.deck.tolist())
+        self.assertEqual((deck.cards_used, deck.reshuffled), (4, False))
+        self.assertEqual(deck.composition.sum(), 48)
+        self.assertEqual(deck.count, sum(COUNTING_SYSTEMS["Hi-Lo"][deck.deck[:4]]))
+        self.assertIsNone(env.player)
+        env.step(2)  # player joins game
+        self.assertIs(env.player, player)
+        self.assertFalse(env.player.reshuffled)
+
+    def testInstrumentationOff(self):
+        env = BlackjackEnvwithRunningCount(3)
+        _, _, _, info = env.step(3)
+        self.assertEqual(info, {})
+        self.assertEqual(env.get_stats(), {})
+
+    def testInstrumentation(self):
+        env = BlackjackEnvwithRunningCount(1, rho=0.5, instrument=True)
+        env.step(2)  # player joins game
+        done, steps = False, 1
+        while not done:
+            _, _, done, info = env.step(0)
+            steps += 1
+        # the step returning info is only timed once it returns
+        self.assertEqual(info["stats"]["step_calls"], steps - 1)
+        stats = env.get_stats()
+        self.assertEqual(stats["step_calls"], steps)
+        self.assertEqual(stats["action_2_frequency"], 1 / steps)
+        self.assertEqual(stats["reshuffles"], 1)
+        self.assertEqual(stats["hands"], steps)
+        self.assertEqual(stats["cards_drawn"], env.blackjack_deck.cards_used)
+        self.assertGreater(stats["step_seconds"], 0)
+
+        env.reset()
+        self.assertEqual(env.get_stats()["shoes"], 2)
+        # infos keep the counters of their own step
+        self.assertEqual(info["stats"]["shoes"], 1)
+
+    def testInstrumentationDealCutShort(self):
+        env = BlackjackEnvwithRunningCount(1, rho=0.5, instrument=True)
+        env.step(3)
+        env.dealer.set_state(((10, 10), 20, 0, False))
+        # the first card of the next deal reaches the reshuffle point
+        deck = env.blackjack_deck
+        deck.cursor = len(deck.deck) - deck.reshuffle_point - 1
+        _, _, done, _ = env.step(3)
+        self.assertTrue(done)
+        self.assertLess(len(env.dealer.hand), 2)
+        dealer_draws = env.stats.dealer_draws
+        env.step(3)
+        self.assertEqual(env.stats.hands, 3)
+        self.assertEqual(env.stats.dealer_draws, dealer_draws)
+
+    def testCustomEnvInstrumentation(self):
+        env = BlackjackCustomEnv(1, simple_game=True, instrument=True)
+        _, _, done, info = env.step(0)
+        self.assertTrue(done)
+        stats = info["stats"]
+        self.assertEqual(stats["hands"], 1)
+        self.assertEqual(stats["dealer_draws_per_hand"], len(env.dealer.hand) - 2)
+        self.assertEqual(stats["cards_drawn"], 2 + len(env.dealer.hand))
+
+    def testFlatObs(self):
+        for make_env in [
+            lambda flat_obs: BlackjackCustomEnv(3, max_hand_sum=24, flat_obs=flat_obs),
+            lambda flat_obs: BlackjackEnvwithRunningCount(
+                2, rho=0.5, counting_systems=("Hi-Lo", "Omega II"), flat_obs=flat_obs),
+        ]:
+            env, flat_env = make_env(False), make_env(True)
+            self.assertEqual(flat_env.observation_space.n, flat_env.n_states)
+            for env_seed in range(20):
+                env.seed(env_seed)
+                flat_env.seed(env_seed)
+                obs, flat = env.reset(), flat_env.reset()
+                done = False
+                for action in [2, 1, 1, 0, 3, 0, 0, 0, 0]:
+                    self.assertIsInstance(flat, int)
+                    self.assertEqual(flat, env.state_index(obs))
+                    max_sum = flat_env.get_state_layout()[0][0] - 1
+                    self.assertEqual(flat_env.index_to_state(flat), (min(obs[0], max_sum),
+                                                                     *obs[1:]))
+                    self.assertTrue(flat_env.observation_space.contains(flat))
+                    if done:
+                        break
+                    action = action % env.action_space.n
+                    obs, _, done, _ = env.step(action)
+                    flat, _, _, _ = flat_env.step(action)
+
+    def testFlatObsClamped(self):
+        env = BlackjackEnvwithRunningCount(1, flat_obs=True)
+        env.step(2)
+        env.player.set_state(((10, 10, 9, 10), 39, 0, False))
+        for count in [-30, 30]:
+            env.blackjack_deck.counts[0] = count
+            obs = env._get_obs()
+            self.assertTrue(env.observation_space.contains(obs))
+            self.assertEqual(obs, env.state_index((39, env.dealer.hand[0], False, count, False)))
+            self.assertEqual(env.index_to_state(obs)[3], max(min(count, 20), -20))
+
+    def testSnapshotRestore(self):
+        for env in [BlackjackCustomEnv(1), BlackjackEnvwithRunningCount(1, rho=0.5),
+                    BlackjackEnvwithTrueCount(1, rho=0.5)]:
+            env.seed(3)
+            env.reset()
+            env.step(2)
+            snapshot = env.snapshot()
+            obs = env._get_obs()
+            actions = [action % env.action_space.n for action in [1, 3, 2, 0, 1, 0]]
+            first = [env.step(action) for action in actions]
+            # the branch reaches a reset, whose new shoe the snapshot's generator state replays
+            first += [env.reset()] + [env.step(0) for _ in range(3)]
+            for _ in range(2):
+                env.restore(snapshot)
+                self.assertEqual(env._get_obs(), obs)
+                replay = [env.step(action) for action in actions]
+                replay += [env.reset()] + [env.step(0) for _ in range(3)]
+                self.assertEqual(str(replay), str(first))
+
+    def testRestoreMissingPlayer(self):
+        env = BlackjackEnvwithRunningCount(3)
+        env.step(2)  # player joins game
+        snapshot = env.snapshot()
+        env.step(3)  # player observes, so has no hand
+        self.assertIsNone(env.player)
+        env.restore(snapshot)
+        self.assertEqual(env.player.get_state(), snapshot.hands[2])
+        self.assertFalse(env.observing)
+
+    def testArrayObs(self):
+        for make_env in [
+            lambda **kwargs: BlackjackCustomEnv(3, **kwargs),
+            lambda **kwargs: BlackjackEnvwithRunningCount(
+                2, rho=0.5, counting_systems=("Hi-Lo", "Omega II"), **kwargs),
+            lambda **kwargs: BlackjackEnvwithRunningCount(1, observe_composition=True,
+                                                          **kwargs),
+            lambda **kwargs: BlackjackEnvwithRunningCount(1, flat_obs=True, **kwargs),
+        ]:
+            env, array_env = make_env(), make_env(array_obs=True)
+            for env_seed in range(10):
+                env.seed(env_seed)
+                array_env.seed(env_seed)
+                obs, buffer = env.reset(), array_env.reset()
+                self.assertEqual(buffer.dtype, array_env.observation_space.dtype)
+                done = False
+                for action in [2, 1, 1, 0, 3, 0, 0, 0]:
+                    self.assertEqual(np.asarray(obs).tolist(), buffer.tolist())
+                    if done:
+                        break
+                    action = action % env.action_space.n
+                    obs, reward, done, _ = env.step(action)
+                    array_obs, array_reward, _, _ = array_env.step(action)
+                    self.assertIs(array_obs, buffer)
+                    self.assertIsInstance(reward, np.float32)
+                    self.assertEqual(reward, array_reward)
+
+    def testObsBuffer(self):
+        env = BlackjackEnvwithRunningCount(1)
+        batch = np.zeros((2, *env.observation_space.shape), dtype=np.int64)
+        env.set_obs_buffer(batch[1])
+        obs = env.reset()
+        self.assertEqual(batch[1].tolist(), obs.tolist())
+        self.assertFalse(batch[0].any())
+        with self.assertRaises(ValueError):
+            env.set_obs_buffer(np.zeros(env.observation_space.shape, dtype=np.float32))
+
+    def testFlatObsWithComposition(self):
+        with self.assertRaises(ValueError):
+            BlackjackEnvwithRunningCount(3, observe_composition=True, flat_obs=True)
+
     def testReset(self):
         env = BlackjackEnvwithRunningCount(1)
         env.reset()
@@ -81,6 +388,18 @@ class TestGameSimulator(unittest.TestCase):
         self.assertNotEqual(env.dummy.hand, prev_dummy, "Incorrect Dummy Hand")
         self.assertNotEqual(env.player.hand, prev_player, "Incorrect Player Hand")
 
+    def testWithoutObserve(self):
+        env = BlackjackEnvwithRunningCount(1, rho=0.5, allow_observe=False)
+        self.assertFalse(env.observing)
+        player = env.player
+        done = False
+        while not done:
+            _, _, done, _ = env.step(0)
+            self.assertIs(env.player, player, "Player hand should be reused")
+        env.reset()
+        self.assertIs(env.player, player)
+        self.assertEqual(len(env.player.hand), 2)
+
     def testObserve(self):
         env = BlackjackEnvwithRunningCount(1)
         self.assertTrue(env.observing, "Default stating state is observing")
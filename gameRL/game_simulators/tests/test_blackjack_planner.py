@@ -0,0 +1,85 @@
+import unittest
+
+from gameRL.game_simulators.blackjack_count import BlackjackEnvwithRunningCount
+from gameRL.game_simulators.blackjack_planner import (
+    DOUBLE_DOWN,
+    HIT,
+    STICK,
+    ExpectimaxAgent,
+    TranspositionTable,
+)
+from gameRL.game_simulators.blackjack_solver import full_shoe, remove_cards
+
+
+class TestBlackjackPlanner(unittest.TestCase):
+    def testTranspositionTable(self):
+        table = TranspositionTable(max_size=2)
+        table.put("a", 1)
+        table.put("b", 2)
+        self.assertEqual(table.get("a"), 1)
+        table.put("c", 3)
+        # "b" was least recently used
+        self.assertIsNone(table.get("b"))
+        self.assertEqual(table.get("a"), 1)
+        self.assertEqual((table.hits, table.misses, table.evictions), (2, 1, 1))
+        self.assertEqual(len(table), 2)
+
+    def testBasicDecisions(self):
+        env = BlackjackEnvwithRunningCount(6)
+        agent = ExpectimaxAgent(env, seed=0)
+        shoe = full_shoe(6)
+        values = agent.action_values(20, False, 2, 10, shoe)
+        self.assertEqual(max(values, key=values.get), STICK)
+        values = agent.action_values(5, False, 2, 10, shoe)
+        self.assertEqual(max(values, key=values.get), HIT)
+        values = agent.action_values(11, False, 2, 6, shoe)
+        self.assertEqual(max(values, key=values.get), DOUBLE_DOWN)
+        # going bust costs more than the stake in this env, so a full shoe favours the house,
+        # and a shoe rich in tens less so
+        seat_value = agent.seat_value(shoe)
+        self.assertTrue(-0.2 < seat_value < 0)
+        self.assertGreater(agent.seat_value(remove_cards(shoe, [2, 3, 4, 5, 6] * 8)),
+                           seat_value)
+
+    def testTranspositions(self):
+        env = BlackjackEnvwithRunningCount(6)
+        # at depth 2, drawing 2 then 3 reaches the same node as drawing 3 then 2
+        agent = ExpectimaxAgent(env, max_depth=3, n_rollouts=1, seed=0)
+        shoe = full_shoe(6)
+        agent.action_values(8, False, 2, 10, shoe)
+        misses = agent.table.misses
+        self.assertGreater(agent.table.hits, 0)
+        agent.action_values(8, False, 2, 10, shoe)
+        self.assertEqual(agent.table.misses, misses)
+
+    def testKeepsWinningHand(self):
+        env = BlackjackEnvwithRunningCount(1)
+        env.seed(0)
+        env.step(2)  # player joins game
+        env.player.set_state(((10, 10), 20, 0, False))
+        env.dealer.set_state(((6, 10), 16, 0, False))
+        agent = ExpectimaxAgent(env, seed=0)
+        # leaving would forfeit a hand that sticking most likely wins
+        self.assertEqual(agent.act(), STICK)
+
+    def testPlaysEnv(self):
+        for allow_observe in [True, False]:
+            env = BlackjackEnvwithRunningCount(1, rho=0.5, allow_observe=allow_observe)
+            env.seed(0)
+            agent = ExpectimaxAgent(env, max_depth=2, time_budget=0.05, table_size=1000,
+                                    seed=0)
+            env.reset()
+            done = False
+            while not done:
+                action = agent.predict()[0]
+                self.assertTrue(env.action_space.contains(action))
+                _, _, done, _ = env.step(action)
+            stats = agent.stats()
+            self.assertGreater(stats["decisions"], 0)
+            self.assertLessEqual(stats["table_size"], 1000)
+            self.assertEqual(stats["table_hits"] + stats["table_misses"],
+                             agent.table.hits + agent.table.misses)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+
+import numpy as np
+
+from gameRL.game_simulators.blackjack import DEALER_MAX, VecBlackjackEnv
+from gameRL.game_simulators.blackjack_solver import (
+    DOUBLE_DOWN,
+    HIT,
+    STICK,
+    BlackjackSolver,
+    draws,
+    full_shoe,
+    remove_cards,
+)
+
+
+def brute_force_dealer(hard_total, has_ace, composition, max_hand_sum):
+    """Reference dealer distribution, drawing one card at a time"""
+    hand_sum = hard_total + 10 if has_ace and hard_total + 10 <= max_hand_sum else hard_total
+    dist = np.zeros(max_hand_sum + 1)
+    if hand_sum >= DEALER_MAX:
+        dist[0 if hard_total > max_hand_sum else hand_sum] = 1
+        return dist
+    for card, prob, rest in draws(composition):
+        dist += prob * brute_force_dealer(
+            hard_total + card, has_ace or card == 1, rest, max_hand_sum
+        )
+    return dist
+
+
+class TestBlackjackSolver(unittest.TestCase):
+    def testDealerDistribution(self):
+        for max_hand_sum in [19, 21, 24]:
+            solver = BlackjackSolver(N_decks=1, max_hand_sum=max_hand_sum)
+            shoe = remove_cards(full_shoe(1), [10, 7, 5])
+            for dealer_card in [1, 6, 10]:
+                expected = brute_force_dealer(
+                    dealer_card, dealer_card == 1, shoe, max_hand_sum
+                )
+                actual = solver.dealer_distribution(dealer_card, shoe)
+                np.testing.assert_allclose(actual, expected)
+
+    def testInfiniteDealerDistribution(self):
+        solver = BlackjackSolver(infinite_deck=True)
+        for dealer_card in range(1, 11):
+            dist = solver.dealer_distribution(dealer_card, None)
+            self.assertAlmostEqual(dist.sum(), 1)
+            np.testing.assert_allclose(dist, brute_force_dealer(
+                dealer_card, dealer_card == 1, None, 21
+            ))
+
+    def testBasicDecisions(self):
+        solver = BlackjackSolver(infinite_deck=True)
+        self.assertEqual(solver.optimal_action([5, 6], 6), DOUBLE_DOWN)
+        self.assertEqual(solver.optimal_action([10, 10], 10), STICK)
+        self.assertEqual(solver.optimal_action([2, 3], 10), HIT)
+        simple_solver = BlackjackSolver(infinite_deck=True, simple_game=True)
+        self.assertNotIn(DOUBLE_DOWN, simple_solver.action_values([5, 6], 6))
+
+    def testOptimalBeatsFixedPolicies(self):
+        solver = BlackjackSolver(infinite_deck=True)
+        for action in [STICK, HIT, DOUBLE_DOWN]:
+            self.assertGreater(solver.regret(lambda obs: action), 0)
+
+    def testMatchesSimulation(self):
+        num_tables = 200000
+        solver = BlackjackSolver(N_decks=1)
+        for action in [STICK, DOUBLE_DOWN]:
+            env = VecBlackjackEnv(num_tables, 1, seed=0)
+            env.reset()
+            _, rewards, _, _ = env.step(np.full(num_tables, action))
+            expected = solver.expected_value(lambda obs: action)
+            self.assertAlmostEqual(rewards.mean(), expected, delta=0.015)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
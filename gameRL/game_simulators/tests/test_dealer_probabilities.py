@@ -0,0 +1,65 @@
+import unittest
+
+import numpy as np
+
+from gameRL.game_simulators.blackjack import DEALER_MAX, BlackjackDeck, BlackjackHand
+from gameRL.game_simulators.dealer_probabilities import (
+    _finite_deck_distribution,
+    dealer_bust_probability,
+    dealer_distribution,
+    full_shoe,
+    infinite_deck_table,
+    stand_outcomes,
+)
+
+
+class TestDealerProbabilities(unittest.TestCase):
+    def testInfiniteDeckTable(self):
+        for max_hand_sum in [19, 21, 24]:
+            table = infinite_deck_table(max_hand_sum)
+            np.testing.assert_allclose(table[1:].sum(axis=1), 1)
+            self.assertFalse(table.flags.writeable)
+
+    def testLargeShoeApproachesInfiniteDeck(self):
+        for dealer_card in range(1, 11):
+            shoe = list(full_shoe(1000))
+            shoe[dealer_card - 1] -= 1
+            np.testing.assert_allclose(
+                dealer_distribution(dealer_card, shoe),
+                dealer_distribution(dealer_card),
+                atol=1e-3,
+            )
+
+    def testMatchesDealerDraws(self):
+        """Bust rate of the env's dealer drawing to DEALER_MAX from a single deck"""
+        rng = np.random.default_rng(0)
+        num_hands = 20000
+        busts = 0
+        for _ in range(num_hands):
+            deck = BlackjackDeck(1, np_random=rng)
+            while deck.deck[0] != 6:  # the dealer's up card
+                deck.shuffle()
+            dealer = BlackjackHand(deck, 21)
+            while dealer.sum_hand() < DEALER_MAX:
+                dealer.draw_card()
+            busts += dealer.is_bust()
+        shoe = list(full_shoe(1))
+        shoe[5] -= 1
+        self.assertAlmostEqual(busts / num_hands, dealer_bust_probability(6, shoe), delta=0.015)
+
+    def testStandOutcomes(self):
+        win, tie, lose = stand_outcomes(18, 10)
+        self.assertAlmostEqual(win + tie + lose, 1)
+        self.assertGreater(lose, win)
+        self.assertEqual(stand_outcomes(21, 6)[2], 0)
+
+    def testCached(self):
+        shoe = full_shoe(2)
+        dealer_distribution(7, shoe)
+        hits = _finite_deck_distribution.cache_info().hits
+        dealer_distribution(7, np.array(shoe))
+        self.assertEqual(_finite_deck_distribution.cache_info().hits, hits + 1)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
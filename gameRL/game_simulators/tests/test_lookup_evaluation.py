@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+
+from gameRL.game_simulators.blackjack import BlackjackCustomEnv, spawn_seeds
+from gameRL.game_simulators.blackjack_count import BlackjackEnvwithRunningCount
+from gameRL.utils.evaluation import evaluate_lookup_policy, play_seeded_episodes
+
+
+def threshold_policy(env, threshold):
+    """Lookup table that hits below threshold"""
+    return np.array([int(env.index_to_state(index)[0] < threshold)
+                     for index in range(env.n_states)])
+
+
+class ThresholdPolicy:
+    def __init__(self, threshold):
+        self.threshold = threshold
+
+    def predict(self, obs, deterministic=True):
+        return int(obs[0] < self.threshold), None
+
+
+class TestLookupEvaluation(unittest.TestCase):
+    def testMatchesSequentialEvaluation(self):
+        env = BlackjackCustomEnv(1, simple_game=True)
+        evaluation = evaluate_lookup_policy(threshold_policy(env, 17), env, 200000)
+        sequential = play_seeded_episodes(ThresholdPolicy(17), env, spawn_seeds(0, 20000))
+        difference = abs(evaluation.mean_reward - sequential.mean())
+        self.assertLess(difference, 4 * np.hypot(evaluation.std_error,
+                                                 sequential.std() / np.sqrt(len(sequential))))
+
+    def testVisitStatistics(self):
+        env = BlackjackCustomEnv(1, simple_game=True)
+        # always standing takes one decision per episode
+        evaluation = evaluate_lookup_policy(np.zeros(env.n_states, dtype=np.int64), env,
+                                            n_episodes=10001, n_envs=1000)
+        self.assertEqual(evaluation.n_episodes, 11000)
+        self.assertEqual(evaluation.state_visits.sum(), 11000)
+        self.assertAlmostEqual(evaluation.visit_frequencies().sum(), 1)
+        self.assertAlmostEqual(evaluation.state_rewards.sum(),
+                               evaluation.episode_rewards.sum())
+        visited = evaluation.state_visits > 0
+        self.assertTrue(np.all(np.isfinite(evaluation.state_mean_rewards()[visited])))
+
+    def testRunningCountEnv(self):
+        env = BlackjackEnvwithRunningCount(1, rho=0.5)
+        # join, then always stand
+        policy = np.array([2 if env.index_to_state(index)[-1] else 0
+                           for index in range(env.n_states)])
+        evaluation = evaluate_lookup_policy(policy, env, n_episodes=500, n_envs=100)
+        self.assertEqual(evaluation.n_episodes, 500)
+        self.assertGreater(evaluation.state_visits.sum(), 500)
+
+    def testPolicyShape(self):
+        env = BlackjackCustomEnv(1)
+        with self.assertRaises(ValueError):
+            evaluate_lookup_policy(np.zeros(10, dtype=np.int64), env)
+
+
+if __name__ == "__main__":
+    unittest.main()
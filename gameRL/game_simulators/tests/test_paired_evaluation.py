@@ -0,0 +1,61 @@
+import unittest
+
+import numpy as np
+
+from gameRL.game_simulators.blackjack import BlackjackCustomEnv
+from gameRL.utils.evaluation import paired_evaluate
+
+
+class ThresholdPolicy:
+    """Hits below threshold, with the predict() interface of stable-baselines models"""
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+
+    def predict(self, obs, deterministic=True):
+        return int(obs[0] < self.threshold), None
+
+
+def make_env():
+    return BlackjackCustomEnv(1, simple_game=True)
+
+
+class TestPairedEvaluation(unittest.TestCase):
+    def testSameModelPairsExactly(self):
+        """Identical models see identical shoes, so their difference is exactly zero"""
+        evaluation = paired_evaluate(
+            {"a": ThresholdPolicy(17), "b": ThresholdPolicy(17)}, make_env, min_episodes=300
+        )
+        self.assertEqual(evaluation.n_episodes, 300)
+        self.assertEqual(evaluation.difference("a", "b"), (0.0, 0.0))
+
+    def testReproducible(self):
+        models = {"17": ThresholdPolicy(17), "12": ThresholdPolicy(12)}
+        first = paired_evaluate(models, make_env, max_episodes=500, seed=3)
+        second = paired_evaluate(models, make_env, max_episodes=500, seed=3)
+        np.testing.assert_array_equal(first.rewards, second.rewards)
+
+    def testPairingNarrowsInterval(self):
+        evaluation = paired_evaluate(
+            {"17": ThresholdPolicy(17), "16": ThresholdPolicy(16)}, make_env,
+            target_half_width=0, max_episodes=2000,
+        )
+        self.assertEqual(evaluation.n_episodes, 2000)
+        std_errors = evaluation.std_errors()
+        unpaired = 1.96 * np.hypot(std_errors["17"], std_errors["16"])
+        self.assertLess(evaluation.ci_half_width(), unpaired / 2)
+        # rewards spread far wider than their mean is uncertain
+        self.assertAlmostEqual(evaluation.std_rewards()["16"], evaluation.rewards[:, 1].std())
+        self.assertGreater(evaluation.std_rewards()["16"], 40 * std_errors["16"])
+
+    def testStopsEarly(self):
+        evaluation = paired_evaluate(
+            {"17": ThresholdPolicy(17), "16": ThresholdPolicy(16)}, make_env,
+            target_half_width=0.1, max_episodes=5000,
+        )
+        self.assertLess(evaluation.n_episodes, 5000)
+        self.assertLess(evaluation.ci_half_width(), 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import functools
+import unittest
+
+import numpy as np
+
+from gameRL.game_simulators.blackjack import BlackjackCustomEnv, spawn_seeds
+from gameRL.game_simulators.blackjack_count import BlackjackEnvwithRunningCount
+from gameRL.game_simulators.shared_vec_env import SharedMemoryVecEnv, VecEnv
+
+
+def broken_env():
+    raise ValueError("cannot build env")
+
+
+class TestSharedMemoryVecEnv(unittest.TestCase):
+    def testMatchesSequentialEnvs(self):
+        for env_fn in [functools.partial(BlackjackCustomEnv, 1),
+                       functools.partial(BlackjackEnvwithRunningCount, 1, rho=0.5),
+                       functools.partial(BlackjackEnvwithRunningCount, 1, flat_obs=True)]:
+            n_envs = 5
+            vec_env = SharedMemoryVecEnv(env_fn, n_envs, n_workers=2, seed=0)
+            envs = []
+            for seed in spawn_seeds(0, n_envs):
+                envs.append(env_fn())
+                envs[-1].seed(seed)
+            try:
+                obs = vec_env.reset()
+                self.assertEqual(obs.tolist(), [np.asarray(env.reset()).tolist()
+                                                for env in envs])
+                rng = np.random.default_rng(0)
+                for _ in range(50):
+                    actions = rng.integers(vec_env.action_space.n, size=n_envs)
+                    obs, rewards, dones, infos = vec_env.step(actions)
+                    for i, env in enumerate(envs):
+                        expected, reward, done, _ = env.step(int(actions[i]))
+                        self.assertEqual(rewards[i], reward)
+                        self.assertEqual(dones[i], done)
+                        if done:
+                            self.assertEqual(infos[i]["terminal_observation"].tolist(),
+                                             np.asarray(expected).tolist())
+                            expected = env.reset()
+                        self.assertEqual(obs[i].tolist(), np.asarray(expected).tolist())
+            finally:
+                vec_env.close()
+
+    def testEnvMethods(self):
+        vec_env = SharedMemoryVecEnv(
+            functools.partial(BlackjackEnvwithRunningCount, 1, rho=0.5), 3, n_workers=2)
+        try:
+            self.assertEqual(vec_env.get_attr("rho"), [0.5] * 3)
+            vec_env.set_attr("natural_bonus", False, indices=[1])
+            self.assertEqual(vec_env.get_attr("natural_bonus"), [True, False, True])
+            self.assertEqual(vec_env.env_method("get_stats", indices=2), [{}])
+        finally:
+            vec_env.close()
+
+    def testSeed(self):
+        env_fn = functools.partial(BlackjackEnvwithRunningCount, 1, rho=0.5)
+        vec_env = SharedMemoryVecEnv(env_fn, 3, n_workers=2, seed=0)
+        try:
+            self.assertEqual(len(vec_env.seed(5)), 3)
+            expected = []
+            for seed in spawn_seeds(5, 3):
+                env = env_fn()
+                env.seed(seed)
+                expected.append(np.asarray(env.reset()).tolist())
+            self.assertEqual(vec_env.reset().tolist(), expected)
+        finally:
+            vec_env.close()
+
+    @unittest.skipIf(VecEnv is object, "stable-baselines is not installed")
+    def testImplementsVecEnv(self):
+        self.assertFalse(SharedMemoryVecEnv.__abstractmethods__)
+
+    def testWorkerError(self):
+        with self.assertRaises(ValueError):
+            SharedMemoryVecEnv(broken_env, 2)
+        vec_env = SharedMemoryVecEnv(functools.partial(BlackjackCustomEnv, 1), 2, n_workers=2)
+        with self.assertRaises(RuntimeError):
+            vec_env.env_method("no_such_method")
+        self.assertTrue(vec_env.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import io
+import pickle
+import unittest
+
+import numpy as np
+
+from gameRL.game_simulators.blackjack import BlackjackCustomEnv
+from gameRL.game_simulators.blackjack_count import BlackjackEnvwithRunningCount
+from gameRL.training_scripts.tabular import ALGORITHMS, TabularAgent, tabular_model_gens
+
+
+class TestTabularAgent(unittest.TestCase):
+    def testLearnsToStandOnHighTotals(self):
+        for algorithm in ALGORITHMS:
+            with self.subTest(algorithm=algorithm):
+                env = BlackjackCustomEnv(1, simple_game=True)
+                agent = TabularAgent(algorithm, env, seed=0).learn(200000)
+                # hitting on 20 almost always busts, hitting on 5 never does
+                self.assertEqual(agent.predict((20, 10, False))[0], 0)
+                self.assertEqual(agent.predict((5, 10, False))[0], 1)
+                self.assertGreater(agent.evaluate(5000), -0.15)
+
+    def testMonteCarloReturnsSpanRollouts(self):
+        """Visits of episodes longer than a rollout get their full return"""
+        agent = TabularAgent("monte_carlo", BlackjackCustomEnv(1), learning_rate=1.0)
+        states = np.array([[1], [2], [3]])
+        actions = np.zeros((3, 1), dtype=np.int64)
+        agent._monte_carlo_update(states[:2], actions[:2], np.array([[1.0], [2.0]]),
+                                  np.zeros((2, 1), dtype=bool))
+        self.assertEqual(agent.visits.sum(), 0)
+        agent._monte_carlo_update(states[2:], actions[2:], np.array([[4.0]]),
+                                  np.ones((1, 1), dtype=bool))
+        np.testing.assert_allclose(agent.q_table[[1, 2, 3], 0], [7, 6, 4])
+
+    def testModelGensPicklable(self):
+        """train_multi pickles the model generators to its spawned workers"""
+        model_gens = pickle.loads(pickle.dumps(tabular_model_gens(learning_rate=0.1)))
+        self.assertEqual([name for name, _ in model_gens], list(ALGORITHMS))
+        agent = model_gens[0][1](BlackjackCustomEnv(1), "runs/test")
+        self.assertEqual((agent.algorithm, agent.learning_rate), (ALGORITHMS[0], 0.1))
+        self.assertEqual(agent.tensorboard_log, "runs/test")
+
+    def testContinuedSchedule(self):
+        """A run split over learn calls explores as the same run in one call does"""
+        epsilons = []
+        for splits in [[4096], [1024, 3072]]:
+            agent = TabularAgent("sarsa", BlackjackCustomEnv(1), n_envs=16, seed=0)
+            seen = []
+            act = agent._act
+            agent._act = lambda states, eps: seen.append(eps) or act(states, eps)
+            for timesteps in splits:
+                agent.learn(timesteps, reset_num_timesteps=False, schedule_timesteps=4096)
+            self.assertEqual(agent.num_timesteps, 4096)
+            epsilons.append(seen)
+        # the split run picks its first action twice, with the same epsilon
+        self.assertEqual(epsilons[0], epsilons[1][:65] + epsilons[1][66:])
+
+    def testSaveLoad(self):
+        env = BlackjackEnvwithRunningCount(1, rho=0.5)
+        agent = TabularAgent("q_learning", env, n_envs=16, seed=0).learn(5000)
+        saved = io.BytesIO()
+        agent.save(saved)
+        saved.seek(0)
+        loaded = TabularAgent.load(saved)
+        np.testing.assert_array_equal(loaded.q_table, agent.q_table)
+        obs = env.reset()
+        self.assertEqual(loaded.predict(obs), agent.predict(obs))
+        self.assertEqual(loaded.num_timesteps, 5000 // 16 * 16)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+
+try:
+    from gameRL.training_scripts.train_comparison import (
+        VEC_MODELS,
+        default_params,
+        make_env,
+        make_train_env,
+    )
+    from gameRL.training_scripts.successive_halving import successive_halving
+    from gameRL.training_scripts.tabular import TabularAgent, tabular_model_gens
+    from gameRL.training_scripts.utils import LargeEvalCallback, learn_until
+except ImportError:  # training needs stable-baselines and TensorFlow 1.x
+    VEC_MODELS = ()
+
+from gameRL.game_simulators.blackjack_count import VecBlackjackEnvwithRunningCount
+
+
+@unittest.skipUnless(VEC_MODELS, "stable-baselines is not installed")
+class TestTrainComparison(unittest.TestCase):
+    def testTrainsOnVecEnv(self):
+        params = default_params()
+        params.update({"n_envs": 4, "vec_env": "inprocess"})
+        model_gens = dict(params["models_to_train"])
+        for name in VEC_MODELS:
+            with self.subTest(model=name):
+                env = make_train_env(params, name, lambda: make_env(0.5, 1, 21))
+                self.assertIsInstance(env, VecBlackjackEnvwithRunningCount)
+                self.assertEqual(env.num_envs, 4)
+                model = model_gens[name](env, None)
+                model.learn(total_timesteps=200)
+                self.assertGreaterEqual(model.num_timesteps, 200)
+                env.close()
+
+    def testLearnUntilContinuesRun(self):
+        params = default_params()
+        model = dict(params["models_to_train"])["dqn"](make_env(0.5, 1, 21), None)
+        model.exploration_fraction = 1.0
+        learn_until(model, 100, 400)
+        self.assertEqual(model.num_timesteps, 100)
+        callback = LargeEvalCallback(n_steps=1000)
+        learn_until(model, 200, 400, callback=callback)
+        self.assertEqual(model.num_timesteps, 200)
+        # the continued run is not evaluated as soon as it starts
+        self.assertEqual(callback.last_time_trigger, 100)
+        # with the schedule of the whole run, exploration is still decaying
+        self.assertGreater(model.exploration.value(model.num_timesteps),
+                           model.exploration_final_eps)
+
+    def testPromotedModelsContinue(self):
+        params = default_params()
+        params.update({"TIMESTEPS_PER_MODEL": 256 * 9, "RHO_TO_TRY": [0.5], "DECKS_TO_TRY": [1],
+                       "MAX_HAND_SUM_TO_TRY": [21], "reduce_runs": False, "eta": 3,
+                       "n_rungs": 2, "eval_episodes": 100,
+                       "models_to_train": tabular_model_gens(("q_learning", "sarsa"))})
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                log = successive_halving(params)
+                promoted = log[log["rung"] == 1]
+                self.assertEqual(len(promoted), 1)
+                self.assertEqual(promoted["timesteps"].tolist(), [256 * 9])
+                name = promoted["model"].iloc[0]
+                agent = TabularAgent.load(f"saved_models/{name}_sum_21_rho_0.5_nd_1.zip")
+                self.assertEqual(agent.num_timesteps, 256 * 9)
+            finally:
+                os.chdir(cwd)
+
+    def testScalarEnvWithoutVecEnvs(self):
+        params = default_params()
+        env = make_train_env(params, VEC_MODELS[0], lambda: make_env(0.5, 1, 21))
+        self.assertEqual(env.N_decks, 1)
+        self.assertFalse(hasattr(env, "num_envs"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+import unittest
+
+import numpy as np
+
+from gameRL.game_simulators.blackjack import (
+    BlackjackCustomEnv,
+    VecBlackjackEnv,
+)
+from gameRL.game_simulators.blackjack_count import (
+    COUNTING_SYSTEMS,
+    BlackjackEnvwithRunningCount,
+    VecBlackjackEnvwithRunningCount,
+    VecBlackjackShoewithCount,
+)
+
+
+def run_scalar_episodes(env, action, num_episodes):
+    rewards = []
+    for _ in range(num_episodes):
+        env.reset()
+        done = False
+        while not done:
+            _, reward, done, _ = env.step(action)
+        rewards.append(reward)
+    return np.array(rewards)
+
+
+def three_standard_errors(samples1, samples2):
+    """Three standard errors of the difference between two independent sample means"""
+    return 3 * np.hypot(
+        np.std(samples1) / np.sqrt(len(samples1)), np.std(samples2) / np.sqrt(len(samples2))
+    )
+
+
+class TestVecBlackjackEnv(unittest.TestCase):
+    def testShapes(self):
+        env = VecBlackjackEnv(16, 3, seed=0)
+        obs = env.reset()
+        self.assertEqual(obs.shape, (16, 3))
+        obs, rewards, dones, infos = env.step(np.zeros(16, dtype=int))
+        self.assertEqual(obs.shape, (16, 3))
+        self.assertEqual(rewards.dtype, np.float32)
+        self.assertTrue(np.all(dones), "Sticking always ends the hand")
+        self.assertEqual(len(infos), 16)
+        self.assertIn("terminal_observation", infos[0])
+
+    def testAutoReset(self):
+        env = VecBlackjackEnv(64, 1, seed=0)
+        env.reset()
+        for _ in range(20):
+            obs, _, _, _ = env.step(np.ones(64, dtype=int))
+            # tables are redealt as soon as they finish, so no live hand is bust
+            self.assertTrue(np.all(env.player_total <= env.max_hand_sum))
+            self.assertTrue(np.all(obs[:, 1] >= 1))
+
+    def testRewards(self):
+        env = VecBlackjackEnv(1000, 3, seed=0)
+        env.reset()
+        for action in range(3):
+            _, rewards, _, _ = env.step(np.full(1000, action))
+            self.assertTrue(set(np.unique(rewards)) <= {-2, -1, 0, 1, 1.5, 2})
+
+    def testSimpleGameIllegalAction(self):
+        env = VecBlackjackEnv(4, 1, simple_game=True, seed=0)
+        env.reset()
+        with self.assertRaises(ValueError):
+            env.step(np.full(4, 2))
+
+    def testSeeded(self):
+        env1 = VecBlackjackEnv(32, 3, seed=5)
+        env2 = VecBlackjackEnv(32, 3, seed=5)
+        np.testing.assert_array_equal(env1.reset(), env2.reset())
+        actions = np.random.default_rng(0).integers(0, 3, 32)
+        for result1, result2 in zip(env1.step(actions)[:3], env2.step(actions)[:3]):
+            np.testing.assert_array_equal(result1, result2)
+
+    def testMatchesScalarEnv(self):
+        num_tables = 20000
+        for max_hand_sum in [19, 21, 24]:
+            for action in [0, 2]:
+                vec_env = VecBlackjackEnv(num_tables, 3, max_hand_sum=max_hand_sum, seed=0)
+                vec_env.reset()
+                _, rewards, _, _ = vec_env.step(np.full(num_tables, action))
+                scalar_env = BlackjackCustomEnv(3, max_hand_sum=max_hand_sum)
+                scalar_env.seed(0)
+                expected = run_scalar_episodes(scalar_env, action, num_tables)
+                self.assertAlmostEqual(
+                    rewards.mean(), expected.mean(), delta=three_standard_errors(rewards, expected)
+                )
+
+
+class TestVecBlackjackEnvwithRunningCount(unittest.TestCase):
+    def testShoeReshufflePoint(self):
+        shoe = VecBlackjackShoewithCount(3, 2, rho=0.25, np_random=np.random.default_rng(0))
+        tables = np.arange(3)
+        dealt = [shoe.draw_cards(tables) for _ in range(25)]
+        self.assertTrue(np.all(np.array(dealt) > 0))
+        np.testing.assert_array_equal(
+            shoe.counts[:, 0], COUNTING_SYSTEMS["Hi-Lo"][np.array(dealt)].sum(axis=0)
+        )
+        self.assertFalse(np.any(shoe.reshuffled))
+        # the 26th card reaches the reshuffle point and is counted but not dealt
+        np.testing.assert_array_equal(shoe.draw_cards(tables), 0)
+        self.assertTrue(np.all(shoe.reshuffled))
+        np.testing.assert_array_equal(shoe.cards_used, 26)
+        counts = shoe.counts.copy()
+        np.testing.assert_array_equal(shoe.draw_cards(tables), 0)
+        np.testing.assert_array_equal(shoe.counts, counts)
+
+    def testSeveralCounts(self):
+        systems = ["Hi-Lo", "Zen", "Wong Halves"]
+        env = VecBlackjackEnvwithRunningCount(8, 2, counting_systems=systems, seed=0)
+        obs = env.reset()
+        self.assertEqual(obs.shape, (8, 7))
+        self.assertEqual(len(env.observation_space.nvec), 7)
+        np.testing.assert_array_equal(obs[:, 3:6], env.shoe.counts)
+
+    def testCompositionObservation(self):
+        env = VecBlackjackEnvwithRunningCount(8, 2, observe_composition=True, seed=0)
+        obs = env.reset()
+        self.assertEqual(obs.shape, (8, 15))
+        np.testing.assert_array_equal(obs[:, 5:].sum(axis=1), env.shoe.remaining)
+
+    def testObservingFlag(self):
+        env = VecBlackjackEnvwithRunningCount(8, 1, seed=0)
+        obs = env.reset()
+        self.assertEqual(obs.shape, (8, 5))
+        self.assertTrue(np.all(obs[:, 4] == 1), "Default starting state is observing")
+        obs, _, dones, _ = env.step(np.full(8, 2))
+        self.assertTrue(np.all(obs[~dones, 4] == 0), "Player should have joined")
+        self.assertTrue(np.all(obs[~dones, 0] >= 4))
+        obs, rewards, dones, _ = env.step(np.full(8, 3))
+        self.assertTrue(np.all(obs[:, 4] == 1), "Player should be observing")
+        np.testing.assert_array_equal(rewards, 0)
+
+    def testShoeEndsGame(self):
+        env = VecBlackjackEnvwithRunningCount(16, 1, seed=0)
+        env.reset()
+        finished = np.zeros(16, dtype=bool)
+        for _ in range(20):
+            _, _, dones, infos = env.step(np.full(16, 3))
+            finished |= dones
+            for i in np.flatnonzero(dones):
+                np.testing.assert_array_equal(infos[i]["terminal_observation"][:3], [0, 1, 0])
+        self.assertTrue(np.all(finished))
+
+    def testMatchesScalarEnv(self):
+        num_tables = 2000
+        rng = np.random.default_rng(0)
+        vec_env = VecBlackjackEnvwithRunningCount(num_tables, 1, rho=0.75, seed=0)
+        vec_env.reset()
+        vec_rewards = []
+        for _ in range(10):
+            _, rewards, _, _ = vec_env.step(rng.integers(0, 5, num_tables))
+            vec_rewards.append(rewards)
+        scalar_env = BlackjackEnvwithRunningCount(1, rho=0.75)
+        scalar_env.seed(0)
+        scalar_env.reset()
+        scalar_rewards = []
+        for _ in range(num_tables * 10):
+            _, reward, done, _ = scalar_env.step(int(rng.integers(0, 5)))
+            scalar_rewards.append(reward)
+            if done:
+                scalar_env.reset()
+        # steps within a table are correlated, so compare per-table means of 10 steps
+        vec_means = np.mean(vec_rewards, axis=0)
+        scalar_means = np.reshape(scalar_rewards, (num_tables, 10)).mean(axis=1)
+        self.assertAlmostEqual(
+            vec_means.mean(),
+            scalar_means.mean(),
+            delta=three_standard_errors(vec_means, scalar_means),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,144 @@
+# Successive halving over the train_comparison sweep: every configuration gets a small
+# budget and only the best ones keep training on larger budgets
+import functools
+from pathlib import Path
+from typing import Dict, List
+
+import pandas as pd
+from stable_baselines.common.evaluation import evaluate_policy
+
+from gameRL.training_scripts.train_comparison import (
+    default_params,
+    get_combinations,
+    get_descriptor,
+    get_metadata,
+    make_env,
+    make_train_env,
+)
+from gameRL.training_scripts.tabular import TabularAgent
+from gameRL.training_scripts.utils import LargeEvalCallback, learn_until, save_with_metadata
+
+
+def rung_budgets(total_timesteps: int, n_rungs: int, eta: int) -> List[int]:
+    """Cumulative timesteps a configuration has trained for once it finishes each rung"""
+    return [int(total_timesteps * eta ** (rung - n_rungs + 1)) for rung in range(n_rungs)]
+
+
+def select_promoted(results: pd.DataFrame, eta: int, group_by_env: bool = True) -> pd.Index:
+    """
+    The top 1 / eta of results by mean reward, keeping at least one. With group_by_env the
+    models are only ranked against models trained on the same environment, since the reward
+    an environment allows differs between rho, deck counts and hand sums
+    """
+    groups = results.groupby(["rho", "num_decks", "max_hand_sum"]) if group_by_env \
+        else [(None, results)]
+    promoted = []
+    for _, group in groups:
+        keep = max(1, len(group) // eta)
+        promoted.extend(group.nlargest(keep, "mean_reward").index)
+    return pd.Index(promoted)
+
+
+def _build_agent(trial: Dict, env):
+    """
+    The trial's model on env, new on its first rung and otherwise reloaded from where the
+    last rung saved it, with the timesteps it has trained for
+    """
+    log = f"./runs/{trial['descriptor']}"
+    if trial["checkpoint"] is None:
+        return trial["model_gen"](env, log)
+    agent = trial["model_class"].load(trial["checkpoint"], env=env, tensorboard_log=log)
+    # stable-baselines does not save num_timesteps
+    agent.num_timesteps = trial["timesteps"]
+    return agent
+
+
+def successive_halving(params) -> pd.DataFrame:
+    """
+    Trains every combination of the sweep in params["n_rungs"] rungs. Each rung trains the
+    remaining models up to the rung's budget, which grows by params["eta"] every rung and
+    reaches params["TIMESTEPS_PER_MODEL"] on the last, evaluates them, and promotes the best
+    1 / eta of them. Models that are not promoted stop training.
+
+    Only the model training holds a TensorFlow graph and session: each model is built when
+    its first rung runs and saved to saved_models/ once the rung has trained it, where the
+    next rung reloads it from if it was promoted
+    :return: log of every rung's evaluations and decisions, also saved to saved_models/
+    """
+    eta = params.get("eta", 3)
+    n_eval_episodes = params.get("eval_episodes", 2000)
+    budgets = rung_budgets(params["TIMESTEPS_PER_MODEL"], params.get("n_rungs", 3), eta)
+    Path("saved_models").mkdir(parents=True, exist_ok=True)
+
+    trials: Dict[int, Dict] = {}
+    for index, (name, model_gen, rho, num_decks, max_hand_sum) in enumerate(
+            get_combinations(params)):
+        trials[index] = {"model": name, "model_gen": model_gen, "rho": rho,
+                         "num_decks": num_decks, "max_hand_sum": max_hand_sum,
+                         "descriptor": get_descriptor(name, rho, num_decks, max_hand_sum),
+                         "model_class": None, "checkpoint": None, "timesteps": 0}
+
+    log = []
+    alive = list(trials)
+    for rung, budget in enumerate(budgets):
+        rows = {}
+        for index in alive:
+            trial = trials[index]
+            env_fn = functools.partial(make_env, trial["rho"], trial["num_decks"],
+                                       trial["max_hand_sum"])
+            env = env_fn()
+            train_env = make_train_env(params, trial["model"], env_fn)
+            agent = _build_agent(trial, train_env)
+            trial["model_class"] = type(agent)
+            # tabular agents log their own evaluations
+            callback = None if isinstance(agent, TabularAgent) else LargeEvalCallback(
+                n_steps=budget // 100, eval_env_fn=env_fn,
+                n_eval_workers=params.get("eval_workers_per_model", 2))
+            # every rung continues one run over the full budget, so promoted and stopped
+            # models follow the same exploration schedule
+            learn_until(agent, budget, params["TIMESTEPS_PER_MODEL"], callback=callback)
+            trial["timesteps"] = agent.num_timesteps
+            reward, std = evaluate_policy(agent, env, n_eval_episodes=n_eval_episodes)
+            rows[index] = {"rung": rung, "timesteps": budget, "model": trial["model"],
+                           "rho": trial["rho"], "num_decks": trial["num_decks"],
+                           "max_hand_sum": trial["max_hand_sum"], "mean_reward": reward,
+                           "std_reward": std}
+            # the final model of trials that stop here, overwritten by the next rung otherwise
+            path = f"saved_models/{trial['descriptor'].replace('/', '_')}"
+            save_with_metadata(agent, path, get_metadata(
+                trial["model"], env, trial["rho"], trial["num_decks"], trial["max_hand_sum"],
+                trial["timesteps"]))
+            trial["checkpoint"] = f"{path}.zip"
+            env.close()
+            train_env.close()
+            # stable-baselines models hold their TensorFlow session until it is closed
+            if getattr(agent, "sess", None) is not None:
+                agent.sess.close()
+        results = pd.DataFrame.from_dict(rows, orient="index")
+
+        last_rung = rung == len(budgets) - 1
+        promoted = results.index if last_rung else select_promoted(
+            results, eta, params.get("group_by_env", True))
+        results["promoted"] = results.index.isin(promoted)
+        print(f"Rung {rung} ({budget} timesteps):")
+        print(results.sort_values("mean_reward", ascending=False).to_string(index=False))
+        log.append(results)
+        alive = [index for index in alive if index in promoted and not last_rung]
+
+    log = pd.concat(log, ignore_index=True)
+    log.to_csv("saved_models/halving_log.csv", index=False)
+    return log
+
+
+if __name__ == "__main__":
+    params = default_params()
+    params.update({
+        # finer grid than the full sweep, affordable since most runs stop early
+        "RHO_TO_TRY": [0.25, 0.5, 0.75, 0.85, 0.95],
+        "DECKS_TO_TRY": [1, 2, 3, 6, 10],
+        "MAX_HAND_SUM_TO_TRY": [19, 21, 24],
+        "reduce_runs": False,
+        "eta": 3,
+        "n_rungs": 3,
+    })
+    successive_halving(params)
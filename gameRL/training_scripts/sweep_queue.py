@@ -0,0 +1,200 @@
+# Resumable sweep of train_comparison driven by a directory queue, which workers on several
+# hosts sharing a filesystem can pull jobs from
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import pandas as pd
+
+from gameRL.training_scripts.train_comparison import (
+    default_params,
+    get_combinations,
+    get_descriptor,
+    train_one,
+)
+
+PENDING, CLAIMED, DONE, CHECKPOINTS = "pending", "claimed", "done", "checkpoints"
+
+
+def _write_json_atomic(path: Path, data: Dict) -> None:
+    tmp = path.with_name(f".{path.name}.{socket.gethostname()}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _make_dirs(queue_dir: Path) -> None:
+    for sub in (PENDING, CLAIMED, DONE, CHECKPOINTS):
+        (queue_dir / sub).mkdir(parents=True, exist_ok=True)
+
+
+def _job_id(name, rho, num_decks, max_hand_sum) -> str:
+    return get_descriptor(name, rho, num_decks, max_hand_sum).replace("/", "_")
+
+
+def is_done(queue_dir: Path, job_id: str) -> bool:
+    """A job is done once both its saved model and its result record exist"""
+    return (queue_dir / DONE / f"{job_id}.json").exists() and \
+        Path(f"saved_models/{job_id}.zip").exists()
+
+
+def enqueue_sweep(params, queue_dir) -> int:
+    """
+    Adds a job for every combination of the sweep that is not already queued, claimed or done
+    :return: number of jobs added
+    """
+    queue_dir = Path(queue_dir)
+    _make_dirs(queue_dir)
+    added = 0
+    for name, _, rho, num_decks, max_hand_sum in get_combinations(params):
+        job_id = _job_id(name, rho, num_decks, max_hand_sum)
+        if is_done(queue_dir, job_id) or (queue_dir / PENDING / f"{job_id}.json").exists() \
+                or (queue_dir / CLAIMED / f"{job_id}.json").exists():
+            continue
+        _write_json_atomic(queue_dir / PENDING / f"{job_id}.json",
+                           {"model": name, "rho": rho, "num_decks": num_decks,
+                            "max_hand_sum": max_hand_sum})
+        added += 1
+    return added
+
+
+def _write_lock(queue_dir: Path, job_id: str) -> None:
+    _write_json_atomic(queue_dir / CLAIMED / f"{job_id}.lock",
+                       {"host": socket.gethostname(), "pid": os.getpid(), "time": time.time()})
+
+
+def claim_job(queue_dir) -> Optional[Dict]:
+    """
+    Claims a pending job by renaming it into claimed/, which succeeds for exactly one worker
+    :return: the job, or None if no job is pending
+    """
+    queue_dir = Path(queue_dir)
+    for path in sorted((queue_dir / PENDING).glob("*.json")):
+        try:
+            # the rename keeps the modification time, which requeue_stale falls back on
+            # until the lock is written, so the job must not look stale once claimed
+            os.utime(path)
+            os.rename(path, queue_dir / CLAIMED / path.name)
+        except FileNotFoundError:
+            # another worker claimed it first
+            continue
+        _write_lock(queue_dir, path.stem)
+        with open(queue_dir / CLAIMED / path.name) as f:
+            job = json.load(f)
+        job["id"] = path.stem
+        return job
+    return None
+
+
+def release_job(queue_dir, job_id: str, requeue: bool = False) -> None:
+    queue_dir = Path(queue_dir)
+    claimed = queue_dir / CLAIMED / f"{job_id}.json"
+    if requeue:
+        os.replace(claimed, queue_dir / PENDING / claimed.name)
+    else:
+        claimed.unlink()
+    lock = queue_dir / CLAIMED / f"{job_id}.lock"
+    if lock.exists():
+        lock.unlink()
+
+
+def requeue_stale(queue_dir, stale_after: float = 3600) -> int:
+    """
+    Moves claimed jobs whose lock has not been refreshed for stale_after seconds, because
+    their worker died, back to pending. They resume from their last checkpoint
+    :return: number of jobs requeued
+    """
+    queue_dir = Path(queue_dir)
+    requeued = 0
+    for path in sorted((queue_dir / CLAIMED).glob("*.json")):
+        lock = queue_dir / CLAIMED / f"{path.stem}.lock"
+        try:
+            last_heartbeat = lock.stat().st_mtime if lock.exists() else path.stat().st_mtime
+            if time.time() - last_heartbeat < stale_after:
+                continue
+            release_job(queue_dir, path.stem, requeue=True)
+        except FileNotFoundError:
+            # released by its worker in the meantime
+            continue
+        requeued += 1
+    return requeued
+
+
+def run_worker(params, queue_dir, heartbeat_interval: float = 60) -> int:
+    """
+    Trains queued jobs until the queue is empty, checkpointing each under
+    <queue_dir>/checkpoints so a preempted job resumes where it stopped. A failed job is put
+    back in the queue before the error is raised
+    :return: number of jobs trained
+    """
+    queue_dir = Path(queue_dir)
+    _make_dirs(queue_dir)
+    Path("saved_models").mkdir(parents=True, exist_ok=True)
+    model_gens = dict(params["models_to_train"])
+    trained = 0
+    while True:
+        job = claim_job(queue_dir)
+        if job is None:
+            return trained
+        if is_done(queue_dir, job["id"]):
+            release_job(queue_dir, job["id"])
+            continue
+
+        # refresh the lock while training, so requeue_stale only picks up dead workers
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(heartbeat_interval):
+                _write_lock(queue_dir, job["id"])
+
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+        try:
+            try:
+                result = train_one(params, job["model"], model_gens[job["model"]], job["rho"],
+                                   job["num_decks"], job["max_hand_sum"],
+                                   checkpoint_dir=str(queue_dir / CHECKPOINTS))
+            finally:
+                stop.set()
+                thread.join()
+        except BaseException:
+            release_job(queue_dir, job["id"], requeue=True)
+            raise
+        _write_json_atomic(queue_dir / DONE / f"{job['id']}.json", result)
+        release_job(queue_dir, job["id"])
+        trained += 1
+
+
+def collect_results(queue_dir) -> pd.DataFrame:
+    """Summary table with the result record of every finished job"""
+    records = []
+    for path in sorted((Path(queue_dir) / DONE).glob("*.json")):
+        with open(path) as f:
+            records.append(json.load(f))
+    return pd.DataFrame(records)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resumable sweep of train_comparison")
+    parser.add_argument("command", choices=["enqueue", "work", "requeue", "summary"])
+    parser.add_argument("--queue-dir", default="sweep_queue")
+    parser.add_argument("--stale-after", type=float, default=3600,
+                        help="seconds without a heartbeat after which a claim is requeued")
+    args = parser.parse_args()
+
+    params = default_params()
+    if args.command == "enqueue":
+        print(f"Queued {enqueue_sweep(params, args.queue_dir)} jobs")
+    elif args.command == "work":
+        print(f"Trained {run_worker(params, args.queue_dir)} jobs")
+    elif args.command == "requeue":
+        print(f"Requeued {requeue_stale(args.queue_dir, args.stale_after)} jobs")
+    else:
+        summary = collect_results(args.queue_dir)
+        summary.to_csv("saved_models/summary.csv", index=False)
+        print(summary.to_string(index=False))
@@ -0,0 +1,308 @@
+# Tabular Q-learning, SARSA and Monte Carlo control over dense NumPy Q-tables, trained from
+# batched rollouts on the vectorized blackjack envs
+import functools
+import glob
+import json
+import os
+from typing import TYPE_CHECKING, Optional, Sequence, Tuple
+
+import numpy as np
+
+from gameRL.game_simulators.blackjack import BlackjackCustomEnv, state_indices
+from gameRL.game_simulators.blackjack_count import make_vec_env
+from gameRL.utils.evaluation import evaluate_lookup_policy
+
+if TYPE_CHECKING:
+    import tensorflow as tf
+
+ALGORITHMS = ("q_learning", "sarsa", "monte_carlo")
+
+
+def _group_mean(keys: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """:return: the distinct keys, the mean of the values of each and how many there were"""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse)
+    return unique, np.bincount(inverse, weights=values) / counts, counts
+
+
+class TabularAgent:
+    """
+    Tabular Q-learning, SARSA or every-visit Monte Carlo control over a dense
+    (n_states, n_actions) Q-table indexed by the env's state index, see
+    BlackjackCustomEnv.state_index. It learns from batched rollouts of n_envs tables of the
+    vectorized version of env, exploring epsilon-greedily with epsilon decaying linearly from
+    exploration_initial_eps to exploration_final_eps over exploration_fraction of training.
+
+    Updates average the TD errors, or returns, of every visit to a state-action pair in a
+    batch, so thousands of tables landing in the same state move it by learning_rate once.
+    The agent has the predict/learn/save/load interface of stable-baselines models, and logs
+    its greedy policy's mean episode reward to TensorBoard as large_eval_performance
+    every eval_freq timesteps, so the sweep can train it alongside them
+    """
+
+    def __init__(
+        self,
+        algorithm: str,
+        env: Optional[BlackjackCustomEnv] = None,
+        learning_rate: float = 0.05,
+        gamma: float = 1.0,
+        exploration_initial_eps: float = 1.0,
+        exploration_final_eps: float = 0.05,
+        exploration_fraction: float = 0.5,
+        n_envs: int = 256,
+        n_steps: int = 32,
+        eval_freq: Optional[int] = None,
+        n_eval_episodes: int = 2000,
+        tensorboard_log: Optional[str] = None,
+        seed=None,
+    ):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown tabular algorithm {algorithm}")
+        self.algorithm = algorithm
+        self.learning_rate = learning_rate
+        self.gamma = gamma
+        self.exploration_initial_eps = exploration_initial_eps
+        self.exploration_final_eps = exploration_final_eps
+        self.exploration_fraction = exploration_fraction
+        self.n_envs = n_envs
+        # steps of every table Monte Carlo collects before updating
+        self.n_steps = n_steps
+        self.eval_freq = eval_freq
+        self.n_eval_episodes = n_eval_episodes
+        self.tensorboard_log = tensorboard_log
+        self.seed = seed
+        self.np_random = np.random.default_rng(seed)
+        self.num_timesteps = 0
+
+        self.env = None
+        self.state_dims: Tuple[int, ...] = ()
+        self.state_offsets = np.zeros(0, dtype=np.int64)
+        self.q_table = np.zeros((0, 0))
+        self.visits = np.zeros((0, 0), dtype=np.int64)
+        # Monte Carlo visits whose episode had not ended by the end of the last rollout:
+        # state, action, table, return so far and discount of the rest of the episode
+        self._pending = self._no_pending()
+        if env is not None:
+            self.set_env(env)
+
+    def get_env(self) -> Optional[BlackjackCustomEnv]:
+        return self.env
+
+    def set_env(self, env: BlackjackCustomEnv) -> None:
+        """Sets the env to learn on, keeping the Q-table if its state space has not changed"""
+        dims, offsets = env.get_state_layout()
+        shape = (int(np.prod(dims)), env.action_space.n)
+        if self.q_table.shape != shape:
+            self.q_table = np.zeros(shape)
+            self.visits = np.zeros(shape, dtype=np.int64)
+        self.env = env
+        self.state_dims = tuple(dims)
+        self.state_offsets = np.array(offsets, dtype=np.int64)
+
+    def state_indices(self, obs: np.ndarray) -> np.ndarray:
+        """State index of each row of obs, vectorized BlackjackCustomEnv.state_index"""
+        return state_indices(obs, self.state_dims, self.state_offsets)
+
+    def predict(self, observation, state=None, mask=None, deterministic=True):
+        """
+        Greedy action for a tuple observation, a batch of them or a flat state index. Like
+        stable-baselines, deterministic=False acts epsilon-greedily with the final epsilon
+        """
+        obs = np.asarray(observation)
+        single = obs.ndim <= 1
+        if obs.ndim == 0:
+            indices = obs.reshape(1)
+        else:
+            indices = self.state_indices(obs.reshape(-1, len(self.state_dims)))
+        eps = 0.0 if deterministic else self.exploration_final_eps
+        actions = self._act(indices, eps)
+        return (int(actions[0]) if single else actions), None
+
+    def _act(self, states: np.ndarray, eps: float) -> np.ndarray:
+        greedy = self.q_table[states].argmax(axis=1)
+        if eps <= 0:
+            return greedy
+        explore = self.np_random.random(len(states)) < eps
+        random_actions = self.np_random.integers(self.q_table.shape[1], size=len(states))
+        return np.where(explore, random_actions, greedy)
+
+    def _epsilon(self, progress: float) -> float:
+        fraction = min(progress / self.exploration_fraction, 1.0) \
+            if self.exploration_fraction > 0 else 1.0
+        return self.exploration_initial_eps + fraction * (
+            self.exploration_final_eps - self.exploration_initial_eps)
+
+    def _update(self, states: np.ndarray, actions: np.ndarray, targets: np.ndarray) -> None:
+        """Moves each visited Q-value toward the mean of its targets"""
+        flat_q = self.q_table.reshape(-1)
+        pairs, mean_target, counts = _group_mean(
+            states * self.q_table.shape[1] + actions,
+            targets - flat_q[states * self.q_table.shape[1] + actions])
+        flat_q[pairs] += self.learning_rate * mean_target
+        self.visits.reshape(-1)[pairs] += counts
+
+    @staticmethod
+    def _no_pending():
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, np.zeros(0), np.zeros(0)
+
+    def _monte_carlo_update(self, states: np.ndarray, actions: np.ndarray, rewards: np.ndarray,
+                            dones: np.ndarray) -> None:
+        """
+        Every-visit Monte Carlo update from a rollout of (n_steps, n_envs) arrays. Visits
+        whose episode runs past the rollout wait in _pending until it ends
+        """
+        n_steps = len(rewards)
+        returns = np.zeros(rewards.shape)
+        future = np.zeros(rewards.shape[1])
+        for t in reversed(range(n_steps)):
+            future = rewards[t] + self.gamma * future * ~dones[t]
+            returns[t] = future
+        # whether the episode of each visit ends within this rollout
+        ended = np.flip(np.logical_or.accumulate(np.flip(dones, axis=0), axis=0), axis=0)
+
+        # pending visits continue into the first episode of their table in this rollout
+        p_states, p_actions, p_tables, p_returns, p_discounts = self._pending
+        p_returns = p_returns + p_discounts * returns[0, p_tables]
+        p_ended = ended[0, p_tables]
+        discounts = self.gamma ** (n_steps - np.arange(n_steps))[:, None] * np.ones_like(returns)
+        tables = np.broadcast_to(np.arange(rewards.shape[1]), rewards.shape)
+        self._pending = (
+            np.concatenate([p_states[~p_ended], states[~ended]]),
+            np.concatenate([p_actions[~p_ended], actions[~ended]]),
+            np.concatenate([p_tables[~p_ended], tables[~ended]]),
+            np.concatenate([p_returns[~p_ended], returns[~ended]]),
+            np.concatenate([p_discounts[~p_ended] * self.gamma ** n_steps, discounts[~ended]]),
+        )
+        self._update(np.concatenate([p_states[p_ended], states[ended]]),
+                     np.concatenate([p_actions[p_ended], actions[ended]]),
+                     np.concatenate([p_returns[p_ended], returns[ended]]))
+
+    def learn(self, total_timesteps: int, callback=None, log_interval=None,
+              tb_log_name: str = "tabular", reset_num_timesteps: bool = True,
+              schedule_timesteps: Optional[int] = None):
+        """
+        Trains for total_timesteps steps, counted over all n_envs tables. stable-baselines
+        callbacks can not run on this model, so callback must be empty
+        :param schedule_timesteps: timesteps of the whole run, which epsilon decays over,
+        by default the timesteps trained once this call returns. A run continued over
+        several calls passes the same value to each of them
+        """
+        if callback:
+            raise ValueError("TabularAgent does not run stable-baselines callbacks")
+        if self.env is None:
+            raise ValueError("TabularAgent needs an env to learn, see set_env")
+        if reset_num_timesteps:
+            self.num_timesteps = 0
+        schedule_timesteps = schedule_timesteps or self.num_timesteps + total_timesteps
+        writer = self._make_writer(tb_log_name)
+        vec_env = make_vec_env(self.env, self.n_envs, self.np_random.integers(2 ** 32))
+        eval_freq = self.eval_freq or max(total_timesteps // 100, 1)
+        last_eval = self.num_timesteps
+
+        n_updates = max(total_timesteps // self.n_envs, 1)
+        states = self.state_indices(vec_env.reset())
+        actions = self._act(states, self._epsilon(self.num_timesteps / schedule_timesteps))
+        rollout = [np.zeros((self.n_steps, self.n_envs), dtype=dtype)
+                   for dtype in (np.int64, np.int64, np.float64, bool)]
+        self._pending = self._no_pending()
+        for update in range(n_updates):
+            eps = self._epsilon(self.num_timesteps / schedule_timesteps)
+            obs, rewards, dones, _ = vec_env.step(actions)
+            next_states = self.state_indices(obs)
+            next_actions = self._act(next_states, eps)
+            if self.algorithm == "monte_carlo":
+                t = update % self.n_steps
+                for buffer, value in zip(rollout, (states, actions, rewards, dones)):
+                    buffer[t] = value
+                if t == self.n_steps - 1:
+                    self._monte_carlo_update(*rollout)
+            else:
+                if self.algorithm == "q_learning":
+                    next_values = self.q_table[next_states].max(axis=1)
+                else:
+                    next_values = self.q_table[next_states, next_actions]
+                self._update(states, actions, rewards + self.gamma * next_values * ~dones)
+            states, actions = next_states, next_actions
+
+            self.num_timesteps += self.n_envs
+            if writer is not None and self.num_timesteps - last_eval >= eval_freq:
+                last_eval = self.num_timesteps
+                self._log(writer, {"large_eval_performance": self.evaluate(),
+                                   "epsilon": eps})
+        if self.algorithm == "monte_carlo" and n_updates % self.n_steps:
+            # the visits of episodes that ended in the last, partial rollout
+            self._monte_carlo_update(*(buffer[:n_updates % self.n_steps] for buffer in rollout))
+        self._pending = self._no_pending()
+        vec_env.close()
+        if writer is not None:
+            writer.close()
+        return self
+
+    def evaluate(self, n_eval_episodes: Optional[int] = None, seed=0) -> float:
+        """Mean reward per episode of the greedy policy, see evaluate_lookup_policy"""
+        return evaluate_lookup_policy(
+            self.q_table.argmax(axis=1), self.env, n_eval_episodes or self.n_eval_episodes,
+            n_envs=self.n_envs, seed=seed).mean_reward
+
+    def _make_writer(self, tb_log_name: str) -> Optional["tf.summary.FileWriter"]:
+        """Writer to a new run directory, numbered like stable-baselines numbers them"""
+        if self.tensorboard_log is None:
+            return None
+        # TensorFlow is only needed to log, so agents train and evaluate without it
+        import tensorflow as tf
+        run_id = len(glob.glob(os.path.join(self.tensorboard_log, f"{tb_log_name}_*"))) + 1
+        return tf.summary.FileWriter(
+            os.path.join(self.tensorboard_log, f"{tb_log_name}_{run_id}"))
+
+    def _log(self, writer: "tf.summary.FileWriter", values) -> None:
+        import tensorflow as tf
+        summary = tf.Summary(value=[tf.Summary.Value(tag=tag, simple_value=value)
+                                    for tag, value in values.items()])
+        writer.add_summary(summary, self.num_timesteps)
+
+    def _get_params(self) -> dict:
+        return {"algorithm": self.algorithm, "learning_rate": self.learning_rate,
+                "gamma": self.gamma, "exploration_initial_eps": self.exploration_initial_eps,
+                "exploration_final_eps": self.exploration_final_eps,
+                "exploration_fraction": self.exploration_fraction, "n_envs": self.n_envs,
+                "n_steps": self.n_steps, "eval_freq": self.eval_freq,
+                "n_eval_episodes": self.n_eval_episodes}
+
+    def save(self, save_path) -> None:
+        """
+        Saves the Q-table, state layout and hyperparameters to save_path, a file object or a
+        path used as it is given
+        """
+        if isinstance(save_path, str):
+            with open(save_path, "wb") as f:
+                self.save(f)
+            return
+        np.savez(save_path, q_table=self.q_table, visits=self.visits,
+                 state_dims=np.array(self.state_dims), state_offsets=self.state_offsets,
+                 num_timesteps=self.num_timesteps, params=json.dumps(self._get_params()))
+
+    @classmethod
+    def load(cls, load_path, env: Optional[BlackjackCustomEnv] = None, **kwargs) -> "TabularAgent":
+        """Loads a saved agent, which can predict without env but needs one to learn"""
+        data = np.load(load_path)
+        params = {**json.loads(str(data["params"])), **kwargs}
+        agent = cls(**params)
+        agent.q_table = data["q_table"]
+        agent.visits = data["visits"]
+        agent.state_dims = tuple(data["state_dims"].tolist())
+        agent.state_offsets = data["state_offsets"]
+        agent.num_timesteps = int(data["num_timesteps"])
+        if env is not None:
+            agent.set_env(env)
+        return agent
+
+
+def _make_agent(algorithm: str, use_env, log_name, **agent_kwargs) -> TabularAgent:
+    return TabularAgent(algorithm, use_env, tensorboard_log=log_name, **agent_kwargs)
+
+
+def tabular_model_gens(algorithms: Sequence[str] = ALGORITHMS, **agent_kwargs):
+    """(name, model_gen) entries for params["models_to_train"] of the sweep"""
+    return [(algorithm, functools.partial(_make_agent, algorithm, **agent_kwargs))
+            for algorithm in algorithms]
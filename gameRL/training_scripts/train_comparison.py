@@ -1,20 +1,39 @@
 # Created by Patrick Kao
+import functools
 import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
 
+import gym
+import pandas as pd
 import stable_baselines
 from stable_baselines import DQN, A2C, ACER, ACKTR, PPO2
 from stable_baselines.common.evaluation import evaluate_policy
 from stable_baselines.common.policies import MlpPolicy
 
 from gameRL.game_simulators.blackjack import BlackjackCustomEnv
-from gameRL.game_simulators.blackjack_count import BlackjackEnvwithRunningCount
-from gameRL.training_scripts.utils import LargeEvalCallback
+from gameRL.game_simulators.blackjack_count import BlackjackEnvwithRunningCount, make_vec_env
+from gameRL.game_simulators.shared_vec_env import START_METHOD, SharedMemoryVecEnv
+from gameRL.training_scripts.tabular import TabularAgent, tabular_model_gens
+from gameRL.training_scripts.utils import (
+    LargeEvalCallback,
+    ResumableCheckpointCallback,
+    learn_until,
+    save_with_metadata,
+)
 
+# params of the sweep run by the current worker process, set by _init_worker
+_worker_params = None
+# models that can collect rollouts from several envs at once
+VEC_MODELS = ("a2c", "acer", "acktr", "ppo2")
 
-def train_multi(params):
-    Path("saved_models").mkdir(parents=True, exist_ok=True)
-    eval_callback = LargeEvalCallback(n_steps=params["TIMESTEPS_PER_MODEL"] // 100)
+
+def get_combinations(params) -> List[Tuple[str, Callable, float, int, int]]:
+    """The (name, model_gen, rho, num_decks, max_hand_sum) combinations the sweep trains"""
+    combinations = []
     for (name, model_gen), rho, num_decks, max_hand_sum in itertools.product(
             params["models_to_train"],
             params["RHO_TO_TRY"],
@@ -26,50 +45,172 @@ def train_multi(params):
         hand_match = params["MAX_HAND_SUM_TO_TRY"].index(max_hand_sum) == 1
         if params.get("reduce_runs", True) and sum([rho_match, deck_match, hand_match]) < 2:
             continue
+        combinations.append((name, model_gen, rho, num_decks, max_hand_sum))
+    return combinations
 
-        descriptor = f"{name}/sum_{max_hand_sum}/rho_{rho}_nd_{num_decks}"
-        log = f"./runs/{descriptor}"
-        env = BlackjackEnvwithRunningCount(num_decks, natural_bonus=True, rho=rho,
-                                           max_hand_sum=max_hand_sum, allow_observe=True)
-        # env = BlackjackCustomEnv(num_decks, natural_bonus=True, rho=rho,
-        #                                    max_hand_sum=max_hand_sum, simple_game=True)
 
-        model = model_gen(env, log)
+def get_descriptor(name, rho, num_decks, max_hand_sum) -> str:
+    return f"{name}/sum_{max_hand_sum}/rho_{rho}_nd_{num_decks}"
 
-        model.learn(total_timesteps=params["TIMESTEPS_PER_MODEL"], callback=eval_callback)
-        # test game
-        reward, std = evaluate_policy(model, env, n_eval_episodes=2000)
-        print(
-            f"Average reward for model {name} with: rho={rho}, num decks={num_decks}, max hand sum="
-            f"{max_hand_sum}: {reward}")
-        # save
-        model.save(f"saved_models/{descriptor.replace('/', '_')}")
 
-        env.close()
+def get_metadata(name, env, rho, num_decks, max_hand_sum, timesteps) -> Dict:
+    """Parameters of a trained model, saved in the sidecar next to it"""
+    return {"model": name, "env": type(env).__name__, "rho": rho, "num_decks": num_decks,
+            "max_hand_sum": max_hand_sum, "timesteps": timesteps}
 
 
-if __name__ == "__main__":
-    params = {
+def make_model(model_class, policy, use_env, log_name):
+    """A stable-baselines model_gen for params["models_to_train"], see default_params"""
+    return model_class(policy, use_env, tensorboard_log=log_name)
+
+
+def make_env(rho, num_decks, max_hand_sum) -> BlackjackEnvwithRunningCount:
+    """The environment every model of the sweep is trained and evaluated on"""
+    return BlackjackEnvwithRunningCount(num_decks, natural_bonus=True, rho=rho,
+                                        max_hand_sum=max_hand_sum, allow_observe=True)
+    # return BlackjackCustomEnv(num_decks, natural_bonus=True, rho=rho,
+    #                           max_hand_sum=max_hand_sum, simple_game=True)
+
+
+def make_train_env(params, name, env_fn: Callable[[], gym.Env]) -> gym.Env:
+    """
+    The env model name trains on. With params["n_envs"] > 1, models in VEC_MODELS collect
+    rollouts from that many envs: with params["vec_env"] "inprocess", the tables of
+    make_vec_env stepped together in this process, and with "shared", envs stepped by the
+    params["env_workers"] processes of a SharedMemoryVecEnv
+    """
+    n_envs = params.get("n_envs", 1)
+    if n_envs <= 1 or name not in VEC_MODELS:
+        return env_fn()
+    vec_env = params.get("vec_env", "inprocess")
+    if vec_env == "inprocess":
+        return make_vec_env(env_fn(), n_envs)
+    if vec_env == "shared":
+        return SharedMemoryVecEnv(env_fn, n_envs, params.get("env_workers"))
+    raise ValueError(f"Unknown vec_env {vec_env}")
+
+
+def train_one(params, name, model_gen, rho, num_decks, max_hand_sum,
+              checkpoint_dir: Optional[str] = None) -> Dict:
+    """
+    Trains, evaluates and saves one model of the sweep and returns its summary row
+    :param checkpoint_dir: if given, training is checkpointed there every
+    params["checkpoint_freq"] steps and resumes from an existing checkpoint
+    """
+    descriptor = get_descriptor(name, rho, num_decks, max_hand_sum)
+    log = f"./runs/{descriptor}"
+    env_fn = functools.partial(make_env, rho, num_decks, max_hand_sum)
+    env = env_fn()
+    train_env = make_train_env(params, name, env_fn)
+    model = model_gen(train_env, log)
+
+    # tabular agents log their own evaluations, and train too fast to need checkpoints
+    tabular = isinstance(model, TabularAgent)
+    callbacks = [] if tabular else [LargeEvalCallback(
+        n_steps=params["TIMESTEPS_PER_MODEL"] // 100,
+        eval_env_fn=env_fn,
+        n_eval_workers=params.get("eval_workers_per_model", 2))]
+    checkpoint_dir = None if tabular else checkpoint_dir
+    if checkpoint_dir is not None:
+        checkpoint = ResumableCheckpointCallback(
+            f"{checkpoint_dir}/{descriptor.replace('/', '_')}",
+            save_freq=params.get("checkpoint_freq", params["TIMESTEPS_PER_MODEL"] // 10))
+        if checkpoint.exists():
+            # the checkpointed model carries on from its num_timesteps
+            model, _ = checkpoint.load(type(model), train_env, log)
+        callbacks.append(checkpoint)
+    learn_until(model, params["TIMESTEPS_PER_MODEL"], params["TIMESTEPS_PER_MODEL"],
+                callback=callbacks)
+    # test game
+    reward, std = evaluate_policy(model, env, n_eval_episodes=2000)
+    print(
+        f"Average reward for model {name} with: rho={rho}, num decks={num_decks}, max hand sum="
+        f"{max_hand_sum}: {reward}")
+    # save
+    save_with_metadata(model, f"saved_models/{descriptor.replace('/', '_')}",
+                       get_metadata(name, env, rho, num_decks, max_hand_sum,
+                                    params["TIMESTEPS_PER_MODEL"]))
+    if checkpoint_dir is not None:
+        checkpoint.remove()
+
+    env.close()
+    train_env.close()
+    return {"model": name, "rho": rho, "num_decks": num_decks, "max_hand_sum": max_hand_sum,
+            "mean_reward": reward, "std_reward": std}
+
+
+def _init_worker(params, tf_threads: int):
+    global _worker_params
+    _worker_params = params
+    # stable-baselines sizes every TensorFlow session it creates from RCALL_NUM_CPU
+    os.environ["RCALL_NUM_CPU"] = str(tf_threads)
+    os.environ["OMP_NUM_THREADS"] = str(tf_threads)
+
+
+def _train_combination(index: int) -> Dict:
+    return train_one(_worker_params, *get_combinations(_worker_params)[index])
+
+
+def train_multi(params) -> pd.DataFrame:
+    """
+    Trains every combination of the sweep. With params["n_workers"] > 1 the combinations
+    are spread over a process pool whose workers each give TensorFlow
+    params["tf_threads_per_worker"] threads
+    :return: summary table with one row per trained model, also saved to saved_models/
+    """
+    Path("saved_models").mkdir(parents=True, exist_ok=True)
+    combinations = get_combinations(params)
+    n_workers = params.get("n_workers", 1)
+    if n_workers > 1:
+        with ProcessPoolExecutor(
+                max_workers=n_workers,
+                mp_context=multiprocessing.get_context(START_METHOD),
+                initializer=_init_worker,
+                initargs=(params, params.get("tf_threads_per_worker", 1))) as pool:
+            results = list(pool.map(_train_combination, range(len(combinations))))
+    else:
+        results = [train_one(params, *combination) for combination in combinations]
+
+    summary = pd.DataFrame(results)
+    summary.to_csv("saved_models/summary.csv", index=False)
+    print(summary.to_string(index=False))
+    return summary
+
+
+def default_params() -> Dict:
+    """Parameters of the full sweep"""
+    return {
         "TIMESTEPS_PER_MODEL": int(7e5),
         "RHO_TO_TRY": [0.25, 0.75, 0.95],
         "DECKS_TO_TRY": [1, 3, 10],
         "MAX_HAND_SUM_TO_TRY": [19, 21, 24],
-        # for each model, name of mode, model
+        # number of combinations trained at once, and TensorFlow threads for each of them
+        "n_workers": 1,
+        "tf_threads_per_worker": 1,
+        # envs each model collects rollouts from, see make_train_env, and processes stepping
+        # them with the "shared" vec_env; 1 env trains on the env itself, in the worker
+        "n_envs": 1,
+        "vec_env": "inprocess",
+        "env_workers": None,
+        # processes evaluating each model in the background while it trains
+        "eval_workers_per_model": 2,
+        # for each model, name of mode, model; partials rather than lambdas, so the params
+        # can be pickled to the train_multi workers
         "models_to_train": [
-            (
-                "dqn",
-                lambda use_env, log_name: DQN(stable_baselines.deepq.policies.MlpPolicy, use_env,
-                                              tensorboard_log=log_name)),
-            ("a2c", lambda use_env, log_name: A2C(MlpPolicy, use_env, tensorboard_log=log_name)),
-            ("acer", lambda use_env, log_name: ACER(MlpPolicy, use_env,
-            tensorboard_log=log_name)),
-            (
-                "acktr",
-                lambda use_env, log_name: ACKTR(MlpPolicy, use_env, tensorboard_log=log_name)),
-            ("ppo2", lambda use_env, log_name: PPO2(MlpPolicy, use_env,
-            tensorboard_log=log_name)),
+            ("dqn", functools.partial(make_model, DQN,
+                                      stable_baselines.deepq.policies.MlpPolicy)),
+            ("a2c", functools.partial(make_model, A2C, MlpPolicy)),
+            ("acer", functools.partial(make_model, ACER, MlpPolicy)),
+            ("acktr", functools.partial(make_model, ACKTR, MlpPolicy)),
+            ("ppo2", functools.partial(make_model, PPO2, MlpPolicy)),
+            # cheap tabular baselines: q_learning, sarsa and monte_carlo
+            *tabular_model_gens(),
         ],
     }
+
+
+if __name__ == "__main__":
+    params = default_params()
     # params = {
     #     "TIMESTEPS_PER_MODEL": int(7e5),
     #     "RHO_TO_TRY": [0.95],
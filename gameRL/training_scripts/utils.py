@@ -1,20 +1,264 @@
 # Created by Patrick Kao
+import io
+import json
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import gym
+import numpy as np
 import tensorflow as tf
+from stable_baselines.common.base_class import BaseRLModel
 from stable_baselines.common.callbacks import BaseCallback
 from stable_baselines.common.evaluation import evaluate_policy
 
+from gameRL.game_simulators.blackjack import spawn_seeds
+from gameRL.game_simulators.shared_vec_env import START_METHOD
+from gameRL.training_scripts.tabular import TabularAgent
+
+
+def make_seeded_env_fns(
+    env_class, n_envs: int, seed=None, **env_kwargs
+) -> List[Callable[[], gym.Env]]:
+    """
+    Builds env constructors for DummyVecEnv/SubprocVecEnv where every env deals from its own
+    independent stream spawned from seed, so parallel workers never share shoes
+    """
+
+    def make_env(child_seed):
+        def _init():
+            env = env_class(**env_kwargs)
+            env.seed(child_seed)
+            env.reset()
+            return env
+
+        return _init
+
+    return [make_env(child_seed) for child_seed in spawn_seeds(seed, n_envs)]
+
+
+def save_with_metadata(model: BaseRLModel, path: str, metadata: Dict) -> None:
+    """
+    Saves model to <path>.zip and metadata, the parameters it was trained with, to a
+    <path>.json sidecar that tools reading the model use instead of parsing its filename
+    """
+    model.save(f"{path}.zip")
+    with open(f"{path}.json", "w") as f:
+        json.dump(metadata, f)
+
+
+def load_metadata(model_path: str) -> Optional[Dict]:
+    """:return: the sidecar metadata saved with the model at model_path, None if it has none"""
+    sidecar = os.path.splitext(model_path)[0] + ".json"
+    if not os.path.exists(sidecar):
+        return None
+    with open(sidecar) as f:
+        return json.load(f)
+
+
+# eval env and model of an eval worker process, built on its first evaluation
+_eval_env = None
+_eval_model = None
+
+
+def _evaluate_snapshot(env_fn, model_class, snapshot: bytes, seed, n_eval_episodes: int) -> float:
+    """Total reward of a saved model over n_eval_episodes played on this worker's eval env"""
+    global _eval_env, _eval_model
+    if _eval_env is None:
+        _eval_env = env_fn()
+    if _eval_model is None:
+        _eval_model = model_class.load(io.BytesIO(snapshot), env=_eval_env)
+    else:
+        _eval_model.load_parameters(io.BytesIO(snapshot))
+    _eval_env.seed(seed)
+    rewards, _ = evaluate_policy(_eval_model, _eval_env, n_eval_episodes=n_eval_episodes,
+                                 return_episode_rewards=True)
+    return float(sum(rewards))
+
+
+class StopAtTimestepsCallback(BaseCallback):
+    """Stops learn() once the model has trained for max_timesteps timesteps in total"""
+
+    def __init__(self, max_timesteps: int, verbose=0):
+        super().__init__(verbose)
+        self.max_timesteps = max_timesteps
+
+    def _on_step(self) -> bool:
+        return self.model.num_timesteps < self.max_timesteps
+
+
+def learn_until(model, timesteps: int, total_timesteps: int, callback=None):
+    """
+    Trains model, which has trained for model.num_timesteps timesteps already, on up to
+    timesteps timesteps, following the exploration schedule of a single run of
+    total_timesteps. A run split over several calls, resumed from a checkpoint or promoted
+    from rung to rung, so explores as one uninterrupted run would. DQN's schedule, laid over
+    the total_timesteps of its learn call, is kept by learning for all of them and stopping
+    at timesteps. Replay buffers are not saved with models, so a reloaded DQN refills its
+    buffer from scratch
+    """
+    reset = model.num_timesteps == 0
+    if isinstance(model, TabularAgent):
+        return model.learn(timesteps - model.num_timesteps, callback=callback,
+                           reset_num_timesteps=reset, schedule_timesteps=total_timesteps)
+    callbacks = [] if callback is None else callback if isinstance(callback, list) \
+        else [callback]
+    return model.learn(total_timesteps=total_timesteps,
+                       callback=[*callbacks, StopAtTimestepsCallback(timesteps)],
+                       reset_num_timesteps=reset)
+
 
 class LargeEvalCallback(BaseCallback):
-    def __init__(self, n_steps=70000, n_eval_episodes=2000, verbose=0):
+    """
+    Evaluates the model every n_steps timesteps and logs the mean reward to TensorBoard as
+    large_eval_performance.
+
+    Without eval_env_fn the evaluation blocks training and plays on the training env. With it,
+    a snapshot of the policy is evaluated on a pool of n_eval_workers processes that each
+    build their own env with eval_env_fn, which must be picklable, while training goes on.
+    Results are logged at the timestep the snapshot was taken once they arrive. Every
+    evaluation replays the same shoes, spawned from seed, so successive results are comparable
+    """
+
+    def __init__(self, n_steps=70000, n_eval_episodes=2000, verbose=0,
+                 eval_env_fn: Optional[Callable[[], gym.Env]] = None, n_eval_workers: int = 2,
+                 max_pending: int = 4, seed=None):
         super().__init__(verbose)
         self.n_steps = n_steps
         self.n_eval_episodes = n_eval_episodes
         self.last_time_trigger = 0
+        self.eval_env_fn = eval_env_fn
+        self.n_eval_workers = n_eval_workers
+        self.max_pending = max_pending
+        self.seeds = spawn_seeds(seed, n_eval_workers)
+        self.pool: Optional[ProcessPoolExecutor] = None
+        # (timestep of the snapshot, futures of its parts) of evaluations still running
+        self.pending: List[Tuple[int, List[Future]]] = []
+
+    def _on_training_start(self) -> None:
+        # a continued run was evaluated up to where it left off
+        self.last_time_trigger = max(self.last_time_trigger, self.model.num_timesteps)
+
+    def _log(self, value: float, timestep: int) -> None:
+        writer = self.locals.get("writer")
+        if writer is not None:
+            summary = tf.Summary(value=[tf.Summary.Value(tag='large_eval_performance', simple_value=value)])
+            writer.add_summary(summary, timestep)
+
+    def _submit(self) -> None:
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.n_eval_workers,
+                                            mp_context=multiprocessing.get_context(START_METHOD))
+        snapshot = io.BytesIO()
+        self.model.save(snapshot)
+        episodes = np.array_split(np.arange(self.n_eval_episodes), self.n_eval_workers)
+        futures = [
+            self.pool.submit(_evaluate_snapshot, self.eval_env_fn, type(self.model),
+                             snapshot.getvalue(), seed, len(part))
+            for seed, part in zip(self.seeds, episodes) if len(part)
+        ]
+        self.pending.append((self.num_timesteps, futures))
+
+    def _collect(self, max_pending: int) -> None:
+        """Logs finished evaluations, waiting for the oldest while more than max_pending run"""
+        while self.pending and (len(self.pending) > max_pending
+                                or all(f.done() for f in self.pending[0][1])):
+            timestep, futures = self.pending.pop(0)
+            self._log(sum(f.result() for f in futures) / self.n_eval_episodes, timestep)
 
     def _on_rollout_start(self) -> None:
+        if self.eval_env_fn is not None:
+            # evaluations that fell this far behind slow training down instead of piling up
+            self._collect(self.max_pending)
         if (self.num_timesteps - self.last_time_trigger) >= self.n_steps:
             self.last_time_trigger = self.num_timesteps
-            value, _ = evaluate_policy(self.model, self.training_env,
-                                    n_eval_episodes=self.n_eval_episodes, )
-            summary = tf.Summary(value=[tf.Summary.Value(tag='large_eval_performance', simple_value=value)])
-            self.locals['writer'].add_summary(summary, self.num_timesteps)
+            if self.eval_env_fn is not None:
+                self._submit()
+            else:
+                value, _ = evaluate_policy(self.model, self.training_env,
+                                           n_eval_episodes=self.n_eval_episodes, )
+                self._log(value, self.num_timesteps)
+
+    def _on_training_end(self) -> None:
+        if self.pool is not None:
+            self._collect(max_pending=0)
+            self.pool.shutdown()
+            self.pool = None
+
+
+class EnvStatsCallback(BaseCallback):
+    """
+    Logs the instrumentation counters of the training envs, built with instrument=True, to
+    TensorBoard as env_stats/<counter> every n_steps timesteps, averaged over the envs
+    """
+
+    def __init__(self, n_steps=10000, verbose=0):
+        super().__init__(verbose)
+        self.n_steps = n_steps
+        self.last_time_trigger = 0
+
+    def _on_training_start(self) -> None:
+        self.last_time_trigger = max(self.last_time_trigger, self.model.num_timesteps)
+
+    def _on_rollout_start(self) -> None:
+        if (self.num_timesteps - self.last_time_trigger) < self.n_steps:
+            return
+        self.last_time_trigger = self.num_timesteps
+        writer = self.locals.get("writer")
+        stats = [env_stats for env_stats in self.training_env.env_method("get_stats")
+                 if env_stats]
+        if writer is None or not stats:
+            return
+        summary = tf.Summary(value=[
+            tf.Summary.Value(tag=f"env_stats/{name}",
+                             simple_value=float(np.mean([env_stats[name] for env_stats in stats])))
+            for name in stats[0]
+        ])
+        writer.add_summary(summary, self.num_timesteps)
+
+
+class ResumableCheckpointCallback(BaseCallback):
+    """
+    Saves the model to <path>.zip and the timesteps trained so far to <path>.json every
+    save_freq steps, replacing the previous checkpoint atomically, so a preempted learn call
+    can be resumed with load() and continued with learn_until
+    """
+
+    def __init__(self, path: str, save_freq: int = 70000, verbose=0):
+        super().__init__(verbose)
+        self.path = path
+        self.save_freq = save_freq
+        self.last_save = 0
+
+    def exists(self) -> bool:
+        return os.path.exists(f"{self.path}.zip") and os.path.exists(f"{self.path}.json")
+
+    def load(self, model_class, env, tensorboard_log=None) -> Tuple[BaseRLModel, int]:
+        """:return: the checkpointed model and the number of timesteps it was trained for"""
+        with open(f"{self.path}.json") as f:
+            num_timesteps = json.load(f)["num_timesteps"]
+        model = model_class.load(f"{self.path}.zip", env=env, tensorboard_log=tensorboard_log)
+        model.num_timesteps = num_timesteps
+        self.last_save = num_timesteps
+        return model, num_timesteps
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.model.save(f"{self.path}.tmp.zip")
+        with open(f"{self.path}.tmp.json", "w") as f:
+            json.dump({"num_timesteps": self.num_timesteps}, f)
+        # the model goes first, so the timesteps on disk never run ahead of it
+        os.replace(f"{self.path}.tmp.zip", f"{self.path}.zip")
+        os.replace(f"{self.path}.tmp.json", f"{self.path}.json")
+
+    def remove(self) -> None:
+        for extension in (".zip", ".json"):
+            if os.path.exists(self.path + extension):
+                os.remove(self.path + extension)
+
+    def _on_step(self) -> bool:
+        if self.num_timesteps - self.last_save >= self.save_freq:
+            self.last_save = self.num_timesteps
+            self.save()
+        return True
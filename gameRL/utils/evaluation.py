@@ -0,0 +1,217 @@
+# Paired evaluation of models on common random numbers
+from typing import Callable, Dict, List, Tuple
+
+import gym
+import numpy as np
+
+from gameRL.game_simulators.blackjack import BlackjackCustomEnv, spawn_seeds, state_indices
+from gameRL.game_simulators.blackjack_count import make_vec_env
+
+
+class PairedEvaluation:
+    """
+    Rewards of every model on the same episodes, rewards[i, j] being model j's reward on
+    episode i. Confidence intervals span z standard errors, 1.96 for 95%
+    """
+
+    def __init__(self, names: List[str], rewards: np.ndarray, z: float = 1.96):
+        self.names = names
+        self.rewards = rewards
+        self.z = z
+
+    @property
+    def n_episodes(self) -> int:
+        return len(self.rewards)
+
+    def mean_rewards(self) -> Dict[str, float]:
+        return dict(zip(self.names, self.rewards.mean(axis=0)))
+
+    def std_rewards(self) -> Dict[str, float]:
+        """Standard deviation of each model's episode rewards"""
+        return dict(zip(self.names, self.rewards.std(axis=0)))
+
+    def std_errors(self) -> Dict[str, float]:
+        return dict(zip(self.names, _std_error(self.rewards)))
+
+    def difference(self, first: str, second: str) -> Tuple[float, float]:
+        """Mean reward of first minus second, and the half width of its confidence interval"""
+        diff = self.rewards[:, self.names.index(first)] - \
+            self.rewards[:, self.names.index(second)]
+        return float(diff.mean()), float(self.z * _std_error(diff))
+
+    def ci_half_width(self) -> float:
+        """Widest confidence interval half width of a reward difference between two models"""
+        widths = [self.difference(first, second)[1]
+                  for i, first in enumerate(self.names) for second in self.names[i + 1:]]
+        return max(widths, default=0.0)
+
+
+def _std_error(rewards: np.ndarray) -> np.ndarray:
+    if len(rewards) < 2:
+        return np.full(rewards.shape[1:], np.inf)
+    return rewards.std(axis=0, ddof=1) / np.sqrt(len(rewards))
+
+
+def play_episode(model, env: gym.Env, deterministic: bool = True) -> float:
+    """Total reward of one episode of model, anything with a stable-baselines predict()"""
+    obs, done, total = env.reset(), False, 0.0
+    while not done:
+        action, _ = model.predict(obs, deterministic=deterministic)
+        obs, reward, done, _ = env.step(action)
+        total += reward
+    return total
+
+
+def play_seeded_episodes(
+    model, env: gym.Env, seeds: List[np.random.SeedSequence], deterministic: bool = True
+) -> np.ndarray:
+    """Rewards of model on one episode per seed, env being seeded before each of them"""
+    rewards = np.empty(len(seeds))
+    for i, seed in enumerate(seeds):
+        env.seed(seed)
+        rewards[i] = play_episode(model, env, deterministic)
+    return rewards
+
+
+def paired_evaluate(
+    models: Dict[str, object],
+    env_fn: Callable[[], gym.Env],
+    target_half_width: float = 0.02,
+    z: float = 1.96,
+    min_episodes: int = 200,
+    max_episodes: int = 5000,
+    batch_size: int = 100,
+    seed: int = 0,
+    deterministic: bool = True,
+) -> PairedEvaluation:
+    """
+    Plays every model on the same pre-generated shoes: before episode i each model's env is
+    seeded with the i-th stream spawned from seed, so the models face identical cards
+    wherever their play does not diverge. Pairing cancels most of blackjack's variance from
+    the reward differences, which need far fewer episodes to resolve than independent runs.
+
+    Episodes are played in batches until the confidence interval of every pairwise reward
+    difference, z standard errors to each side, is narrower than +-target_half_width, after
+    at least min_episodes and at most max_episodes episodes. The same seed replays the same
+    shoes, so results of separate calls can be compared too
+    """
+    names = list(models)
+    envs = {name: env_fn() for name in names}
+    seeds = spawn_seeds(seed, max_episodes)
+    rewards = np.empty((max_episodes, len(names)))
+    evaluation = PairedEvaluation(names, rewards[:0], z)
+    n_played = 0
+    while n_played < max_episodes:
+        batch = slice(n_played, min(n_played + batch_size, max_episodes))
+        for j, name in enumerate(names):
+            rewards[batch, j] = play_seeded_episodes(models[name], envs[name], seeds[batch],
+                                                     deterministic)
+        n_played = batch.stop
+        evaluation = PairedEvaluation(names, rewards[:n_played], z)
+        if n_played >= min_episodes and evaluation.ci_half_width() < target_half_width:
+            break
+    for env in envs.values():
+        env.close()
+    return evaluation
+
+
+class LookupEvaluation:
+    """
+    Rewards of every episode a lookup policy played, with how often each state was visited
+    and the total reward that followed the action taken there. Confidence intervals span z
+    standard errors, 1.96 for 95%
+    """
+
+    def __init__(self, episode_rewards: np.ndarray, state_visits: np.ndarray,
+                 state_rewards: np.ndarray, z: float = 1.96):
+        self.episode_rewards = episode_rewards
+        self.state_visits = state_visits
+        self.state_rewards = state_rewards
+        self.z = z
+
+    @property
+    def n_episodes(self) -> int:
+        return len(self.episode_rewards)
+
+    @property
+    def mean_reward(self) -> float:
+        return float(self.episode_rewards.mean())
+
+    @property
+    def std_error(self) -> float:
+        return float(_std_error(self.episode_rewards[:, None])[0])
+
+    def ci_half_width(self) -> float:
+        return self.z * self.std_error
+
+    def visit_frequencies(self) -> np.ndarray:
+        """Fraction of all decisions taken in each state"""
+        return self.state_visits / max(self.state_visits.sum(), 1)
+
+    def state_mean_rewards(self) -> np.ndarray:
+        """Mean immediate reward of the action taken in each state, nan where never visited"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.state_rewards / self.state_visits
+
+
+def evaluate_lookup_policy(
+    policy: np.ndarray,
+    env: BlackjackCustomEnv,
+    n_episodes: int = 1000000,
+    n_envs: int = 10000,
+    seed: int = 0,
+    z: float = 1.96,
+) -> LookupEvaluation:
+    """
+    Plays policy, the action to take in each state index of env (see
+    BlackjackCustomEnv.state_index), for n_episodes episodes on a vectorized copy of env of
+    n_envs tables at once. Every table plays the same number of episodes, so short episodes
+    are not over-represented among the first ones to finish, which rounds n_episodes up to
+    a multiple of the number of tables
+    """
+    policy = np.asarray(policy)
+    dims, offsets = env.get_state_layout()
+    n_states = int(np.prod(dims))
+    if policy.shape != (n_states,):
+        raise ValueError(f"policy must have one action for each of the {n_states} states")
+    n_envs = min(n_envs, n_episodes)
+    per_table = -(-n_episodes // n_envs)
+    vec_env = make_vec_env(env, n_envs, seed)
+
+    episode_rewards = np.zeros((per_table, n_envs))
+    episodes_done = np.zeros(n_envs, dtype=np.int64)
+    totals = np.zeros(n_envs)
+    state_visits = np.zeros(n_states, dtype=np.int64)
+    state_rewards = np.zeros(n_states)
+    # visited states are counted in chunks, so counting costs O(n_states) once per chunk
+    visited, rewarded = [], []
+
+    def count_visits():
+        states = np.concatenate(visited)
+        state_visits[:] += np.bincount(states, minlength=n_states)
+        state_rewards[:] += np.bincount(states, weights=np.concatenate(rewarded),
+                                        minlength=n_states)
+        visited.clear()
+        rewarded.clear()
+
+    obs = vec_env.reset()
+    tables = np.arange(n_envs)
+    while True:
+        active = episodes_done < per_table
+        if not active.any():
+            break
+        states = state_indices(obs, dims, offsets)
+        obs, rewards, dones, _ = vec_env.step(policy[states])
+        visited.append(states[active])
+        rewarded.append(rewards[active])
+        totals += rewards
+        finished = np.flatnonzero(dones & active)
+        episode_rewards[episodes_done[finished], tables[finished]] = totals[finished]
+        episodes_done[finished] += 1
+        totals[dones] = 0
+        if len(visited) * n_envs >= n_states:
+            count_visits()
+    if visited:
+        count_visits()
+    vec_env.close()
+    return LookupEvaluation(episode_rewards.reshape(-1), state_visits, state_rewards, z)
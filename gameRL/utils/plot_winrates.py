@@ -1,66 +1,154 @@
 # Created by Patrick Kao
-import copy
-from os import listdir
-from os.path import join, isfile
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from typing import Dict, List, Optional
 
 import matplotlib.pyplot as plt
 import numpy as np
 from stable_baselines import ACER, A2C, PPO2, DQN, ACKTR
-from stable_baselines.common.evaluation import evaluate_policy
 
-from gameRL.game_simulators.blackjack_count import BlackjackEnvwithRunningCount
+from gameRL.game_simulators.blackjack import spawn_seeds
+from gameRL.game_simulators.shared_vec_env import START_METHOD
+from gameRL.training_scripts.tabular import ALGORITHMS, TabularAgent
+from gameRL.training_scripts.train_comparison import make_env
+from gameRL.training_scripts.utils import load_metadata
+from gameRL.utils.evaluation import PairedEvaluation, play_seeded_episodes
 
 name_map = {"a2c": A2C,
             "acer": ACER,
             "acktr": ACKTR,
             "dqn": DQN,
-            "ppo2": PPO2
+            "ppo2": PPO2,
+            **{algorithm: TabularAgent for algorithm in ALGORITHMS},
             }
 
 NUM_TO_RUN = 5000
+# half width of the 95% confidence interval on reward differences to evaluate down to
+TARGET_HALF_WIDTH = 0.01
+# episodes every model plays before the first check of the confidence intervals
+MIN_TO_RUN = 500
+# every model plays the shoes spawned from this seed, so cached rewards stay paired
+SEED = 0
+CACHE_DIR = ".eval_cache"
+ENV_PARAMS = ("rho", "num_decks", "max_hand_sum")
 
 
-def plot_winrates(directory, show_std=False):
-    files = [f for f in listdir(directory) if isfile(join(directory, f))]
-    # files = filter(lambda x: x[-4] == ".zip", files)
-
-    params = copy.deepcopy(files)
-    params = [file.replace("sum_", "") for file in params]
-    params = [file.replace("rho_", "") for file in params]
-    params = [file.replace("nd_", "") for file in params]
-    params = [file.replace(".zip", "") for file in params]
-    params = np.array([file.split("_") for file in params])
-
-    param_file_map = {tuple(param): filename for param, filename in zip(params, files)}
-
-    combos = np.unique(params[:, 1:], axis=0)
-    fig, axs = plt.subplots(len(combos))
-    for i, combo in enumerate(combos):
-        match_hits = params[:, 1:] == combo
-        match_hits = np.all(match_hits, axis=1)
-        matches = params[match_hits, :]
-        matches = sorted(list(matches), key=lambda x: x[0])
-        names = []
-        winrates = []
-        stds = []
-        for match in matches:
-            full_filename = f"{directory}/{param_file_map[tuple(match)]}"
-            model = name_map[match[0]].load(full_filename)
-            env = BlackjackEnvwithRunningCount(int(match[3]), natural_bonus=True,
-                                               rho=float(match[2]),
-                                               max_hand_sum=int(match[1]), allow_observe=True)
-            mean_reward, std_reward = evaluate_policy(model, env, render=True, n_eval_episodes=NUM_TO_RUN)
-            names.append(match[0])
-            winrates.append(mean_reward)
-            stds.append(std_reward)
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_path(directory: str, model_path: str, metadata: Dict) -> str:
+    key = json.dumps({"model": file_hash(model_path), "seed": SEED,
+                      **{param: metadata[param] for param in ENV_PARAMS}}, sort_keys=True)
+    return os.path.join(directory, CACHE_DIR,
+                        f"{hashlib.sha256(key.encode()).hexdigest()}.npy")
+
+
+def _evaluate_model(model_path: str, metadata: Dict, start: int, stop: int) -> np.ndarray:
+    """Rewards of the saved model on episodes start to stop of the shoes spawned from SEED"""
+    env = make_env(*(metadata[param] for param in ENV_PARAMS))
+    model = name_map[metadata["model"]].load(model_path)
+    rewards = play_seeded_episodes(model, env, spawn_seeds(SEED, stop)[start:stop])
+    env.close()
+    return rewards
+
+
+def evaluate_models(directory: str,
+                    n_workers: Optional[int] = None) -> Dict[tuple, PairedEvaluation]:
+    """
+    Evaluates every model saved with a metadata sidecar in directory, headless, on a pool of
+    n_workers processes. Models sharing env parameters play the same shoes, and are played
+    until the differences between them are resolved to TARGET_HALF_WIDTH, or NUM_TO_RUN
+    episodes. Rewards are cached in directory/.eval_cache keyed by the model file's hash and
+    the env parameters, so only new or changed models, or models that need more episodes,
+    are played again
+    Each group can hold one model of each name, a second one raises a ValueError
+    :return: evaluation of each group of models, keyed by (rho, num_decks, max_hand_sum)
+    """
+    groups: Dict[tuple, Dict[str, str]] = {}
+    metadata = {}
+    for model_path in sorted(glob(os.path.join(directory, "*.zip"))):
+        metadata[model_path] = load_metadata(model_path)
+        if metadata[model_path] is None:
+            print(f"Skipping {model_path}, which has no metadata sidecar")
+            continue
+        env_params = tuple(metadata[model_path][param] for param in ENV_PARAMS)
+        group = groups.setdefault(env_params, {})
+        name = metadata[model_path]["model"]
+        if name in group:
+            raise ValueError(f"{group[name]} and {model_path} both hold a {name} model for "
+                             f"{dict(zip(ENV_PARAMS, env_params))}, move one of them")
+        group[name] = model_path
+
+    os.makedirs(os.path.join(directory, CACHE_DIR), exist_ok=True)
+    cache_paths = {path: _cache_path(directory, path, metadata[path])
+                   for paths in groups.values() for path in paths.values()}
+    rewards = {path: np.load(cache) if os.path.exists(cache) else np.empty(0)
+               for path, cache in cache_paths.items()}
+    targets = {env_params: MIN_TO_RUN for env_params in groups}
+    evaluations = {}
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             mp_context=multiprocessing.get_context(START_METHOD)) as pool:
+        while targets:
+            futures = {
+                path: pool.submit(_evaluate_model, path, metadata[path], len(rewards[path]),
+                                  n_episodes)
+                for env_params, n_episodes in targets.items()
+                for path in groups[env_params].values() if len(rewards[path]) < n_episodes
+            }
+            for path, future in futures.items():
+                rewards[path] = np.concatenate([rewards[path], future.result()])
+                np.save(cache_paths[path], rewards[path])
+
+            for env_params, n_episodes in list(targets.items()):
+                names = sorted(groups[env_params])
+                evaluation = PairedEvaluation(names, np.stack(
+                    [rewards[groups[env_params][name]][:n_episodes] for name in names], axis=1))
+                evaluations[env_params] = evaluation
+                if n_episodes >= NUM_TO_RUN or evaluation.ci_half_width() < TARGET_HALF_WIDTH:
+                    del targets[env_params]
+                else:
+                    targets[env_params] = min(2 * n_episodes, NUM_TO_RUN)
+    return evaluations
+
+
+def plot_winrates(directory, show_std=False, n_workers: Optional[int] = None,
+                  show_sem=False):
+    """
+    Plots the mean reward of every model in directory, see evaluate_models. show_std adds
+    error bars of one standard deviation of the episode rewards, show_sem of one standard
+    error of the mean reward instead
+    """
+    if show_std and show_sem:
+        raise ValueError("Error bars show either the standard deviation or standard error")
+    evaluations = evaluate_models(directory, n_workers)
+    fig, axs = plt.subplots(len(evaluations))
+    for i, (env_params, evaluation) in enumerate(sorted(evaluations.items())):
+        names: List[str] = evaluation.names
+        winrates = list(evaluation.mean_rewards().values())
+        errors = None
+        if show_std:
+            errors = list(evaluation.std_rewards().values())
+        elif show_sem:
+            errors = list(evaluation.std_errors().values())
 
         names_pos = [i for i, _ in enumerate(names)]
 
-        axis = axs[i] if len(combos) > 1 else axs
-        axis.bar(names_pos, winrates, yerr=stds if show_std else None)
+        axis = axs[i] if len(evaluations) > 1 else axs
+        axis.bar(names_pos, winrates, yerr=errors)
         axis.set_xticks(names_pos)
         axis.set_xticklabels(names)
         axis.set_ylabel("Mean reward")
+        axis.set_title(", ".join(f"{param}={value}"
+                                 for param, value in zip(ENV_PARAMS, env_params)))
 
     fig.tight_layout()
     plt.show()